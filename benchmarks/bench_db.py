@@ -0,0 +1,114 @@
+# benchmarks/bench_db.py
+#
+# Порівняння старого доступу до БД (новий sqlite3.connect на кожен виклик, прямо в циклі подій)
+# з Database (одне з'єднання у WAL, запити в окремому потоці).
+# Навантаження повторює набір запитів одного натискання "case:bronze".
+#
+#   python -m benchmarks.bench_db [--users 10000] [--updates 2000] [--concurrency 32]
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from db import Database
+
+SCHEMA = (
+    "CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT, coins INTEGER DEFAULT 0, stars INTEGER DEFAULT 0, "
+    "total_coins_earned INTEGER DEFAULT 0, rank_level INTEGER DEFAULT 1)",
+    "CREATE TABLE inventory (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, item_id TEXT)",
+    "CREATE TABLE quests (user_id INTEGER, quest_id TEXT, progress INTEGER DEFAULT 0, last_reset_date TEXT, PRIMARY KEY (user_id, quest_id))",
+)
+
+# (sql, чи це запис) — послідовність запитів cb_open_case + cb_cases_menu
+def open_case_queries(user_id):
+    return [
+        ("SELECT * FROM users WHERE user_id = ?", (user_id,)),
+        ("SELECT * FROM users WHERE user_id = ?", (user_id,)),
+        ("UPDATE users SET coins = coins - 500 WHERE user_id = ?", (user_id,)),
+        ("SELECT * FROM users WHERE user_id = ?", (user_id,)),
+        ("SELECT * FROM quests WHERE user_id = ? AND quest_id = 'open_case'", (user_id,)),
+        ("INSERT OR REPLACE INTO quests (user_id, quest_id, progress, last_reset_date) VALUES (?, 'open_case', 1, '2026-01-01')", (user_id,)),
+        ("SELECT * FROM users WHERE user_id = ?", (user_id,)),
+        ("UPDATE users SET coins = coins + 300, total_coins_earned = total_coins_earned + 300 WHERE user_id = ?", (user_id,)),
+        ("SELECT * FROM users WHERE user_id = ?", (user_id,)),
+        ("SELECT * FROM users WHERE user_id = ?", (user_id,)),
+        ("SELECT item_id, COUNT(item_id) FROM inventory WHERE user_id = ? GROUP BY item_id", (user_id,)),
+    ]
+
+
+def seed(path, users):
+    with sqlite3.connect(path) as conn:
+        for stmt in SCHEMA: conn.execute(stmt)
+        conn.executemany("INSERT INTO users (user_id, username, coins) VALUES (?, ?, 1000000)", ((i, f"u{i}") for i in range(1, users + 1)))
+        conn.executemany("INSERT INTO inventory (user_id, item_id) VALUES (?, ?)", ((random.randint(1, users), f"c{random.randint(1, 20)}") for _ in range(users * 5)))
+
+
+async def old_update(path, user_id):
+    for sql, params in open_case_queries(user_id):
+        with sqlite3.connect(path) as conn:
+            conn.execute(sql, params).fetchall()
+
+
+async def new_update(db, user_id):
+    for sql, params in open_case_queries(user_id):
+        if sql.startswith("SELECT"): await db.fetchall(sql, params)
+        else: await db.execute(sql, params)
+
+
+async def measure(update_fn, users, updates, concurrency):
+    lags, stop = [], asyncio.Event()
+
+    async def ticker():
+        interval = 0.001
+        while not stop.is_set():
+            t = time.perf_counter(); await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - t - interval)
+
+    queue = asyncio.Queue()
+    for _ in range(updates): queue.put_nowait(random.randint(1, users))
+
+    async def worker():
+        while not queue.empty():
+            await update_fn(queue.get_nowait())
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set(); await tick
+    lags.sort()
+    return {
+        "updates/s": updates / elapsed,
+        "stall p50 ms": statistics.median(lags) * 1000 if lags else 0.0,
+        "stall p99 ms": lags[int(len(lags) * 0.99) - 1] * 1000 if lags else 0.0,
+        "stall max ms": lags[-1] * 1000 if lags else 0.0,
+        "ticks": len(lags),
+    }
+
+
+def report(name, result):
+    print(f"{name:<28}" + "  ".join(f"{k}={v:,.1f}" for k, v in result.items()))
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path, args.users)
+        report("per-call connect (before)", await measure(lambda uid: old_update(path, uid), args.users, args.updates, args.concurrency))
+        db = Database(path)
+        await db.connect()
+        report("Database executor (after)", await measure(lambda uid: new_update(db, uid), args.users, args.updates, args.concurrency))
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(run(parser.parse_args()))
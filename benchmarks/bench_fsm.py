@@ -0,0 +1,92 @@
+# benchmarks/bench_fsm.py
+#
+# Затримка FSM-сховищ: MemoryStorage aiogram проти SQLiteStorage (кеш + пакетний запис)
+# і проти SQLiteStorage з комітом на кожен перехід (flush після кожного запису).
+# Перехід = set_state + set_data, як у хендлерах ставок і обміну.
+#
+#   python -m benchmarks.bench_fsm [--keys 10000] [--transitions 20000] [--concurrency 100]
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from db import Database
+from fsm_storage import SQLiteStorage
+
+
+def key(user_id):
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+def summary(samples):
+    cuts = statistics.quantiles(samples, n=100)
+    return f"p50 {cuts[49] * 1e6:7.1f} µs   p99 {cuts[98] * 1e6:8.1f} µs"
+
+
+async def measure(storage, args, flush_each=False):
+    users = [random.randint(1, args.keys) for _ in range(args.transitions)]
+    reads, writes = [], []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def transition(user_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await storage.get_state(key(user_id))
+            reads.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await storage.set_state(key(user_id), "CasinoStates:get_bet_dice")
+            await storage.set_data(key(user_id), {"type": "c2s", "amount": user_id})
+            if flush_each: await storage.flush()
+            writes.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(transition(user_id) for user_id in users))
+    if isinstance(storage, SQLiteStorage): await storage.flush()
+    elapsed = time.perf_counter() - started
+    return elapsed, reads, writes
+
+
+async def run(args):
+    os.chdir(tempfile.mkdtemp())
+    db = Database("fsm_bench.db")
+    await db.connect()
+    await db.execute("CREATE TABLE fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT, expires REAL NOT NULL) WITHOUT ROWID")
+    print(f"keys={args.keys} transitions={args.transitions} concurrency={args.concurrency}")
+
+    variants = [("memory", MemoryStorage(), False), ("sqlite batched", SQLiteStorage(db), False), ("sqlite commit each", SQLiteStorage(db), True)]
+    for name, storage, flush_each in variants:
+        if isinstance(storage, SQLiteStorage): storage.start()
+        # Перший прохід застає порожній кеш (ключі читаються з бази), другий — теплий
+        for pass_name in ("cold", "warm"):
+            flushes = getattr(storage, "flushes", 0)
+            elapsed, reads, writes = await measure(storage, args, flush_each)
+            commits = f"   commits {storage.flushes - flushes:,}" if isinstance(storage, SQLiteStorage) else ""
+            print(f"  {name + ' ' + pass_name:<24} {args.transitions / elapsed:>9,.0f} transitions/s{commits}")
+            print(f"      read   {summary(reads)}")
+            print(f"      write  {summary(writes)}")
+        await storage.close()
+
+    # Холодне читання після "рестарту": кеш порожній, стан читається з бази
+    storage = SQLiteStorage(db)
+    samples = []
+    for user_id in random.sample(range(1, args.keys + 1), min(args.keys, 2000)):
+        started = time.perf_counter()
+        await storage.get_state(key(user_id))
+        samples.append(time.perf_counter() - started)
+    print(f"  sqlite after restart     read {summary(samples)}")
+    await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--transitions", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
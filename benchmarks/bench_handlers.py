@@ -0,0 +1,200 @@
+# benchmarks/bench_handlers.py
+#
+# Навантажувальний прогін реальних сценаріїв через dp.feed_update. Bot API замінено
+# на FakeSession (у процесі, з налаштовуваною затримкою), БД — справжня SQLite з
+# засіяними користувачами. Популяції засіваються по зростанню в одну й ту саму БД.
+#
+# Для кожної популяції й сценарію: оновлень/с, p50/p95/p99 кожного кроку,
+# SQL-запитів і викликів API на оновлення. Сповіщення, що йдуть через outbox,
+# у виклики API кроку не потрапляють — вони відправляються у фоні.
+#
+# feed_update повертається одразу, якщо оновлення стало в чергу користувача (lanes.py)
+# або відкинуте, тож час кроку міряється до завершення самого хендлера, а фаза
+# закінчується, коли розібрано всі черги. Оновлень/с — лише оброблені; поставлені
+# в чергу, відкинуті як дублікат / переповнення черги й застарілі — окремо. Так само
+# окремо — відкинуті захистом від флуду (ratelimit.py): вони не доходять до смуги
+# і в оброблені не потрапляють.
+#
+#   python -m benchmarks.bench_handlers [--populations 1000,100000,1000000] [--updates 2000]
+#                                       [--concurrency 50] [--latency 0.0] [--flows profile,dice] [--keep-delays]
+#                                       [--batch-size 64]   (1 — окремий коміт на кожен запис)
+#                                       [--no-send-limit]
+#
+# Відповіді хендлерів проходять через ліміт надсилань бота (BotRateLimiter, BOT_MESSAGE_RATE),
+# як у бою, тож пропускна здатність обмежена ним. --no-send-limit знімає ліміт, щоб
+# виміряти сам бот; у заголовку прогону видно, чи ліміт діяв.
+
+import argparse
+import asyncio
+import contextvars
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+from benchmarks.fake_telegram import FakeSession, FakeTelegram, callback_update, message_update
+
+NEW_USERS_FROM = 10 ** 9  # id для /start з рефералом — поза засіяними популяціями
+LANE_COUNTERS = ("queued", "shed_duplicate", "shed_overflow", "shed_stale")
+STEP = contextvars.ContextVar("bench_step")  # (крок, початок) — задається перед feed_update
+
+# сценарій -> кроки (назва кроку, функція (update_id, user_id) -> сире оновлення)
+FLOWS = {
+    "start_ref": [("/start <ref>", None)],  # будується окремо: потрібен новий користувач
+    "profile": [("menu:profile", lambda uid, user: callback_update(uid, user, "menu:profile"))],
+    "inventory": [("menu:inventory", lambda uid, user: callback_update(uid, user, "menu:inventory"))],
+    "case_bronze": [("case:bronze", lambda uid, user: callback_update(uid, user, "case:bronze"))],
+    "dice": [("game:dice", lambda uid, user: callback_update(uid, user, "game:dice")),
+             ("dice bet", lambda uid, user: message_update(uid, user, "100"))],
+    "slots": [("game:slots", lambda uid, user: callback_update(uid, user, "game:slots")),
+              ("slots bet", lambda uid, user: message_update(uid, user, "100"))],
+    "top_coins": [("top:coins", lambda uid, user: callback_update(uid, user, "top:coins"))],
+    "craft": [("craft:rare_card", lambda uid, user: callback_update(uid, user, "craft:rare_card"))],
+    "exchange": [("exchange:c2s", lambda uid, user: callback_update(uid, user, "exchange:c2s")),
+                 ("exchange amount", lambda uid, user: message_update(uid, user, "1"))],
+}
+
+
+def _seed(conn, first, last):
+    rows = [(user_id, f"user{user_id}", random.randint(10 ** 8, 10 ** 9), 10 ** 6, random.randint(0, 10 ** 8)) for user_id in range(first, last + 1)]
+    conn.executemany("INSERT INTO users (user_id, username, coins, stars, total_coins_earned) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO inventory (user_id, item_id, count) VALUES (?, 'fragment1', 1000000)", ((row[0],) for row in rows))
+
+
+def percentiles(samples):
+    if len(samples) < 2: return [samples[0] if samples else 0.0] * 3
+    cuts = statistics.quantiles(samples, n=100)
+    return cuts[49], cuts[94], cuts[98]
+
+
+class Bench:
+    def __init__(self, main, fake, args):
+        self.main, self.fake, self.args = main, fake, args
+        self.statements = 0
+        self.update_ids = iter(range(1, 10 ** 12))
+        self.new_users = iter(range(NEW_USERS_FROM, 2 * NEW_USERS_FROM))
+        self.population = 0
+        self.latencies = None
+        run = main.lanes.run
+
+        # Хендлер виконується в смузі користувача — там і засікаємо кінець кроку
+        async def timed_run(key, job, tag=None, ttl=None):
+            step, started = STEP.get()
+            async def timed_job():
+                result = await job()
+                self.latencies[step].append(time.perf_counter() - started)
+                return result
+            return await run(key, timed_job, tag, ttl)
+        main.lanes.run = timed_run
+
+    def _trace(self, statement):
+        self.statements += 1
+
+    async def grow(self, population):
+        started = time.perf_counter()
+        for first in range(self.population + 1, population + 1, 50000):
+            await self.main.db.transaction(_seed, first, min(first + 49999, population))
+        self.population = population
+        self.main.user_cache.clear()
+        await self.main.rebuild_leaderboards()
+        print(f"\npopulation={population:,} (seeded in {time.perf_counter() - started:.1f} s)")
+
+    def _session(self, flow, user_id):
+        if flow == "start_ref":
+            return [("/start <ref>", message_update(next(self.update_ids), next(self.new_users), f"/start {user_id}"))]
+        return [(step, build(next(self.update_ids), user_id)) for step, build in FLOWS[flow]]
+
+    async def run_phase(self, flows):
+        """Проганяє сесії (сценарій для одного користувача) з обмеженою паралельністю."""
+        from aiogram.types import Update
+        main, bot = self.main, self.main.bot
+        users = random.sample(range(1, self.population + 1), min(self.population, self.args.updates))
+        sessions, total = [], 0
+        while total < self.args.updates:
+            flow = flows[len(sessions) % len(flows)]
+            steps = [(step, Update.model_validate(raw, context={"bot": bot})) for step, raw in self._session(flow, users[len(sessions) % len(users)])]
+            sessions.append(steps); total += len(steps)
+
+        latencies = self.latencies = defaultdict(list)
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def play(steps):
+            async with semaphore:
+                for step, update in steps:
+                    STEP.set((step, time.perf_counter()))
+                    await main.dp.feed_update(bot, update)
+
+        statements, calls = self.statements, sum(self.fake.calls.values())
+        lanes_before, flood_before = main.lanes.stats(), sum(main.flood_guard.dropped_by_class.values())
+        started = time.perf_counter()
+        await asyncio.gather(*(play(steps) for steps in sessions))
+        await main.lanes.join()
+        elapsed = time.perf_counter() - started
+        lanes_after = main.lanes.stats()
+        handled = sum(len(samples) for samples in latencies.values())
+        return {"rate": handled / elapsed, "handled": handled, "total": total,
+                "flood_dropped": sum(main.flood_guard.dropped_by_class.values()) - flood_before,
+                "sql": (self.statements - statements) / max(handled, 1), "api": (sum(self.fake.calls.values()) - calls) / max(handled, 1),
+                "lanes": {name: lanes_after[name] - lanes_before[name] for name in LANE_COUNTERS}, "latencies": latencies}
+
+    def report(self, name, result):
+        lanes = "   ".join(f"{counter} {value}" for counter, value in result["lanes"].items())
+        print(f"  {name:<12} {result['rate']:>9,.0f} upd/s   handled {result['handled']}/{result['total']}   flood_dropped {result['flood_dropped']}   {lanes}"
+              f"   sql/upd {result['sql']:>5.1f}   api/upd {result['api']:>4.1f}")
+        if name == "mixed": return
+        for step, samples in result["latencies"].items():
+            p50, p95, p99 = (value * 1000 for value in percentiles(samples))
+            print(f"      {step:<18} n={len(samples):<6} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms   p99 {p99:7.2f} ms")
+
+
+async def run(args):
+    os.environ.update(BOT_TOKEN="42:BENCH")
+    for name in ("SPONSOR_CHANNEL", "TELEGRAM_API_SERVER", "ADMIN_ID"): os.environ.pop(name, None)
+    if args.no_send_limit: os.environ["BOT_MESSAGE_RATE"] = "1000000"
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+
+    fake = FakeTelegram(latency=args.latency)
+    main.bot.session = FakeSession(fake)
+    if not args.keep_delays:
+        # Паузи "анімацій" у казино (1-3 с) інакше затулять усе інше. Лише в хендлерах кроків:
+        # фонові цикли (звірка лічильників, стеження за каталогом) без пауз крутилися б безперервно
+        real_sleep = asyncio.sleep
+        main.asyncio = types.SimpleNamespace(**{name: getattr(asyncio, name) for name in dir(asyncio) if not name.startswith("__")})
+        main.asyncio.sleep = lambda delay, result=None: real_sleep(0 if STEP.get(None) else delay, result)
+    main.db.batch_size = args.batch_size
+    main.setup_dispatcher()
+    await main.startup()
+    bench = Bench(main, fake, args)
+    await main.db.transaction(lambda conn: conn.set_trace_callback(bench._trace))
+
+    flows = args.flows.split(",") if args.flows else list(FLOWS)
+    print(f"updates/phase={args.updates} concurrency={args.concurrency} api latency={args.latency * 1000:.0f} ms delays={'on' if args.keep_delays else 'off'} batch={args.batch_size} "
+          f"send limit={'lifted (--no-send-limit)' if args.no_send_limit else format(main.BOT_MESSAGE_RATE, 'g') + ' msg/s'}")
+    for population in sorted(int(value) for value in args.populations.split(",")):
+        await bench.grow(population)
+        for flow in flows: bench.report(flow, await bench.run_phase([flow]))
+        bench.report("mixed", await bench.run_phase(flows))
+
+    stats = main.db.batch_stats()
+    print(f"\ngroup commit: {stats['batches']:,} commits for {stats['operations']:,} writes, avg batch {stats['size_avg']:.1f}, max {stats['size_max']}, "
+          f"commit p50 {stats['commit_p50'] * 1000:.2f} ms, p95 {stats['commit_p95'] * 1000:.2f} ms")
+    await main.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--populations", default="1000,100000")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--flows", default="")
+    parser.add_argument("--keep-delays", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--no-send-limit", action="store_true")
+    asyncio.run(run(parser.parse_args()))
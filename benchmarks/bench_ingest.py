@@ -0,0 +1,82 @@
+# benchmarks/bench_ingest.py
+#
+# Стала пропускна здатність прийому оновлень: long polling проти webhook.
+# Бот працює проти локального FakeTelegram, кожне оновлення — натискання menu:profile.
+#
+#   python -m benchmarks.bench_ingest [--updates 5000] [--users 500] [--latency 0.0]
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_telegram import FakeTelegram, callback_update, free_port
+
+
+async def run(args):
+    api_port, webhook_port = free_port(), free_port()
+    os.environ.update(BOT_TOKEN="42:BENCH", TELEGRAM_API_SERVER=f"http://127.0.0.1:{api_port}")
+    os.environ.pop("SPONSOR_CHANNEL", None)
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+    from webhook import WebhookServer
+
+    fake = FakeTelegram(latency=args.latency)
+    await fake.start(port=api_port)
+    main.setup_dispatcher()
+    await main.startup()
+    for user_id in range(1, args.users + 1): await main.add_user(user_id, f"user{user_id}")
+
+    update_ids = iter(range(1, 10 ** 9))
+    def batch(): return [callback_update(next(update_ids), 1 + i % args.users, "menu:profile") for i in range(args.updates)]
+    results = {}
+
+    # --- long polling ---
+    edits = fake.calls["editMessageText"]
+    fake.push_updates(batch())
+    polling = asyncio.create_task(main.dp.start_polling(main.bot, handle_signals=False, polling_timeout=1))
+    started = time.perf_counter()
+    await fake.wait_for("editMessageText", edits + args.updates)
+    results["polling"] = args.updates / (time.perf_counter() - started)
+    await main.dp.stop_polling(); await polling
+
+    # --- webhook ---
+    server = WebhookServer(main.dp, main.bot, "bench-secret")
+    await server.start("127.0.0.1", webhook_port)
+    edits = fake.calls["editMessageText"]
+    url = f"http://127.0.0.1:{webhook_port}{server.path}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": "bench-secret"}
+    updates = batch()
+    from aiohttp import ClientSession, TCPConnector
+    async with ClientSession(connector=TCPConnector(limit=args.connections)) as session:
+        async def deliver(update):
+            while True:
+                async with session.post(url, json=update, headers=headers) as response:
+                    if response.status == 200: return
+                await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await asyncio.gather(*(deliver(update) for update in updates))
+        await fake.wait_for("editMessageText", edits + args.updates)
+        results["webhook"] = args.updates / (time.perf_counter() - started)
+        async with session.post(url, json=updates[0], headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+            assert response.status == 401, response.status
+    await server.stop()
+
+    print(f"updates={args.updates} users={args.users} api latency={args.latency * 1000:.0f} ms")
+    for mode, rate in results.items(): print(f"  {mode:<8} {rate:,.0f} updates/s")
+    print(f"  webhook 503 responses (backpressure): {server.rejected}")
+    await main.shutdown()
+    await main.bot.session.close()
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--connections", type=int, default=40)
+    asyncio.run(run(parser.parse_args()))
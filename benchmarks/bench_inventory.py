@@ -0,0 +1,55 @@
+# benchmarks/bench_inventory.py
+#
+# Затримка читання інвентарю залежно від кількості предметів у користувача:
+# старий формат (рядок на копію, GROUP BY без індексу) проти лічильників (user_id, item_id) -> count.
+#
+#   python -m benchmarks.bench_inventory [--other-users 5000] [--reads 200]
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+ITEM_IDS = [f"c{i}" for i in range(1, 21)] + ["key1", "fragment1", "exp_sphere"]
+OWNED = (10, 100, 1000, 10000, 100000)
+
+
+def build(path, other_users, owned):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE legacy (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, item_id TEXT)")
+    conn.execute("CREATE TABLE inventory (user_id INTEGER NOT NULL, item_id TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (user_id, item_id)) WITHOUT ROWID")
+    # фон: інші гравці по 20 предметів
+    background = [(random.randint(2, other_users + 1), random.choice(ITEM_IDS)) for _ in range(other_users * 20)]
+    target = [(1, random.choice(ITEM_IDS)) for _ in range(owned)]
+    conn.executemany("INSERT INTO legacy (user_id, item_id) VALUES (?, ?)", background + target)
+    conn.execute("INSERT INTO inventory SELECT user_id, item_id, COUNT(*) FROM legacy GROUP BY user_id, item_id")
+    conn.commit()
+    return conn
+
+
+def timed(conn, sql, reads):
+    samples = []
+    for _ in range(reads):
+        t = time.perf_counter(); conn.execute(sql, (1,)).fetchall(); samples.append(time.perf_counter() - t)
+    return statistics.median(samples) * 1e6
+
+
+def main(args):
+    print(f"{'owned items':>12} {'legacy µs':>12} {'counted µs':>12} {'speedup':>9}")
+    for owned in OWNED:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = build(os.path.join(tmp, "bench.db"), args.other_users, owned)
+            legacy = timed(conn, "SELECT item_id, COUNT(item_id) FROM legacy WHERE user_id = ? GROUP BY item_id", args.reads)
+            counted = timed(conn, "SELECT item_id, count FROM inventory WHERE user_id = ?", args.reads)
+            conn.close()
+        print(f"{owned:>12,} {legacy:>12,.1f} {counted:>12,.1f} {legacy / counted:>8,.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--other-users", type=int, default=5000)
+    parser.add_argument("--reads", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+# benchmarks/bench_routing.py
+#
+# Накладні витрати маршрутизації callback-кнопок залежно від кількості хендлерів:
+# звичайний Router з F.data == ... / F.data.startswith(...) (фільтри перевіряються по черзі)
+# проти CallbackRouter (один словник). Хендлери порожні, Bot API не викликається —
+# вимірюється тільки dp.feed_update. Натискається перша, середня й остання кнопка.
+#
+#   python -m benchmarks.bench_routing [--handlers 10,40,160] [--updates 2000]
+
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import Update
+
+from benchmarks.fake_telegram import callback_update
+from callback_router import CallbackRouter
+
+
+async def noop(callback):
+    pass
+
+
+async def noop_with_arg(callback, item_id: int):
+    pass
+
+
+def filter_dispatcher(count):
+    router = Router()
+    for index in range(count):
+        # Кожен четвертий — з аргументом, як case:<id> чи duel_card:<id>
+        if index % 4 == 3: router.callback_query.register(noop, F.data.startswith(f"route{index}:"))
+        else: router.callback_query.register(noop, F.data == f"route{index}")
+    dp = Dispatcher(); dp.include_router(router)
+    return dp
+
+
+def table_dispatcher(count):
+    router = CallbackRouter()
+    for index in range(count):
+        if index % 4 == 3: router.route(f"route{index}", item_id=int)(noop_with_arg)
+        else: router.route(f"route{index}")(noop)
+    dp = Dispatcher(); dp.include_router(router)
+    return dp
+
+
+def callback_data(index):
+    return f"route{index}:7" if index % 4 == 3 else f"route{index}"
+
+
+async def measure(dp, bot, updates):
+    started = time.perf_counter()
+    for update in updates: await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def run(args):
+    bot = Bot("42:BENCH")
+    print(f"updates per cell={args.updates}")
+    print(f"  {'handlers':>8}  {'button':>6}  {'filters':>10}  {'table':>10}")
+    for count in (int(value) for value in args.handlers.split(",")):
+        dispatchers = {"filters": filter_dispatcher(count), "table": table_dispatcher(count)}
+        for position, index in (("first", 0), ("middle", count // 2), ("last", count - 1)):
+            updates = [Update.model_validate(callback_update(update_id, 1, callback_data(index)), context={"bot": bot}) for update_id in range(args.updates)]
+            results = {name: await measure(dp, bot, updates) for name, dp in dispatchers.items()}
+            print(f"  {count:>8}  {position:>6}  {results['filters'] * 1e6:>7.1f} µs  {results['table'] * 1e6:>7.1f} µs")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--handlers", default="10,40,160")
+    parser.add_argument("--updates", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,68 @@
+# benchmarks/bench_sharding.py
+#
+# Пропускна здатність бота цілком (окремі процеси, long polling, справжній HTTP) при
+# WORKERS=1, 2, 4...: FakeTelegram слухає локальний порт, main.py запускається з
+# TELEGRAM_API_SERVER на нього. Кожне оновлення — натискання "Профиль" від одного з
+# users користувачів, тож відповідь — рівно один editMessageText.
+#
+# Масштабування обмежене кількістю ядер: на машині з одним ядром процеси лише ділять його.
+#
+#   python -m benchmarks.bench_sharding [--workers 1,2,4] [--users 2000] [--updates 5000] [--latency 0.0]
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_telegram import FakeTelegram, callback_update, message_update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run_bot(fake, workers, args):
+    workdir = tempfile.mkdtemp()
+    # FakeTelegram лімітів не має, тож ліміт надсилань бота (BOT_MESSAGE_RATE) знято, інакше міряли б його
+    env = {**os.environ, "BOT_TOKEN": "42:BENCH", "TELEGRAM_API_SERVER": fake.base_url, "WORKERS": str(workers), "BOT_MESSAGE_RATE": "1000000"}
+    for name in ("SPONSOR_CHANNEL", "ADMIN_ID", "BOT_MODE", "BOT_ROLE", "WORKER_INDEX", "METRICS_PORT"): env.pop(name, None)
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "main.py"), cwd=workdir, env=env,
+                                                   stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    update_ids = iter(range(1, 10 ** 12))
+    try:
+        # Прогрів: /start створює користувачів і піднімає всі процеси
+        sent = fake.calls["sendMessage"]
+        fake.push_updates(message_update(next(update_ids), user_id, "/start") for user_id in range(1, args.users + 1))
+        await fake.wait_for("sendMessage", sent + args.users)
+
+        edits = fake.calls["editMessageText"]
+        started = time.perf_counter()
+        fake.push_updates(callback_update(next(update_ids), 1 + index % args.users, "menu:profile") for index in range(args.updates))
+        await fake.wait_for("editMessageText", edits + args.updates)
+        elapsed = time.perf_counter() - started
+    finally:
+        process.send_signal(signal.SIGINT)
+        await process.wait()
+    return args.updates / elapsed
+
+
+async def run(args):
+    fake = FakeTelegram(latency=args.latency)
+    await fake.start()
+    print(f"users={args.users} updates={args.updates} api latency={args.latency * 1000:.0f} ms cpus={os.cpu_count()}")
+    baseline = None
+    for workers in (int(value) for value in args.workers.split(",")):
+        rate = await run_bot(fake, workers, args)
+        baseline = baseline or rate
+        print(f"  workers={workers:<3} {rate:>8,.0f} upd/s   x{rate / baseline:.2f}")
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,138 @@
+# benchmarks/fake_telegram.py
+#
+# Локальний фейковий Bot API сервер для навантажувальних тестів.
+# Бот підключається до нього через TELEGRAM_API_SERVER=http://127.0.0.1:<port>
+# або, без HTTP, через FakeSession прямо в процесі.
+
+import asyncio
+import itertools
+import json
+import socket
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+from aiogram.client.session.base import BaseSession
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def user_dict(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def message_update(update_id, user_id, text, message_id=1):
+    return {"update_id": update_id, "message": {"message_id": message_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": user_dict(user_id), "text": text}}
+
+
+def callback_update(update_id, user_id, data, message_id=None):
+    # Кожне натискання — на своєму повідомленні: однакові натискання на одному повідомленні бот відкидає як дублікати
+    return {"update_id": update_id, "callback_query": {"id": str(update_id), "from": user_dict(user_id), "chat_instance": "bench", "data": data,
+            "message": {"message_id": message_id or update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}, "from": BOT_USER, "text": "menu"}}}
+
+
+class FakeTelegram:
+    """Відповідає на методи Bot API правдоподібними об'єктами і рахує виклики.
+
+    latency — штучна затримка кожної відповіді, секунди.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.latencies = defaultdict(list)
+        self.updates = asyncio.Queue()
+        self._message_ids = itertools.count(1000)
+        self._runner = None
+        self.base_url = None
+
+    def push_updates(self, updates):
+        for update in updates: self.updates.put_nowait(update)
+
+    async def wait_for(self, method, count, timeout=600):
+        deadline = time.monotonic() + timeout
+        while self.calls[method] < count:
+            if time.monotonic() > deadline: raise TimeoutError(f"{method}: {self.calls[method]}/{count}")
+            await asyncio.sleep(0.005)
+
+    def _message(self, chat_id, **extra):
+        return {"message_id": next(self._message_ids), "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, **extra}
+
+    def _result(self, method, params):
+        chat_id = int(params.get("chat_id") or 1) if str(params.get("chat_id", "1")).lstrip("-").isdigit() else 1
+        if method == "getMe": return BOT_USER
+        if method == "getChatMember": return {"status": "member", "user": user_dict(int(params["user_id"]))}
+        if method == "getChat":
+            return {"id": -100, "type": "channel", "title": "Sponsor", "username": "sponsor", "accent_color_id": 0, "max_reaction_count": 11,
+                    "accepted_gift_types": {"unlimited_gifts": True, "limited_gifts": True, "unique_gifts": True, "premium_subscription": True, "gifts_from_channels": True}}
+        if method in ("sendMessage", "editMessageText"): return self._message(chat_id, text=params.get("text", ""))
+        if method == "sendDice": return self._message(chat_id, dice={"emoji": "🎲", "value": 1 + next(self._message_ids) % 6})
+        if method == "copyMessage": return {"message_id": next(self._message_ids)}
+        if method == "forwardMessage": return self._message(chat_id, text="forwarded")
+        return True
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else {}
+        started = time.perf_counter()
+        if method == "getUpdates":
+            batch = await self._get_updates(int(params.get("timeout") or 0))
+            self.calls[method] += 1
+            return web.json_response({"ok": True, "result": batch})
+        if self.latency: await asyncio.sleep(self.latency)
+        self.calls[method] += 1
+        self.latencies[method].append(time.perf_counter() - started)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def _get_updates(self, timeout):
+        batch = []
+        try:
+            if self.updates.empty(): batch.append(await asyncio.wait_for(self.updates.get(), min(timeout, 1) or 0.05))
+        except asyncio.TimeoutError: return batch
+        while not self.updates.empty() and len(batch) < 100: batch.append(self.updates.get_nowait())
+        return batch
+
+    async def start(self, host="127.0.0.1", port=None):
+        port = port or free_port()
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner: await self._runner.cleanup()
+
+
+class FakeSession(BaseSession):
+    """Сесія aiogram, яка відповідає через FakeTelegram без HTTP: вимірюється тільки сам бот.
+
+    bot.session = FakeSession(fake)
+    """
+
+    def __init__(self, fake):
+        super().__init__()
+        self.fake = fake
+
+    async def make_request(self, bot, method, timeout=None):
+        name, started = method.__api_method__, time.perf_counter()
+        if self.fake.latency: await asyncio.sleep(self.fake.latency)
+        self.fake.calls[name] += 1
+        self.fake.latencies[name].append(time.perf_counter() - started)
+        result = self.fake._result(name, method.model_dump(exclude_none=True))
+        return self.check_response(bot=bot, method=method, status_code=200, content=json.dumps({"ok": True, "result": result})).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
@@ -0,0 +1,308 @@
+# benchmarks/simulate_economy.py
+#
+# Офлайн-симулятор економіки на NumPy. Правила виплат беруться з economy.py, кейси,
+# квести й Battle Pass — з каталогу (за замовчуванням catalog.json бота), тож рахується
+# рівно те, що зараз працює в бою.
+#
+# Ігри й кейси. Розклад виплат будується викликом тих самих dice_payout / slots_payout /
+# duel_payout на всіх можливих результатах. Далі на plays розіграшів тягнеться один
+# мультиноміальний розподіл кількостей результатів, а суми з діапазонів ("amount": [min, max])
+# добираються пачками по chunk. Звіт: очікувана віддача (EV) з похибкою 2σ/√n і точним
+# значенням для звірки, σ одного розіграшу, перевага бота (1 - RTP) і скільки монет / зірок
+# один розіграш у середньому додає в економіку.
+#
+# Предмети оцінюються в монетах через те, на що їх можна обміняти: карта — середній виграш
+# у дуелі, фрагмент — частка скрафченої карти, ключ — кейс, який він відкриває. Виграні
+# зірки — за ціною продажу, ціна кейса в зірках — за ціною купівлі. RTP > 1 — арбітраж.
+#
+# Популяція. players гравців протягом days днів (вектори по гравцях, цикл по днях): щоденний
+# бонус із серією, казино й кейси в межах балансу, квести, Battle Pass, крафт і дуелі
+# отриманими картами. Звіт — грошова маса, зірки, медіана балансу і звідки беруться монети.
+# Рефералів і обміну зірок у моделі немає.
+#
+#   python -m benchmarks.simulate_economy [--plays 100000000] [--chunk 4000000] [--players 100000] [--days 30]
+#                                         [--activity 0.7] [--casino-plays 5] [--bet 50] [--case bronze]
+#                                         [--case-opens 3] [--premium 0.05] [--duel-share 1.0] [--seed 1] [--catalog PATH]
+
+import argparse
+import os
+import time
+from collections import defaultdict
+from itertools import product
+
+import numpy as np
+
+from catalog import load_catalog
+from economy import (START_COINS, MIN_BET, STAR_SELL_PRICE, STAR_BUY_PRICE, DAILY_BONUS_CYCLE, DICE_FACES, SLOT_SYMBOLS,
+                     CRAFT_FRAGMENTS, CRAFT_RARITY, daily_bonus_streak, daily_bonus_reward, dice_payout, slots_payout, duel_payout)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ----- Розклади виплат -----
+# Результат розіграшу: (ймовірність, валюта, min, max) — валюта "coins", "stars" або id предмета,
+# сума рівномірна в [min, max]. Для казино сума — множник ставки.
+
+def grouped(values):
+    """Рівноймовірні значення -> [(ймовірність, "coins", значення, значення)]."""
+    counts = defaultdict(int)
+    for value in values: counts[value] += 1
+    return [(count / len(values), "coins", value, value) for value, count in sorted(counts.items())]
+
+
+def dice_table():
+    return np.array([dice_payout(1, user_roll, bot_roll) for user_roll in DICE_FACES for bot_roll in DICE_FACES], dtype=np.float64)
+
+
+def slots_table():
+    return np.array([slots_payout(1, reels) for reels in product(SLOT_SYMBOLS, repeat=3)], dtype=np.float64)
+
+
+def duel_table(cat):
+    """duel[i, j] — виграш картою i проти карти бота j (обидві з cat.items_by_type['card'])."""
+    powers = [cat.items[card_id]['power'] for card_id in cat.items_by_type['card']]
+    return np.array([[duel_payout(user_power, bot_power) for bot_power in powers] for user_power in powers], dtype=np.float64)
+
+
+def case_outcomes(cat, case_id):
+    prizes, cum_weights = cat.case_prize_tables[case_id]
+    outcomes = []
+    for prize, chance in zip(prizes, np.diff(cum_weights, prepend=0) / cum_weights[-1]):
+        if prize['type'] == 'item': outcomes.append((chance, prize['item_id'], 1, 1))
+        else:
+            low, high = (prize['amount'], prize['amount']) if isinstance(prize['amount'], int) else prize['amount']
+            outcomes.append((chance, prize['type'], low, high))
+    return outcomes
+
+
+def item_values(cat, duel):
+    """Ціна предметів у монетах через те, на що їх можна обміняти; решта — 0."""
+    values = {item_id: 0.0 for item_id in cat.items}
+    values.update(zip(cat.items_by_type['card'], duel.mean(axis=1)))
+    craft = cat.cards_by_rarity.get(CRAFT_RARITY)
+    if craft: values['fragment1'] = np.mean([values[card_id] for card_id in craft]) / CRAFT_FRAGMENTS
+    # Предмети-валюти кейсів (ключі) коштують стільки, скільки дає кейс на одиницю ціни
+    for case_id, info in cat.cases.items():
+        if info['currency'] in values: values[info['currency']] = exact_ev(case_outcomes(cat, case_id), values) / info['cost']
+    return values
+
+
+def unit_value(currency, values):
+    return 1.0 if currency == "coins" else STAR_SELL_PRICE if currency == "stars" else values[currency]
+
+
+def exact_ev(outcomes, values):
+    return sum(chance * unit_value(currency, values) * (low + high) / 2 for chance, currency, low, high in outcomes)
+
+
+# ----- 🎲 Монте-Карло розіграшів -----
+def simulate(rng, outcomes, plays, chunk, values):
+    """plays розіграшів: середня цінність (у монетах) і σ одного розіграшу, монети й зірки на розіграш."""
+    total = total_sq = 0.0; minted = defaultdict(float)
+    counts = rng.multinomial(plays, [chance for chance, *_ in outcomes])
+    for (chance, currency, low, high), count in zip(outcomes, counts):
+        amount = amount_sq = 0.0
+        if low == high: amount, amount_sq = float(low) * count, float(low) ** 2 * count
+        else:
+            for start in range(0, count, chunk):
+                drawn = rng.integers(low, high + 1, size=min(chunk, count - start)).astype(np.float64)
+                amount += drawn.sum(); amount_sq += drawn @ drawn
+        unit = unit_value(currency, values)
+        total += unit * amount; total_sq += unit * unit * amount_sq; minted[currency] += amount
+    mean = total / plays
+    return mean, np.sqrt(max(total_sq / plays - mean * mean, 0.0)), minted["coins"] / plays, minted["stars"] / plays
+
+
+def report_plays(rng, cat, args):
+    duel = duel_table(cat); values = item_values(cat, duel)
+    print(f"Розіграшів на рядок: {args.plays:,}; ⭐ продаж {STAR_SELL_PRICE:,} / купівля {STAR_BUY_PRICE:,} 💰"
+          f" (обмін туди й назад втрачає {1 - STAR_SELL_PRICE / STAR_BUY_PRICE:.1%})")
+
+    print("\nКазино (на 1 монету ставки) і дуель (на карту):")
+    print(f"  {'гра':<22} {'EV':>10} {'±':>8} {'точно':>10} {'σ':>9} {'перевага бота':>14} {'монет на 1000 ставки':>21}")
+    for name, table in (("кості", dice_table()), ("слоти", slots_table())):
+        outcomes = grouped(table.tolist())
+        mean, std, _, _ = simulate(rng, outcomes, args.plays, args.chunk, values)
+        print(f"  {name:<22} {mean:>10.4f} {2 * std / np.sqrt(args.plays):>8.4f} {exact_ev(outcomes, values):>10.4f} {std:>9.3f} {1 - mean:>14.2%} {(mean - 1) * 1000:>+21.1f}")
+    card_ids = cat.items_by_type['card']
+    for rarity in cat.rarities:
+        rows = [card_ids.index(card_id) for card_id in cat.cards_by_rarity[rarity]]
+        if not rows: continue
+        outcomes = grouped(duel[rows].ravel().tolist())
+        mean, std, _, _ = simulate(rng, outcomes, args.plays, args.chunk, values)
+        print(f"  {'дуель ' + rarity:<22} {mean:>10.1f} {2 * std / np.sqrt(args.plays):>8.1f} {exact_ev(outcomes, values):>10.1f} {std:>9.1f} {'—':>14} {'+' + format(mean, ',.0f') + ' за дуель':>21}")
+
+    print("\nКейси (цінність у монетах; предмети — за ціною обміну):")
+    print(f"  {'кейс':<12} {'ціна':>10} {'EV':>12} {'±':>9} {'точно':>12} {'σ':>11} {'RTP':>8} {'монет/відкр.':>13} {'⭐/відкр.':>10}")
+    for case_id, info in cat.cases.items():
+        outcomes = case_outcomes(cat, case_id)
+        mean, std, coins, stars = simulate(rng, outcomes, args.plays, args.chunk, values)
+        currency, cost = info['currency'], info['cost']
+        cost_value = cost * (1 if currency == "coins" else STAR_BUY_PRICE if currency == "stars" else values[currency])
+        rtp = mean / cost_value if cost_value else float('inf')
+        coins -= cost if currency == "coins" else 0; stars -= cost if currency == "stars" else 0
+        print(f"  {case_id:<12} {f'{cost:,} {currency}':>10} {mean:>12,.0f} {2 * std / np.sqrt(args.plays):>9,.0f} {exact_ev(outcomes, values):>12,.0f} {std:>11,.0f}"
+              f" {rtp:>8.1%} {coins:>+13,.0f} {stars:>+10.2f}{'  ⚠ арбітраж' if rtp > 1 else ''}")
+    print("\nЦіна предметів: " + ", ".join(f"{cat.items[item_id]['name']} {value:,.0f}" for item_id, value in values.items() if value))
+
+
+# ----- 👥 Популяція гравців -----
+class Population:
+    def __init__(self, rng, cat, args):
+        self.rng, self.cat, self.args, self.players = rng, cat, args, args.players
+        self.coins = np.full(self.players, START_COINS, dtype=np.int64)
+        self.stars = np.zeros(self.players, dtype=np.int64)
+        self.streak = np.zeros(self.players, dtype=np.intp)
+        self.claimed_yesterday = np.zeros(self.players, dtype=bool)
+        self.xp = np.zeros(self.players, dtype=np.int64)
+        self.bp_level = np.ones(self.players, dtype=np.int64)
+        self.premium = rng.random(self.players) < args.premium
+        # Некарткові предмети лежать в інвентарі; карти з кожного дня йдуть у дуель або в колекцію
+        self.inventory = {item_id: np.zeros(self.players, dtype=np.int64) for item_id, info in cat.items.items() if info['type'] != 'card'}
+        self.card_ids = cat.items_by_type['card']; self.card_index = {card_id: index for index, card_id in enumerate(self.card_ids)}
+        self.craft_cards = np.array([self.card_index[card_id] for card_id in cat.cards_by_rarity[CRAFT_RARITY]], dtype=np.intp)
+        self.duel = duel_table(cat); self.cards_kept = 0
+        self.new_cards = []  # [(власники, індекси карт)] за поточний день
+        self.coin_sources = defaultdict(int); self.star_sources = defaultdict(int)
+        # Серія й бонус — таблиці з живих правил: next_streak[вчора_брав, серія], bonus[серія]
+        self.next_streak = np.array([[daily_bonus_streak(streak, consecutive) for streak in range(DAILY_BONUS_CYCLE + 1)] for consecutive in (False, True)])
+        self.bonus = np.array([daily_bonus_reward(streak) for streak in range(DAILY_BONUS_CYCLE + 1)], dtype=np.int64)
+        self.dice, self.slots = dice_table(), slots_table()
+
+    def owners(self, counts):
+        return np.repeat(np.arange(self.players), counts)
+
+    def per_player(self, owners, weights=None):
+        return np.bincount(owners, weights=weights, minlength=self.players)
+
+    def amounts(self, amount, size):
+        if isinstance(amount, int): return np.full(size, amount, dtype=np.int64)
+        return self.rng.integers(amount[0], amount[1] + 1, size=size)
+
+    def grant(self, owners, reward, source):
+        """Видає нагороду формату каталогу ({"type": ..., ...}) кожному з owners."""
+        if reward['type'] == 'item': return self.grant_items(owners, reward['item_id'])
+        gained = self.per_player(owners, self.amounts(reward['amount'], owners.size)).astype(np.int64)
+        if reward['type'] == 'coins': self.coins += gained; self.coin_sources[source] += int(gained.sum())
+        else: self.stars += gained; self.star_sources[source] += int(gained.sum())
+
+    def grant_items(self, owners, item_id):
+        if item_id in self.card_index: self.new_cards.append((owners, np.full(owners.size, self.card_index[item_id])))
+        else: self.inventory[item_id] += self.per_player(owners)
+
+    def open_cases(self, counts, case_id):
+        owners = self.owners(counts)
+        prizes, cum_weights = self.cat.case_prize_tables[case_id]
+        drawn = np.searchsorted(cum_weights, self.rng.random(owners.size) * cum_weights[-1], side='right')
+        for index, prize in enumerate(prizes): self.grant(owners[drawn == index], prize, 'кейси')
+
+    def play_casino(self, counts, table):
+        owners = self.owners(counts)
+        won = self.per_player(owners, table[self.rng.integers(0, table.size, owners.size)]).astype(np.int64) * self.args.bet
+        return won - counts * self.args.bet
+
+    def complete_quest(self, quest_id, progress):
+        quest = self.cat.quests[quest_id]
+        self.xp += quest['xp'] * (progress >= quest['target'])
+
+    def level_up(self):
+        cat = self.cat
+        level = np.minimum(np.searchsorted(cat.bp_cumulative_xp, self.xp, side='right') + 1, len(cat.bp_levels) + 1)
+        for bp_level in range(int(self.bp_level.min()), int(level.max())):
+            passed = (self.bp_level <= bp_level) & (level > bp_level)
+            self.grant(np.flatnonzero(passed), cat.bp_levels[bp_level]['free_reward'], 'battle pass')
+            self.grant(np.flatnonzero(passed & self.premium), cat.bp_levels[bp_level]['premium_reward'], 'battle pass')
+        self.bp_level = level
+
+    def day(self):
+        rng, cat, args = self.rng, self.cat, self.args
+        active = rng.random(self.players) < args.activity
+
+        self.streak = np.where(active, self.next_streak[self.claimed_yesterday.astype(np.intp), self.streak], self.streak)
+        bonus = np.where(active, self.bonus[self.streak], 0)
+        self.coins += bonus; self.coin_sources['бонус'] += int(bonus.sum()); self.claimed_yesterday = active
+
+        # Казино: скільки встигне зіграти за день, але не більше, ніж дозволяє баланс на початок
+        plays = np.minimum(rng.poisson(args.casino_plays, self.players) * active, self.coins // args.bet)
+        dice = rng.binomial(plays, 0.5)
+        net = self.play_casino(dice, self.dice) + self.play_casino(plays - dice, self.slots)
+        self.coins += net; self.coin_sources['казино'] += int(net.sum())
+        self.complete_quest('play_casino', plays)
+
+        case = cat.cases[args.case]
+        balance = self.coins if case['currency'] == 'coins' else self.stars if case['currency'] == 'stars' else self.inventory[case['currency']]
+        opens = np.minimum(rng.poisson(args.case_opens, self.players) * active, balance // case['cost'])
+        balance -= opens * case['cost']
+        if case['currency'] == 'coins': self.coin_sources['кейси'] -= int(opens.sum()) * case['cost']
+        elif case['currency'] == 'stars': self.star_sources['кейси'] -= int(opens.sum()) * case['cost']
+        self.open_cases(opens, args.case)
+        self.complete_quest('open_case', opens)
+
+        # Ключі й інші предмети-валюти одразу йдуть на свої кейси, фрагменти — у крафт
+        for case_id, info in cat.cases.items():
+            if info['currency'] in self.inventory:
+                counts = self.inventory[info['currency']] // info['cost']
+                self.inventory[info['currency']] -= counts * info['cost']; self.open_cases(counts, case_id)
+        crafted = self.inventory['fragment1'] // CRAFT_FRAGMENTS
+        self.inventory['fragment1'] -= crafted * CRAFT_FRAGMENTS
+        owners = self.owners(crafted)
+        self.new_cards.append((owners, self.craft_cards[rng.integers(0, self.craft_cards.size, owners.size)]))
+
+        self.level_up()
+
+        # Дуелі: частка duel_share отриманих за день карт, решта лишається в колекції
+        owners, cards = (np.concatenate(parts) for parts in zip(*self.new_cards)); self.new_cards = []
+        dueled = rng.random(owners.size) < args.duel_share
+        self.cards_kept += int((~dueled).sum())
+        owners, cards = owners[dueled], cards[dueled]
+        won = self.per_player(owners, self.duel[cards, rng.integers(0, len(self.card_ids), cards.size)]).astype(np.int64)
+        self.coins += won; self.coin_sources['дуелі'] += int(won.sum())
+        return int(active.sum())
+
+
+def report_population(rng, cat, args):
+    population = Population(rng, cat, args)
+    print(f"\nПопуляція: {args.players:,} гравців × {args.days} днів; активність {args.activity:.0%}, казино {args.casino_plays}/день по {args.bet}, "
+          f"кейс {args.case} ×{args.case_opens}/день, преміум BP {args.premium:.0%}, у дуель {args.duel_share:.0%} карт")
+    print(f"  {'день':>5} {'активні':>9} {'монет всього':>15} {'за день':>9} {'⭐ всього':>11} {'медіана монет':>14} {'не вистачає на ставку':>22}")
+    report_every = max(args.days // 10, 1); previous = int(population.coins.sum())
+    for day in range(1, args.days + 1):
+        active = population.day()
+        supply = int(population.coins.sum())
+        if day % report_every == 0 or day == args.days:
+            print(f"  {day:>5} {active:>9,} {supply:>15,} {(supply - previous) / max(previous, 1):>+9.2%} {int(population.stars.sum()):>11,}"
+                  f" {int(np.median(population.coins)):>14,} {np.mean(population.coins < args.bet):>22.1%}")
+        previous = supply
+    player_days = args.players * args.days
+    print("  Звідки монети (на гравця за день): " + ", ".join(f"{source} {total / player_days:+,.1f}" for source, total in population.coin_sources.items()))
+    print("  Звідки зірки (на гравця за день): " + ", ".join(f"{source} {total / player_days:+,.3f}" for source, total in population.star_sources.items()))
+    print(f"  Середній рівень BP: {population.bp_level.mean():.1f}; карт у колекціях: {population.cards_kept:,}")
+
+
+def main(args):
+    cat = load_catalog(args.catalog)
+    if args.case not in cat.cases: raise SystemExit(f"Кейса {args.case!r} нет в каталоге: {', '.join(cat.cases)}")
+    print(f"Каталог {cat.summary()}")
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    if args.plays: report_plays(rng, cat, args)
+    if args.players and args.days: report_population(rng, cat, args)
+    print(f"\nГотово за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog", default=os.path.join(ROOT, "catalog.json"))
+    parser.add_argument("--plays", type=int, default=100_000_000)
+    parser.add_argument("--chunk", type=int, default=4_000_000)
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--activity", type=float, default=0.7)
+    parser.add_argument("--casino-plays", type=float, default=5)
+    parser.add_argument("--bet", type=int, default=MIN_BET)
+    parser.add_argument("--case", default="bronze")
+    parser.add_argument("--case-opens", type=float, default=3)
+    parser.add_argument("--premium", type=float, default=0.05)
+    parser.add_argument("--duel-share", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    main(parser.parse_args())
@@ -0,0 +1,118 @@
+# broadcast.py
+
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+
+
+class BroadcastEngine:
+    """Розсилка copy_message всім користувачам із відновленням після перезапуску.
+
+    Отримувачі читаються сторінками по user_id (keyset), сторінка надсилається
+    паралельно під спільним лімітом бота (BotRateLimiter, той самий, що в outbox) як
+    фонова робота: відповіді хендлерів ідуть поперед розсилки, а разом усе не виходить
+    за ліміт Telegram. Після кожної сторінки в таблицю broadcasts записується
+    last_user_id і лічильники, тому після рестарту розсилка продовжується з наступної
+    сторінки. Користувачі, які заблокували
+    бота, позначаються is_blocked = 1 і в наступних розсилках пропускаються.
+    """
+
+    def __init__(self, db, bot, limiter, concurrency=20, page_size=100, max_attempts=5,
+                 progress_interval=5, on_progress=None, on_blocked=None):
+        self.db = db
+        self.bot = bot
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress
+        self.on_blocked = on_blocked
+        self.tasks = {}
+
+    async def start(self, from_chat_id, message_id, status_chat_id=None, status_message_id=None):
+        total = (await self.db.fetchone("SELECT COUNT(*) FROM users WHERE is_blocked = 0"))[0]
+        campaign_id = (await self.db.fetchone(
+            "INSERT INTO broadcasts (from_chat_id, message_id, status_chat_id, status_message_id, total) VALUES (?, ?, ?, ?, ?) RETURNING id",
+            (from_chat_id, message_id, status_chat_id, status_message_id, total)))[0]
+        self.resume(campaign_id)
+        return campaign_id
+
+    def resume(self, campaign_id):
+        if campaign_id in self.tasks: return
+        task = asyncio.create_task(self._run(campaign_id))
+        self.tasks[campaign_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(campaign_id, None))
+
+    async def resume_all(self):
+        for row in await self.db.fetchall("SELECT id FROM broadcasts WHERE status = 'running'"):
+            logging.info(f"Продолжаю рассылку #{row[0]}")
+            self.resume(row[0])
+
+    async def stop(self):
+        for task in list(self.tasks.values()): task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def _send(self, user_id, from_chat_id, message_id):
+        for _ in range(self.max_attempts):
+            # Токен бере request middleware limiter'а; після pause() він же й чекає перед повтором
+            try:
+                await self.bot.copy_message(chat_id=user_id, from_chat_id=from_chat_id, message_id=message_id)
+                return SENT
+            except TelegramRetryAfter as e:
+                # Ліміт глобальний, тож зупиняємо всіх, а не тільки цей запит
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                if "chat not found" in e.message.lower(): return BLOCKED
+                logging.warning(f"Рассылка: не удалось отправить {user_id}: {e.message}")
+                return FAILED
+            except Exception as e:
+                logging.warning(f"Рассылка: не удалось отправить {user_id}: {e}")
+                return FAILED
+        return FAILED
+
+    @staticmethod
+    def _checkpoint(conn, campaign_id, last_user_id, sent, failed, blocked_ids):
+        if blocked_ids:
+            conn.execute(f"UPDATE users SET is_blocked = 1 WHERE user_id IN ({','.join('?' * len(blocked_ids))})", blocked_ids)
+        return conn.execute("UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ? WHERE id = ? RETURNING *",
+                            (last_user_id, sent, failed, len(blocked_ids), campaign_id)).fetchone()
+
+    async def _report(self, campaign):
+        if not self.on_progress: return
+        try: await self.on_progress(campaign)
+        except Exception as e: logging.warning(f"Рассылка #{campaign['id']}: не удалось обновить прогресс: {e}")
+
+    async def _run(self, campaign_id):
+        with self.limiter.background(): await self._send_all(campaign_id)
+
+    async def _send_all(self, campaign_id):
+        campaign = await self.db.fetchone("SELECT * FROM broadcasts WHERE id = ?", (campaign_id,))
+        last_user_id, last_report = campaign['last_user_id'], time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id):
+            async with semaphore: return await self._send(user_id, campaign['from_chat_id'], campaign['message_id'])
+
+        while True:
+            page = [row[0] for row in await self.db.fetchall(
+                "SELECT user_id FROM users WHERE user_id > ? AND is_blocked = 0 ORDER BY user_id LIMIT ?", (last_user_id, self.page_size))]
+            if not page: break
+            results = await asyncio.gather(*(send(user_id) for user_id in page))
+            blocked_ids = [user_id for user_id, result in zip(page, results) if result == BLOCKED]
+            last_user_id = page[-1]
+            campaign = await self.db.transaction(self._checkpoint, campaign_id, last_user_id,
+                                                 results.count(SENT), results.count(FAILED), blocked_ids)
+            if blocked_ids and self.on_blocked: self.on_blocked(blocked_ids)
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                await self._report(campaign)
+
+        campaign = await self.db.fetchone("UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ? RETURNING *", (campaign_id,))
+        await self._report(campaign)
@@ -0,0 +1,65 @@
+# cache.py
+
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Обмежений кеш з витісненням LRU і терміном життя записів.
+
+    Не потокобезпечний — використовується тільки з циклу подій.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self._data[key]
+            self.expirations += 1; self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, ttl=None):
+        self._data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key, default=None):
+        """Значення без перевірки терміну й без впливу на LRU і статистику (останнє відоме)."""
+        entry = self._data.get(key)
+        return default if entry is None else entry[1]
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    def ttl_remaining(self, key):
+        entry = self._data.get(key)
+        return max(entry[0] - self.clock(), 0.0) if entry is not None else 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations}
@@ -0,0 +1,68 @@
+# callback_router.py
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import HandlerObject
+
+
+class CallbackRouter(Router):
+    """Роутер callback-кнопок зі словником замість перебору фільтрів.
+
+    callback_data виду "prefix:arg1:arg2" розбирається один раз і шукається в словнику:
+    спершу повний рядок (маршрути без аргументів, "menu:profile"), потім префікс до
+    першої ":" (маршрути з аргументами, "case:<id>:<n>"). Аргументи перетворюються
+    за типами з route() і передаються хендлеру як іменовані; відсутні в даних
+    аргументи беруться зі значень за замовчуванням хендлера.
+
+    Знайдений хендлер підставляється в data["handler"], тож middleware (метрики,
+    спонсорство) бачать саме його. Якщо маршруту немає або аргументи не розбираються,
+    оновлення йде далі — до звичайних роутерів із фільтрами (хендлери зі станом FSM).
+    """
+
+    def __init__(self, name=None):
+        super().__init__(name=name)
+        self.exact = {}
+        self.prefixes = {}  # prefix -> (HandlerObject, ((назва, тип), ...))
+        self.callback_query.register(self._dispatch, self._match)
+
+    def route(self, data, **arg_types):
+        """Реєструє хендлер на callback_data == data або, якщо задано типи аргументів, на "data:...".
+
+        Тип — функція перетворення (str, int) або множина допустимих значень.
+        """
+        def decorator(callback):
+            handler = HandlerObject(callback=callback)
+            table = self.prefixes if arg_types else self.exact
+            if data in table: raise ValueError(f"Маршрут {data!r} уже зарегистрирован")
+            table[data] = (handler, tuple(arg_types.items()))
+            return callback
+        return decorator
+
+    def resolve(self, data):
+        """Повертає (HandlerObject, {аргумент: значення}) або None."""
+        route = self.exact.get(data)
+        if route: return route[0], {}
+        prefix, _, rest = data.partition(":")
+        route = self.prefixes.get(prefix)
+        if route is None or not rest: return None
+        handler, arg_types = route
+        values = rest.split(":")
+        if len(values) > len(arg_types): return None
+        args = {}
+        for (name, arg_type), value in zip(arg_types, values):
+            if isinstance(arg_type, (set, frozenset)):
+                if value not in arg_type: return None
+                args[name] = value
+            else:
+                try: args[name] = arg_type(value)
+                except ValueError: return None
+        return handler, args
+
+    def _match(self, callback):
+        resolved = self.resolve(callback.data) if callback.data else None
+        if resolved is None: return False
+        handler, args = resolved
+        return {"handler": handler, "callback_args": args}
+
+    @staticmethod
+    async def _dispatch(callback, handler, callback_args, **data):
+        return await handler.call(callback, handler=handler, **data, **callback_args)
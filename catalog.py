@@ -0,0 +1,140 @@
+# catalog.py
+
+import hashlib
+import json
+import os
+from bisect import bisect_right
+from itertools import accumulate
+
+ITEM_TYPES = ('card', 'item', 'craft_item', 'exp_item')
+CURRENCY_EMOJI = {'coins': '💰', 'stars': '⭐'}
+
+
+class CatalogError(ValueError):
+    """Файл каталогу не читається або не пройшов перевірку."""
+
+
+class Catalog:
+    """Скомпільований каталог гри: дані з файлу плюс індекси для гарячих шляхів.
+
+    Після створення не змінюється. Перезавантаження будує новий об'єкт, і його
+    підміняють одним присвоєнням, тож хендлер, що взяв посилання на каталог,
+    до кінця бачить одну узгоджену версію. version росте з кожним завантаженням
+    і входить у ключі кешів, що залежать від каталогу.
+    """
+
+    def __init__(self, data, version=1, digest=None):
+        self.version = version
+        self.digest = digest
+        self.rarities = tuple(rarity['name'] for rarity in data['rarities'])
+        self.rarity_rank = {name: rank for rank, name in enumerate(self.rarities)}
+        self.items = data['items']
+        self.cases = data['cases']
+        self.quests = data['quests']
+
+        # Ранги: рівень -> (поріг total_coins_earned, назва); null у файлі — недосяжний поріг
+        self.ranks = {level: (float('inf') if threshold is None else threshold, name) for level, (threshold, name) in enumerate(data['ranks'], 1)}
+        self.rank_levels = sorted(self.ranks)
+        self.rank_thresholds = [self.ranks[level][0] for level in self.rank_levels]
+        # Той самий перерахунок для масових UPDATE
+        self.rank_level_sql = "CASE " + " ".join(f"WHEN total_coins_earned >= {threshold} THEN {level}" for level, threshold in reversed(list(zip(self.rank_levels, self.rank_thresholds))) if threshold != float('inf')) + f" ELSE {self.rank_levels[0]} END"
+
+        self.bp_levels = dict(enumerate(data['battle_pass'], 1))
+        # bp_cumulative_xp[i] — сумарний XP, щоб пройти рівні 1..i+1
+        self.bp_cumulative_xp = list(accumulate(self.bp_levels[level]['xp'] for level in sorted(self.bp_levels)))
+
+        self.items_by_type = {item_type: tuple(item_id for item_id, info in self.items.items() if info['type'] == item_type) for item_type in ITEM_TYPES}
+        self.cards_by_rarity = {rarity: tuple(item_id for item_id in self.items_by_type['card'] if self.items[item_id]['rarity'] == rarity) for rarity in self.rarities}
+        # Накопичені шанси для random.choices: бінарний пошук замість лінійного проходу
+        self.case_prize_tables = {case_id: (info['prizes'], list(accumulate(prize['chance'] for prize in info['prizes']))) for case_id, info in self.cases.items()}
+        # Кейси за валюту у порядку файлу: (case_id, назва, ціна, валюта, емодзі)
+        self.shop_cases = tuple((case_id, info['name'], info['cost'], info['currency'], CURRENCY_EMOJI[info['currency']]) for case_id, info in self.cases.items() if info['currency'] in CURRENCY_EMOJI)
+
+    def rank_level(self, total_coins_earned):
+        return self.rank_levels[max(bisect_right(self.rank_thresholds, total_coins_earned) - 1, 0)]
+
+    def summary(self):
+        return f"v{self.version} ({self.digest}): предметов {len(self.items)}, кейсов {len(self.cases)}, квестов {len(self.quests)}, рангов {len(self.ranks)}, уровней BP {len(self.bp_levels)}"
+
+
+def _validate(data, required):
+    errors = []
+    def check(condition, message):
+        if not condition: errors.append(message)
+        return condition
+
+    for section, kind in (('rarities', list), ('ranks', list), ('items', dict), ('cases', dict), ('quests', dict), ('battle_pass', list)):
+        if not check(isinstance(data.get(section), kind) and data[section], f"{section}: отсутствует или пуст"): return errors
+    rarities = {rarity.get('name') for rarity in data['rarities'] if isinstance(rarity, dict)}
+    check(len(rarities) == len(data['rarities']) and None not in rarities, "rarities: нужны уникальные name")
+
+    thresholds = [rank[0] if isinstance(rank, list) and len(rank) == 2 else "?" for rank in data['ranks']]
+    finite = [threshold for threshold in thresholds if threshold is not None]
+    if check(all(isinstance(threshold, int) for threshold in finite), "ranks: пороги — целые числа или null"):
+        check(thresholds[0] == 0, "ranks: первый порог должен быть 0")
+        check(all(a < b for a, b in zip(finite, finite[1:])), "ranks: пороги должны строго возрастать")
+        check(None not in thresholds[:-1], "ranks: null допустим только у последнего ранга")
+
+    items = data['items']
+    for item_id, info in items.items():
+        check(isinstance(info.get('name'), str), f"items.{item_id}: нет name")
+        check(info.get('rarity') in rarities, f"items.{item_id}: неизвестная редкость {info.get('rarity')!r}")
+        check(info.get('type') in ITEM_TYPES, f"items.{item_id}: неизвестный тип {info.get('type')!r}")
+        if info.get('type') == 'card': check(isinstance(info.get('power'), int), f"items.{item_id}: у карты нет power")
+
+    def check_amount(where, amount):
+        if isinstance(amount, int): return check(amount > 0, f"{where}: amount должен быть > 0")
+        return check(isinstance(amount, list) and len(amount) == 2 and all(isinstance(value, int) for value in amount) and 0 < amount[0] <= amount[1], f"{where}: amount — число или [min, max]")
+
+    def check_reward(where, reward):
+        if not check(isinstance(reward, dict) and reward.get('type') in ('coins', 'stars', 'item'), f"{where}: type — coins, stars или item"): return
+        if reward['type'] == 'item': check(reward.get('item_id') in items, f"{where}: неизвестный предмет {reward.get('item_id')!r}")
+        else: check_amount(where, reward.get('amount'))
+
+    for case_id, info in data['cases'].items():
+        check(isinstance(info.get('name'), str), f"cases.{case_id}: нет name")
+        check(isinstance(info.get('cost'), int) and info['cost'] > 0, f"cases.{case_id}: cost должен быть целым > 0")
+        check(info.get('currency') in CURRENCY_EMOJI or info.get('currency') in items, f"cases.{case_id}: неизвестная валюта {info.get('currency')!r}")
+        if not check(isinstance(info.get('prizes'), list) and info['prizes'], f"cases.{case_id}: нет призов"): continue
+        for index, prize in enumerate(info['prizes']):
+            check_reward(f"cases.{case_id}.prizes[{index}]", prize)
+            check(isinstance(prize, dict) and isinstance(prize.get('chance'), (int, float)) and prize['chance'] > 0, f"cases.{case_id}.prizes[{index}]: chance должен быть > 0")
+
+    for quest_id, info in data['quests'].items():
+        check(isinstance(info.get('name'), str), f"quests.{quest_id}: нет name")
+        check(isinstance(info.get('target'), int) and info['target'] > 0, f"quests.{quest_id}: target должен быть целым > 0")
+        check(isinstance(info.get('xp'), int) and info['xp'] >= 0, f"quests.{quest_id}: xp должен быть целым >= 0")
+
+    for level, info in enumerate(data['battle_pass'], 1):
+        check(isinstance(info.get('xp'), int) and info['xp'] > 0, f"battle_pass[{level}]: xp должен быть целым > 0")
+        check_reward(f"battle_pass[{level}].free_reward", info.get('free_reward'))
+        check_reward(f"battle_pass[{level}].premium_reward", info.get('premium_reward'))
+
+    # На що посилається код бота
+    for section in ('items', 'cases', 'quests'):
+        for missing in sorted(set(required.get(section, ())) - set(data[section])): errors.append(f"{section}: нет обязательного {missing!r}")
+    card_rarities = {info.get('rarity') for info in items.values() if info.get('type') == 'card'}
+    for rarity in required.get('card_rarities', ()):
+        if check(rarity in rarities, f"rarities: нет обязательной {rarity!r}"): check(rarity in card_rarities, f"items: нет ни одной карты редкости {rarity!r}")
+    check(len(data['ranks']) >= required.get('min_ranks', 0), f"ranks: рангов меньше, чем уже используется ({required.get('min_ranks')})")
+    return errors
+
+
+def load_catalog(path, version=1, required=None):
+    """Читає і перевіряє файл каталогу; при будь-якій помилці — CatalogError зі списком проблем."""
+    try:
+        with open(path, 'rb') as f: raw = f.read()
+        data = json.loads(raw)
+    except (OSError, ValueError) as e: raise CatalogError(f"{path}: {e}") from e
+    if not isinstance(data, dict): raise CatalogError(f"{path}: ожидается JSON-объект")
+    errors = _validate(data, required or {})
+    if errors: raise CatalogError(f"{path}: " + "; ".join(errors))
+    for case in data['cases'].values():
+        for prize in case['prizes']:
+            if isinstance(prize.get('amount'), list): prize['amount'] = tuple(prize['amount'])
+    return Catalog(data, version, hashlib.sha1(raw).hexdigest()[:8])
+
+
+def catalog_mtime(path):
+    try: return os.stat(path).st_mtime_ns
+    except OSError: return None
@@ -0,0 +1,196 @@
+# db.py
+
+import asyncio
+import contextvars
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# ----- НАЛАШТУВАННЯ SQLITE -----
+# WAL дозволяє читати паралельно із записом, synchronous=NORMAL у WAL-режимі
+# не робить fsync на кожен коміт (тільки на чекпоінт).
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = OFF",
+)
+
+
+class Database:
+    """Одне довгоживуче з'єднання з SQLite, всі запити виконуються в окремому потоці.
+
+    Потік один, тому з'єднання ніколи не використовується конкурентно, а цикл подій
+    не блокується на I/O бази.
+
+    Для інструментації: on_statement(sql) викликається на кожен виконаний SQLite
+    запит, on_call(rows) — після кожного виклику з кількістю змінених рядків. Обидва
+    працюють у потоці бази, але з contextvars того, хто зробив запит.
+
+    batch() — груповий коміт: поки триває попередній коміт, записи від конкурентних
+    хендлерів збираються протягом batch_window секунд (або до batch_size штук) і
+    комітяться однією транзакцією. Якщо база вільна, запис комітиться одразу.
+    """
+
+    def __init__(self, path, pragmas=PRAGMAS, on_statement=None, on_call=None, batch_window=0.002, batch_size=64):
+        self.path = path
+        self.pragmas = pragmas
+        self.on_statement = on_statement
+        self.on_call = on_call
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self._pending = []  # (context, fn, args, future)
+        self._flush_timer = None
+        self._flushes = set()
+        self.batches = self.batched = self.batch_max = 0
+        self.batch_sizes = deque(maxlen=1000)
+        self.commit_latencies = deque(maxlen=1000)
+
+    # --- виконується тільки в потоці бази ---
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            for pragma in self.pragmas: conn.execute(pragma)
+            if self.on_statement: conn.set_trace_callback(self.on_statement)
+            self._conn = conn
+        return self._conn
+
+    def _fetchone(self, sql, params):
+        # close() скидає statement — інакше INSERT/UPDATE ... RETURNING тримав би транзакцію відкритою
+        cursor = self._connection().execute(sql, params)
+        try: return cursor.fetchone()
+        finally: cursor.close()
+
+    def _fetchall(self, sql, params):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _execute(self, sql, params):
+        return self._connection().execute(sql, params).rowcount
+
+    def _executemany(self, sql, seq_of_params):
+        return self._transaction(lambda c: c.executemany(sql, seq_of_params).rowcount)
+
+    def _transaction(self, fn, *args):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _run_batch(self, batch):
+        # Кожен запис — у своєму SAVEPOINT: помилка одного відкочує тільки його, решта комітиться
+        conn = self._connection()
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        results = []
+        try:
+            for context, fn, args, _ in batch:
+                conn.execute("SAVEPOINT batch_op")
+                try:
+                    results.append((True, context.run(self._observed, fn, conn, *args)))
+                    conn.execute("RELEASE batch_op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO batch_op"); conn.execute("RELEASE batch_op")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        return results, time.perf_counter() - started
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _observed(self, fn, *args):
+        if self.on_call is None or self._conn is None: return fn(*args)
+        changes = self._conn.total_changes
+        try: return fn(*args)
+        finally:
+            if self._conn is not None: self.on_call(self._conn.total_changes - changes)
+
+    # --- асинхронний API ---
+    async def _call(self, fn, *args):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, self._observed, fn, *args)
+
+    async def connect(self):
+        await self._call(self._connection)
+
+    async def fetchone(self, sql, params=()):
+        return await self._call(self._fetchone, sql, params)
+
+    async def fetchall(self, sql, params=()):
+        return await self._call(self._fetchall, sql, params)
+
+    async def execute(self, sql, params=()):
+        return await self._call(self._execute, sql, params)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self._call(self._executemany, sql, list(seq_of_params))
+
+    async def transaction(self, fn, *args):
+        """Виконує fn(conn, *args) в одній транзакції BEGIN IMMEDIATE ... COMMIT."""
+        return await self._call(self._transaction, fn, *args)
+
+    async def batch(self, fn, *args):
+        """Як transaction(), але fn(conn, *args) комітиться разом з іншими записами, що надійшли
+        одночасно. Результат повертається тільки після коміту всієї групи."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((contextvars.copy_context(), fn, args, future))
+        # База вільна — комітимо одразу; поки йде попередній коміт, записи накопичуються
+        if len(self._pending) >= self.batch_size or not self._flushes: self._start_flush()
+        elif self._flush_timer is None: self._flush_timer = loop.call_later(self.batch_window, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._flush_timer: self._flush_timer.cancel()
+        self._flush_timer = None
+        if not self._pending: return
+        batch, self._pending = self._pending, []
+        # Потік бази один, тож групи комітяться строго по черзі, а поки йде коміт, набирається наступна
+        task = asyncio.get_running_loop().create_task(self._flush(batch))
+        self._flushes.add(task); task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        try: results, elapsed = await asyncio.get_running_loop().run_in_executor(self._executor, self._run_batch, batch)
+        except BaseException as e:
+            for *_, future in batch:
+                if not future.done(): future.set_exception(e)
+            return
+        self.batches += 1; self.batched += len(batch); self.batch_max = max(self.batch_max, len(batch))
+        self.batch_sizes.append(len(batch)); self.commit_latencies.append(elapsed)
+        for (*_, future), (ok, value) in zip(batch, results):
+            if future.done(): continue
+            if ok: future.set_result(value)
+            else: future.set_exception(value)
+
+    async def flush(self):
+        """Комітить усе, що чекає в групі, і дочікується всіх незавершених комітів."""
+        self._start_flush()
+        if self._flushes: await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def batch_stats(self):
+        commits = sorted(self.commit_latencies)
+        def percentile(p): return commits[min(int(len(commits) * p), len(commits) - 1)] if commits else 0.0
+        return {"batches": self.batches, "operations": self.batched, "pending": len(self._pending), "size_max": self.batch_max,
+                "size_avg": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+                "commit_p50": percentile(0.5), "commit_p95": percentile(0.95)}
+
+    async def close(self):
+        await self.flush()
+        await self._call(self._close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,54 @@
+# economy.py
+
+# Правила виплат: ставки, обмін зірок, щоденний бонус, казино, дуелі, крафт.
+# Без залежностей від бота — їх використовують і хендлери main.py, і офлайн-симулятор
+# (benchmarks/simulate_economy.py), тож баланс перевіряється на тих самих числах.
+# Кейси, ранги, квести й Battle Pass — у каталозі (catalog.json).
+
+START_COINS = 1000
+MIN_BET = 50
+STAR_SELL_PRICE = 20000
+STAR_BUY_PRICE = 22000
+
+DAILY_BONUS_STEP = 100
+DAILY_BONUS_CYCLE = 7
+
+DICE_FACES = range(1, 7)
+DICE_WIN_MULTIPLIER = 2
+
+SLOT_SYMBOLS = ("🍓", "🍋", "🍀", "💎", "BAR")
+SLOT_TRIPLE_MULTIPLIERS = {'💎': 25, 'BAR': 15, '🍀': 10}
+SLOT_TRIPLE_DEFAULT = 5
+SLOT_PAIR_MULTIPLIERS = {'💎': 3}
+SLOT_PAIR_DEFAULT = 2
+
+DUEL_POWER_PAYOUT = 1000
+
+CRAFT_FRAGMENTS = 10
+CRAFT_RARITY = '🟢 Редкая'
+
+
+def daily_bonus_streak(streak, consecutive):
+    """Наступна серія: +1 по колу 1..DAILY_BONUS_CYCLE, якщо вчора бонус брали, інакше з початку."""
+    return streak % DAILY_BONUS_CYCLE + 1 if consecutive else 1
+
+
+def daily_bonus_reward(streak):
+    return DAILY_BONUS_STEP * streak
+
+
+def dice_payout(bet, user_roll, bot_roll):
+    """Скільки монет повертається гравцю (ставку вже списано): виграш, ставка при нічиї або 0."""
+    if user_roll > bot_roll: return bet * DICE_WIN_MULTIPLIER
+    return bet if user_roll == bot_roll else 0
+
+
+def slots_payout(bet, reels):
+    if reels[0] == reels[1] == reels[2]: return bet * SLOT_TRIPLE_MULTIPLIERS.get(reels[0], SLOT_TRIPLE_DEFAULT)
+    if reels[0] == reels[1] or reels[1] == reels[2]: return bet * SLOT_PAIR_MULTIPLIERS.get(reels[1], SLOT_PAIR_DEFAULT)
+    return 0
+
+
+def duel_payout(user_power, bot_power):
+    """Виграш за дуель; карта гравця згорає за будь-якого результату."""
+    return user_power * DUEL_POWER_PAYOUT if user_power > bot_power else 0
@@ -0,0 +1,139 @@
+# fsm_storage.py
+
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+_dumps = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched", "dirty")
+
+    def __init__(self, state=None, data=None):
+        self.state = state
+        self.data = data or {}
+        self.touched = time.monotonic()
+        self.dirty = False
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-сховище aiogram у таблиці fsm тієї ж бази, що й решта бота.
+
+    Читання й запис ідуть через кеш у пам'яті: запис лише позначає ключ брудним, а
+    фонова задача раз на flush_interval зберігає всі брудні ключі однією транзакцією,
+    тож перехід стану не коштує окремого коміту. Після рестарту стан читається з
+    бази. Стан, який не змінювався state_ttl секунд, вважається покинутим і
+    видаляється; чисті записи кешу забуваються через cache_idle секунд.
+
+    Кеш вважає себе єдиним власником ключа, тому кілька процесів можуть ділити
+    одну базу, лише якщо кожен користувач обслуговується одним процесом.
+    """
+
+    def __init__(self, db, flush_interval=0.5, state_ttl=86400, cache_idle=600, sweep_interval=300):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.state_ttl = state_ttl
+        self.cache_idle = cache_idle
+        self.sweep_interval = sweep_interval
+        self._records = {}
+        self._dirty = set()
+        self._task = None
+        self.flushes = self.rows_written = 0
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.business_connection_id or ''}:{key.destiny}"
+
+    async def _record(self, key):
+        name = self._key(key)
+        record = self._records.get(name)
+        if record is None:
+            row = await self.db.fetchone("SELECT state, data FROM fsm WHERE key = ? AND expires > ?", (name, time.time()))
+            # Поки чекали на базу, ключ міг уже з'явитися в кеші — він новіший
+            record = self._records.get(name)
+            if record is None:
+                record = self._records[name] = _Record(row['state'], json.loads(row['data']) if row and row['data'] else None) if row else _Record()
+        record.touched = time.monotonic()
+        return name, record
+
+    def _mark(self, name, record):
+        record.dirty = True
+        self._dirty.add(name)
+
+    # --- BaseStorage ---
+    async def set_state(self, key, state=None):
+        name, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark(name, record)
+
+    async def get_state(self, key):
+        return (await self._record(key))[1].state
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict): raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        name, record = await self._record(key)
+        record.data = data.copy()
+        self._mark(name, record)
+
+    async def get_data(self, key):
+        return (await self._record(key))[1].data.copy()
+
+    # --- запис у базу ---
+    @staticmethod
+    def _write(conn, upserts, deletes):
+        if upserts:
+            conn.executemany("INSERT INTO fsm (key, state, data, expires) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, expires = excluded.expires", upserts)
+        if deletes: conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+    async def flush(self):
+        if not self._dirty: return
+        names, self._dirty = self._dirty, set()
+        expires, upserts, deletes = time.time() + self.state_ttl, [], []
+        for name in names:
+            record = self._records.get(name)
+            if record is None: continue
+            record.dirty = False
+            if record.state is None and not record.data: deletes.append((name,))
+            else: upserts.append((name, record.state, _dumps(record.data) if record.data else None, expires))
+        try: await self.db.transaction(self._write, upserts, deletes)
+        except Exception:
+            # Не втрачаємо зміни: наступний flush спробує ще раз
+            for name in names:
+                record = self._records.get(name)
+                if record is not None: self._mark(name, record)
+            raise
+        self.flushes += 1; self.rows_written += len(upserts) + len(deletes)
+
+    def sweep_cache(self):
+        deadline = time.monotonic() - self.cache_idle
+        for name, record in list(self._records.items()):
+            if not record.dirty and record.touched < deadline: del self._records[name]
+
+    async def _run(self):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    self.sweep_cache()
+                    await self.db.execute("DELETE FROM fsm WHERE expires <= ?", (time.time(),))
+            except Exception as e: logging.error(f"FSM: не удалось сохранить состояния: {e}")
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
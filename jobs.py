@@ -0,0 +1,97 @@
+# jobs.py
+
+import asyncio
+import json
+import logging
+import time
+
+
+class JobRunner:
+    """Фонові адмінські операції над усіма користувачами (роздачі тощо).
+
+    Користувачі обробляються порціями по user_id (keyset): кожна порція — окрема
+    коротка транзакція, в якій разом зі зміною рядків users записується
+    last_user_id у таблицю jobs. Тому після рестарту задача продовжується рівно з
+    наступної порції, а між порціями інші хендлери встигають працювати з БД.
+
+    Обробник задачі реєструється через register(kind, handler), де
+    handler(conn, params, low, high) змінює користувачів з low < user_id <= high.
+    """
+
+    def __init__(self, db, chunk_size=500, progress_interval=5, on_progress=None, on_chunk=None):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress
+        self.on_chunk = on_chunk
+        self.handlers = {}
+        self.tasks = {}
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    async def start(self, kind, params, status_chat_id=None, status_message_id=None):
+        total = (await self.db.fetchone("SELECT COUNT(*) FROM users"))[0]
+        job_id = (await self.db.fetchone(
+            "INSERT INTO jobs (kind, params, status_chat_id, status_message_id, total) VALUES (?, ?, ?, ?, ?) RETURNING id",
+            (kind, json.dumps(params), status_chat_id, status_message_id, total)))[0]
+        self.resume(job_id)
+        return job_id
+
+    def resume(self, job_id):
+        if job_id in self.tasks: return
+        task = asyncio.create_task(self._run(job_id))
+        self.tasks[job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+
+    async def resume_all(self):
+        for row in await self.db.fetchall("SELECT id FROM jobs WHERE status = 'running'"):
+            logging.info(f"Продолжаю задачу #{row[0]}")
+            self.resume(row[0])
+
+    async def cancel(self, job_id):
+        """Зупиняє задачу назавжди: вже оброблені порції лишаються застосованими."""
+        job = await self.db.fetchone("UPDATE jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running' RETURNING *", (job_id,))
+        # Задачу не перериваємо: порція, що вже в транзакції, має дійти до on_chunk, а наступна побачить статус і завершиться
+        task = self.tasks.get(job_id)
+        if task: await asyncio.gather(task, return_exceptions=True)
+        if job: await self._report(job)
+        return job is not None
+
+    async def stop(self):
+        # На відміну від cancel() статус лишається 'running', щоб resume_all() підхопив задачі
+        for task in list(self.tasks.values()): task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    @staticmethod
+    def _chunk(conn, handler, job_id, params, last_user_id, chunk_size):
+        # Скасована задача більше нічого не змінює, навіть якщо порція вже стояла в черзі до БД
+        if conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] != 'running': return [], None
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (last_user_id, chunk_size))]
+        if not user_ids: return user_ids, None
+        handler(conn, params, last_user_id, user_ids[-1])
+        job = conn.execute("UPDATE jobs SET last_user_id = ?, processed = processed + ? WHERE id = ? RETURNING *",
+                           (user_ids[-1], len(user_ids), job_id)).fetchone()
+        return user_ids, job
+
+    async def _report(self, job):
+        if not self.on_progress: return
+        try: await self.on_progress(job)
+        except Exception as e: logging.warning(f"Задача #{job['id']}: не удалось обновить прогресс: {e}")
+
+    async def _run(self, job_id):
+        job = await self.db.fetchone("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        handler, params = self.handlers[job['kind']], json.loads(job['params'])
+        last_user_id, last_report = job['last_user_id'], time.monotonic()
+        while True:
+            user_ids, checkpoint = await self.db.transaction(self._chunk, handler, job_id, params, last_user_id, self.chunk_size)
+            if not user_ids: break
+            job, last_user_id = checkpoint, user_ids[-1]
+            if self.on_chunk: self.on_chunk(job, user_ids)
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                await self._report(job)
+            await asyncio.sleep(0)
+
+        job = await self.db.fetchone("UPDATE jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running' RETURNING *", (job_id,))
+        if job: await self._report(job)
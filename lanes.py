@@ -0,0 +1,127 @@
+# lanes.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+
+SHED = object()
+
+
+class _Lane:
+    __slots__ = ("queue", "tags")
+
+    def __init__(self):
+        self.queue = deque()  # (поставлено, тег, ttl, job)
+        self.tags = set()  # теги виконуваних і очікуючих задач
+
+
+class LaneScheduler:
+    """Послідовне виконання по ключу (user_id) без глобального блокування.
+
+    Смуга існує, поки в ній є робота. Якщо смуги немає, задача виконується одразу
+    в таску, що її приніс. Якщо смуга зайнята, задача стає в чергу і run() повертає
+    None, не чекаючи; чергу розбирає окремий таск смуги, після чого смуга зникає.
+    Таски прийому (polling, webhook, воркер) не простоюють за чужою чергою.
+
+    Відкидається (run() повертає SHED): задача з тегом, однаковим з уже виконуваною
+    або очікуючою в тій самій смузі (подвійне натискання кнопки), і будь-яка задача,
+    якщо в черзі вже max_queue. Задача з ttl, що простояла в черзі довше, пропускається.
+    """
+
+    def __init__(self, max_queue=10, callback_ttl=10.0):
+        self.max_queue = max_queue
+        self.callback_ttl = callback_ttl
+        self.lanes = {}
+        self._drains = set()
+        self.immediate = self.queued = self.queue_max = 0
+        self.shed_duplicate = self.shed_overflow = self.shed_stale = 0
+        self.waits = deque(maxlen=1000)
+
+    async def run(self, key, job, tag=None, ttl=None):
+        """await job() у смузі key: результат job, None — якщо поставлено в чергу, SHED — якщо відкинуто."""
+        lane = self.lanes.get(key)
+        if lane is not None:
+            if tag is not None and tag in lane.tags:
+                self.shed_duplicate += 1; return SHED
+            if len(lane.queue) >= self.max_queue:
+                self.shed_overflow += 1; return SHED
+            lane.queue.append((time.monotonic(), tag, ttl, job))
+            if tag is not None: lane.tags.add(tag)
+            self.queued += 1; self.queue_max = max(self.queue_max, len(lane.queue))
+            return None
+        lane = self.lanes[key] = _Lane()
+        if tag is not None: lane.tags.add(tag)
+        self.immediate += 1
+        try: return await job()
+        finally:
+            lane.tags.discard(tag)
+            if lane.queue:
+                task = asyncio.create_task(self._drain(key, lane))
+                self._drains.add(task); task.add_done_callback(self._drains.discard)
+            else: del self.lanes[key]
+
+    async def _drain(self, key, lane):
+        try:
+            while lane.queue:
+                enqueued, tag, ttl, job = lane.queue.popleft()
+                waited = time.monotonic() - enqueued
+                try:
+                    if ttl is not None and waited > ttl:
+                        self.shed_stale += 1; continue
+                    self.waits.append(waited)
+                    await job()
+                except Exception as e: logging.exception(f"Очередь пользователя {key}: ошибка обработки: {e}")
+                finally: lane.tags.discard(tag)
+        finally: del self.lanes[key]
+
+    async def join(self):
+        """Чекає, поки розберуться всі черги: run() на поставлене в чергу не чекає."""
+        while self._drains: await asyncio.wait(set(self._drains))
+
+    async def stop(self, timeout=10):
+        """Дає розібрати вже поставлене в черги."""
+        if not self._drains: return
+        _, pending = await asyncio.wait(set(self._drains), timeout=timeout)
+        if pending: logging.warning(f"Очереди пользователей: не дождались {sum(len(lane.queue) for lane in self.lanes.values())} обновлений")
+        for task in pending: task.cancel()
+
+    def middleware(self):
+        return _LaneMiddleware(self)
+
+    def stats(self):
+        waits = sorted(self.waits)
+        def percentile(p): return waits[min(int(len(waits) * p), len(waits) - 1)] if waits else 0.0
+        return {"lanes": len(self.lanes), "queued_now": sum(len(lane.queue) for lane in self.lanes.values()), "queue_max": self.queue_max,
+                "immediate": self.immediate, "queued": self.queued, "shed_duplicate": self.shed_duplicate,
+                "shed_overflow": self.shed_overflow, "shed_stale": self.shed_stale,
+                "wait_p50": percentile(0.5), "wait_p95": percentile(0.95)}
+
+
+class _LaneMiddleware(BaseMiddleware):
+    """Зовнішній middleware на dp.update: оновлення одного користувача — строго по черзі.
+
+    Має стояти перед FSMContextMiddleware, щоб стан читався вже всередині смуги.
+    Тег callback — (повідомлення, data): повторне натискання тієї самої кнопки, поки
+    перше ще в роботі, відкидається. На відкинутий callback лише відповідаємо, щоб
+    у клієнта зник годинник.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None: return await handler(event, data)
+        callback, tag, ttl = event.callback_query, None, None
+        if callback is not None:
+            tag = (callback.message.message_id if callback.message else callback.inline_message_id, callback.data)
+            ttl = self.scheduler.callback_ttl
+        result = await self.scheduler.run(user.id, lambda: handler(event, data), tag, ttl)
+        if result is not SHED: return result
+        if callback is not None:
+            try: await callback.answer()
+            except TelegramAPIError: pass
@@ -0,0 +1,69 @@
+# leaderboard.py
+
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    """Топ-K гравців за однією колонкою users, що оновлюється інкрементально.
+
+    values — мультимножина всіх додатних значень колонки, по ній рахується місце
+    будь-якого гравця за O(log n). top — точний топ із capacity гравців із іменами.
+    Якщо топ "просів" нижче display (хтось із топу втратив баланс, а кращого
+    кандидата ззовні ми не знаємо), needs_refill стає True і топ треба
+    перезавантажити з індексу.
+    """
+
+    def __init__(self, display=10, capacity=50):
+        self.display = display
+        self.capacity = capacity
+        self.values = SortedList()
+        self.top = SortedList()  # (-value, user_id)
+        self.members = {}  # user_id -> (value, username)
+
+    def load(self, values, top_rows):
+        """values — відсортовані додатні значення, top_rows — (user_id, username, value) за спаданням."""
+        self.values = SortedList(values)
+        self.refill(top_rows)
+
+    def refill(self, top_rows):
+        """Перезавантажує тільки топ (values не змінюються)."""
+        self.top = SortedList()
+        self.members = {}
+        for user_id, username, value in top_rows[:self.capacity]:
+            self.top.add((-value, user_id)); self.members[user_id] = (value, username)
+
+    @property
+    def needs_refill(self):
+        return len(self.top) < min(self.display, len(self.values))
+
+    def update(self, user_id, old_value, new_value, username=None):
+        if old_value == new_value: return
+        if old_value > 0: self.values.discard(old_value)
+        if new_value > 0: self.values.add(new_value)
+
+        member = self.members.pop(user_id, None)
+        if member is not None:
+            self.top.discard((-member[0], user_id))
+            username = username if username is not None else member[1]
+        if new_value <= 0: return
+        outsiders = len(self.values) > len(self.top) + 1
+        if self.top: floor = -self.top[-1][0]
+        else: floor = float('inf') if outsiders else 0
+        # Усі гравці поза топом не кращі за floor, тож новий запис точно належить топу,
+        # якщо він вищий за floor або якщо поза топом нікого немає
+        if new_value > floor or not outsiders or (member is not None and new_value >= floor):
+            self.top.add((-new_value, user_id)); self.members[user_id] = (new_value, username)
+            while len(self.top) > self.capacity:
+                _, dropped = self.top.pop()
+                del self.members[dropped]
+
+    def top_entries(self, limit=None):
+        return [(user_id, self.members[user_id][1], -neg_value) for neg_value, user_id in self.top[:limit or self.display]]
+
+    def position(self, value):
+        """Місце гравця зі значенням value (1 — найкращий), None якщо він поза рейтингом."""
+        if value <= 0: return None
+        return len(self.values) - self.values.bisect_right(value) + 1
+
+    def __len__(self):
+        return len(self.values)
@@ -2,13 +2,21 @@
 
 import asyncio
 import logging
-import sqlite3
 import random
 import os
+import signal
+import sys
+import time
+from bisect import bisect_right
+from collections import Counter
+from itertools import count as counter
 from datetime import datetime, timedelta, date
+from functools import lru_cache
 
 from aiogram import Bot, Dispatcher, types, F, Router, BaseMiddleware
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import CommandStart, Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -21,90 +29,143 @@ from aiogram.types import (
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 
+from broadcast import BroadcastEngine
+from cache import TTLCache
+from catalog import CatalogError, load_catalog, catalog_mtime
+from callback_router import CallbackRouter
+from db import Database
+from economy import (START_COINS, MIN_BET, STAR_SELL_PRICE, STAR_BUY_PRICE, CRAFT_FRAGMENTS, CRAFT_RARITY, SLOT_SYMBOLS,
+                     daily_bonus_streak, daily_bonus_reward, dice_payout, slots_payout, duel_payout)
+from fsm_storage import SQLiteStorage
+from jobs import JobRunner
+from lanes import LaneScheduler
+from leaderboard import Leaderboard
+from metrics import Metrics
+from sharding import ShardRouter, poll_updates, serve_worker
+from outbox import Outbox, ADMIN
+from ratelimit import BotRateLimiter, FloodGuard
+from webhook import WebhookServer
+
 # ----- ⚙️ КОНФІГУРАЦІЯ БОТА ⚙️ -----
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 SPONSOR_CHANNEL = os.getenv("SPONSOR_CHANNEL")
 ADMIN_IDS = [admin_id.strip() for admin_id in os.getenv("ADMIN_ID", "").split(',') if admin_id]
+# Режим отримання оновлень: "polling" (за замовчуванням) або "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Свій Bot API сервер (або локальний фейковий для тестів), наприклад http://127.0.0.1:8081
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (якщо порт не задано — не запускаються)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# Оновлення, що обробляються довше (секунди), пишуться в лог разом з усіма SQL-запитами
+SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", "1.0"))
+# Кількість процесів-воркерів. Якщо більше 1, цей процес лише приймає оновлення і розподіляє їх
+# за user_id % WORKERS; воркери запускаються ним самим з BOT_ROLE=worker і WORKER_INDEX
+WORKERS = max(int(os.getenv("WORKERS", "1")), 1)
+BOT_ROLE = os.getenv("BOT_ROLE", "main")
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+# Скільки оновлень воркер обробляє одночасно (порядок у межах користувача тримають черги користувачів)
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "256"))
+# Скільки повідомлень на секунду бот надсилає сумарно з усіх процесів (ліміт Telegram ~30)
+BOT_MESSAGE_RATE = float(os.getenv("BOT_MESSAGE_RATE", "25"))
 
 # ----- НАЛАШТУВАННЯ ЛОГІВ -----
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # ----- Налаштування економіки -----
+# Ставки, обмін зірок і виплати ігор — в economy.py (їх же рахує симулятор)
 DB_NAME = "economy_bot.db"
-START_COINS = 1000
 REFERRAL_BONUS = 1000
 REFERRED_BONUS = 2000
-MIN_BET = 50
-STAR_SELL_PRICE = 20000
-STAR_BUY_PRICE = 22000
 BATTLE_PASS_COST_STARS = 25
-
-# ----- 📈 РАНГИ 📈 -----
-RANKS = {
-    1: (0, "🌱 Новичок"), 2: (5000, "🥈 Игрок"), 3: (15000, "🥉 Опытный"), 4: (30000, "🥉 Бывалый"),
-    5: (50000, "🥉 Ветеран"), 6: (100000, "🥈 Мастер"), 7: (250000, "🥈 Эксперт"), 8: (500000, "🥈 Профессионал"),
-    9: (1000000, "🥇 Легенда"), 10: (2500000, "🥇 Миллионер"), 11: (5000000, "💎 Магнат"),
-    12: (10000000, "👑 Король экономики"), 13: (25000000, "✨ Повелитель монет"),
-    14: (50000000, "🌌 Галактический банкир"), 15: (100000000, "🔱 Божество"),
-    16: (float('inf'), "👑 Абсолют")
-}
-
-# ----- 🃏 ПРЕДМЕТИ 🃏 -----
-RARITY_POWER = {'⚪️ Обычная': 1, '🟢 Редкая': 2, '🔵 Эпическая': 3, '🟣 Легендарная': 4, '🟠 Мифическая': 5, '⚜️ Уникальная': 10}
-ITEMS = {
-    'c1': {'name': 'Карта Новичка', 'rarity': '⚪️ Обычная', 'type': 'card', 'power': 1},
-    'c2': {'name': 'Талисман Удачи', 'rarity': '⚪️ Обычная', 'type': 'card', 'power': 1},
-    'c3': {'name': 'Проклятый Дублон', 'rarity': '⚪️ Обычная', 'type': 'card', 'power': 1},
-    'c4': {'name': 'Пыльный Свиток', 'rarity': '⚪️ Обычная', 'type': 'card', 'power': 1},
-    'c5': {'name': 'Древняя Монета', 'rarity': '🟢 Редкая', 'type': 'card', 'power': 2},
-    'c6': {'name': 'Кристалл Энергии', 'rarity': '🟢 Редкая', 'type': 'card', 'power': 2},
-    'c7': {'name': 'Зелье Исцеления', 'rarity': '🟢 Редкая', 'type': 'card', 'power': 2},
-    'c8': {'name': 'Амулет Защиты', 'rarity': '🟢 Редкая', 'type': 'card', 'power': 2},
-    'c9': {'name': 'Звёздная Карта', 'rarity': '🔵 Эпическая', 'type': 'card', 'power': 3},
-    'c10': {'name': 'Эссенция Богатства', 'rarity': '🔵 Эпическая', 'type': 'card', 'power': 3},
-    'c11': {'name': 'Плащ-невидимка', 'rarity': '🔵 Эпическая', 'type': 'card', 'power': 3},
-    'c12': {'name': 'Сапоги-скороходы', 'rarity': '🔵 Эпическая', 'type': 'card', 'power': 3},
-    'c13': {'name': 'Корона Правителя', 'rarity': '🟣 Легендарная', 'type': 'card', 'power': 4},
-    'c14': {'name': 'Осколок Вселенной', 'rarity': '🟣 Легендарная', 'type': 'card', 'power': 4},
-    'c15': {'name': 'Молот Тора', 'rarity': '🟣 Легендарная', 'type': 'card', 'power': 4},
-    'c16': {'name': 'Трезубец Посейдона', 'rarity': '🟣 Легендарная', 'type': 'card', 'power': 4},
-    'c17': {'name': 'Сердце Галактики', 'rarity': '🟠 Мифическая', 'type': 'card', 'power': 5},
-    'c18': {'name': 'Перо Феникса', 'rarity': '🟠 Мифическая', 'type': 'card', 'power': 5},
-    'c19': {'name': 'Кровь Грифона', 'rarity': '🟠 Мифическая', 'type': 'card', 'power': 5},
-    'c20': {'name': 'Карта COINVERSE', 'rarity': '⚜️ Уникальная', 'type': 'card', 'power': 10},
-    'key1': {'name': 'Ключ от Сокровищницы', 'rarity': '🟢 Редкая', 'type': 'item'},
-    'fragment1': {'name': 'Фрагмент карты', 'rarity': '⚪️ Обычная', 'type': 'craft_item'},
-    'exp_sphere': {'name': 'Сфера опыта', 'rarity': '🔵 Эпическая', 'type': 'exp_item', 'xp': 50},
-}
-
-# ----- 🎁 КЕЙСИ 🎁 -----
-CASES = {
-    'rusty': {'name': '🔩 Ржавый ящик', 'cost': 100, 'currency': 'coins', 'prizes': [{'type': 'coins', 'amount': (10, 80), 'chance': 90}, {'type': 'item', 'item_id': 'fragment1', 'chance': 10}]},
-    'bronze': {'name': '🥉 Бронзовый кейс', 'cost': 500, 'currency': 'coins', 'prizes': [ {'type': 'coins', 'amount': (100, 450), 'chance': 65}, {'type': 'item', 'item_id': 'c1', 'chance': 15}, {'type': 'item', 'item_id': 'c2', 'chance': 15}, {'type': 'item', 'item_id': 'key1', 'chance': 5},]},
-    'silver': {'name': '🥈 Серебряный кейс', 'cost': 2500, 'currency': 'coins', 'prizes': [ {'type': 'coins', 'amount': (1000, 2200), 'chance': 55}, {'type': 'stars', 'amount': (1, 3), 'chance': 15}, {'type': 'item', 'item_id': 'c3', 'chance': 15}, {'type': 'item', 'item_id': 'c5', 'chance': 10}, {'type': 'item', 'item_id': 'key1', 'chance': 5},]},
-    'gold':   {'name': '🥇 Золотой кейс', 'cost': 10, 'currency': 'stars', 'prizes': [ {'type': 'coins', 'amount': (15000, 25000), 'chance': 50}, {'type': 'item', 'item_id': 'c7', 'chance': 40}, {'type': 'item', 'item_id': 'c9', 'chance': 9}, {'type': 'item', 'item_id': 'c10', 'chance': 1},]},
-    'treasure': {'name': '💎 Кейс Сокровищницы', 'cost': 1, 'currency': 'key1', 'prizes': [ {'type': 'stars', 'amount': (10, 25), 'chance': 50}, {'type': 'item', 'item_id': 'c8', 'chance': 30}, {'type': 'item', 'item_id': 'c10', 'chance': 20},]},
-    'diamond': {'name': '💎 Алмазный кейс', 'cost': 50, 'currency': 'stars', 'prizes': [ {'type': 'stars', 'amount': (25, 45), 'chance': 50}, {'type': 'item', 'item_id': 'c10', 'chance': 25}, {'type': 'item', 'item_id': 'exp_sphere', 'chance': 25},]},
-    'legendary': {'name': '🟣 Легендарный ларец', 'cost': 25, 'currency': 'stars', 'prizes': [{'type': 'item', 'item_id': 'c13', 'chance': 40}, {'type': 'item', 'item_id': 'c14', 'chance': 30}, {'type': 'item', 'item_id': 'c15', 'chance': 30}]},
-}
-
-# ----- 📜 КВЕСТИ 📜 -----
-QUESTS = {
-    'open_case': {'name': 'Откройте 3 кейса', 'target': 3, 'xp': 20},
-    'play_casino': {'name': 'Сыграйте в казино 5 раз', 'target': 5, 'xp': 15},
-    'invite_friend': {'name': 'Пригласите 1 друга', 'target': 1, 'xp': 50}
-}
-
-# ----- 🏆 BATTLE PASS 🏆 -----
-BP_LEVELS = {i: {'xp': i * 50, 'free_reward': {'type': 'coins', 'amount': i * 500}, 'premium_reward': {'type': 'stars', 'amount': i}} for i in range(1, 21)}
-BP_LEVELS[5]['premium_reward'] = {'type': 'item', 'item_id': 'key1'}
-BP_LEVELS[10]['premium_reward'] = {'type': 'item', 'item_id': 'c7'}
-BP_LEVELS[20]['premium_reward'] = {'type': 'item', 'item_id': 'c10'}
+PAYOUT_FAILED_TEXT = "❌ Не удалось начислить выигрыш, перезапустите бота /start"
+
+# ----- Черги користувачів -----
+# Оновлення одного користувача обробляються по черзі (без подвійних списань), різних — паралельно
+LANE_MAX_QUEUE = 10
+LANE_CALLBACK_TTL = 10
+
+# ----- Захист від флуду -----
+# Клас дії: (дій на секунду, запас). Понад ліміт оновлення відкидається ще до запитів у БД і Telegram
+FLOOD_LIMITS = {'menu': (3, 10), 'bet': (1, 3), 'case': (2, 5), 'text': (1, 5), 'admin': (20, 50)}
+# Клас callback за префіксом до ":"; решта кнопок — 'menu'
+FLOOD_CALLBACK_CLASSES = {'game': 'bet', 'duel_card': 'bet', 'case': 'case', 'craft': 'case', 'admin': 'admin', 'admin_edit': 'admin', 'giveaway': 'admin', 'giveaway_confirm': 'admin', 'job_cancel': 'admin'}
+
+# ----- Кеш користувачів -----
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300
+
+# ----- Кеш екранів (профіль, інвентар, кейси) -----
+SCREEN_CACHE_SIZE = 30000
+SCREEN_CACHE_TTL = 300
+
+# ----- Кеш підписки на спонсора -----
+SUBSCRIPTION_CACHE_SIZE = 50000
+SUBSCRIPTION_TTL_POSITIVE = 600
+SUBSCRIPTION_TTL_NEGATIVE = 30
+SUBSCRIPTION_TTL_ERROR = 15
+SUBSCRIPTION_ACTIVE_WINDOW = 1800
+SUBSCRIPTION_REFRESH_INTERVAL = 60
+SUBSCRIPTION_REFRESH_BATCH = 25
+CHANNEL_INFO_TTL = 3600
+
+# ----- Лічильники економіки -----
+ECONOMY_RECONCILE_INTERVAL = 3600
+
+# ----- Синхронізація воркерів -----
+SHARD_SYNC_INTERVAL = 1
+LEADERBOARD_SYNC_INTERVAL = 60
+
+# ----- 📦 КАТАЛОГ ГРИ 📦 -----
+# Ранги, предмети, кейси, квести і Battle Pass — у файлі даних (catalog.json поруч із ботом).
+# Файл перевіряється при завантаженні і перечитується на льоту, коли змінюється (або по /catalog);
+# невалідний файл не застосовується — лишається попередня версія.
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json"))
+CATALOG_WATCH_INTERVAL = 5
+# На що посилається код бота — без цього каталог не приймається
+CATALOG_REQUIRED = {'items': ('key1', 'fragment1'), 'cases': ('treasure',), 'quests': ('open_case', 'play_casino', 'invite_friend'),
+                    'card_rarities': (CRAFT_RARITY,)}
+CASE_BULK_COUNTS = (1, 10, 100)
+
+catalog = load_catalog(CATALOG_PATH, required=CATALOG_REQUIRED)
+catalog_mtime_seen = catalog_mtime(CATALOG_PATH)
+
+def get_rank_level(total_coins_earned):
+    return catalog.rank_level(total_coins_earned)
+
+def reload_catalog():
+    """Перечитує файл і підміняє каталог одним присвоєнням; при помилці — CatalogError, старий каталог лишається."""
+    global catalog, catalog_mtime_seen
+    mtime = catalog_mtime(CATALOG_PATH)
+    # Рангів не менше, ніж було: rank_level гравців уже записано в БД
+    new_catalog = load_catalog(CATALOG_PATH, catalog.version + 1, {**CATALOG_REQUIRED, 'min_ranks': len(catalog.ranks)})
+    catalog, catalog_mtime_seen = new_catalog, mtime
+    logging.info(f"Каталог загружен: {new_catalog.summary()}")
+    return new_catalog
+
+async def catalog_watcher():
+    global catalog_mtime_seen
+    while True:
+        await asyncio.sleep(CATALOG_WATCH_INTERVAL)
+        mtime = catalog_mtime(CATALOG_PATH)
+        if mtime is None or mtime == catalog_mtime_seen: continue
+        try: reload_catalog()
+        except CatalogError as e:
+            # Той самий файл не перевіряємо вдруге, поки його знову не змінять
+            catalog_mtime_seen = mtime
+            logging.error(f"Каталог не применён, работает v{catalog.version}: {e}")
 
 # ----- Базові настройки -----
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="Markdown"))
-dp = Dispatcher()
+bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="Markdown"),
+          session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER)) if TELEGRAM_API_SERVER else None)
 main_router = Router()
+# Кнопки без стану FSM — через словник; хендлери зі станом лишаються на main_router з фільтрами
+callbacks = CallbackRouter(name="callbacks")
 
 # ----- FSM Стейни -----
 class AdminStates(StatesGroup):
@@ -127,220 +188,560 @@ def escape_markdown(text: str) -> str:
     return text.replace('_', '\\_').replace('*', '\\*').replace('`', '\\`').replace('[', '\\[')
 
 # ----- 🗄️ БАЗА ДАННЫХ 🗄️ -----
-def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY, username TEXT, coins INTEGER DEFAULT 0, stars INTEGER DEFAULT 0,
-            total_coins_earned INTEGER DEFAULT 0, rank_level INTEGER DEFAULT 1,
-            daily_bonus_streak INTEGER DEFAULT 0, last_bonus_date TEXT,
-            referrer_id INTEGER, join_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-            bp_level INTEGER DEFAULT 1, bp_xp INTEGER DEFAULT 0, has_premium_bp INTEGER DEFAULT 0
-        )""")
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS inventory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, item_id TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )""")
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS quests (
-            user_id INTEGER, quest_id TEXT, progress INTEGER DEFAULT 0, last_reset_date TEXT,
-            PRIMARY KEY (user_id, quest_id)
-        )""")
-        user_columns = [i[1] for i in cursor.execute("PRAGMA table_info(users)").fetchall()]
-        if 'referrer_id' not in user_columns: cursor.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER")
-        if 'bp_level' not in user_columns: cursor.execute("ALTER TABLE users ADD COLUMN bp_level INTEGER DEFAULT 1")
-        if 'bp_xp' not in user_columns: cursor.execute("ALTER TABLE users ADD COLUMN bp_xp INTEGER DEFAULT 0")
-        if 'has_premium_bp' not in user_columns: cursor.execute("ALTER TABLE users ADD COLUMN has_premium_bp INTEGER DEFAULT 0")
-        conn.commit()
+metrics = Metrics(slow_threshold=SLOW_UPDATE_THRESHOLD)
+db = Database(DB_NAME, on_statement=metrics.on_statement, on_call=metrics.on_db_call)
+# Ліміт Telegram глобальний на бота: усі надсилання процесу (відповіді хендлерів, outbox, розсилка)
+# ідуть через один limiter, а воркери ділять ліміт порівну, тож разом не перевищують BOT_MESSAGE_RATE
+api_limiter = BotRateLimiter(BOT_MESSAGE_RATE / WORKERS)
+metrics.add_gauges("bot_api_limiter", api_limiter.stats)
+outbox = Outbox(bot, api_limiter)
+metrics.add_gauges("bot_outbox", outbox.stats)
+metrics.add_gauges("bot_db_batch", db.batch_stats)
+fsm_storage = SQLiteStorage(db)
+metrics.add_gauges("bot_fsm", lambda: {"cached": len(fsm_storage._records), "flushes": fsm_storage.flushes, "rows_written": fsm_storage.rows_written})
+dp = Dispatcher(storage=fsm_storage)
+lanes = LaneScheduler(LANE_MAX_QUEUE, LANE_CALLBACK_TTL)
+metrics.add_gauges("bot_lanes", lanes.stats)
+flood_guard = FloodGuard(FLOOD_LIMITS)
+metrics.add_gauges("bot_flood", flood_guard.stats)
+
+def flood_class(update, user):
+    """Клас дії для захисту від флуду — лише за самим оновленням, без БД і стану FSM."""
+    if str(user.id) in ADMIN_IDS: return 'admin'
+    if update.callback_query: return FLOOD_CALLBACK_CLASSES.get((update.callback_query.data or "").partition(":")[0], 'menu')
+    if update.message:
+        text = update.message.text or ""
+        # Числа — ставки й суми обміну
+        return 'menu' if text.startswith("/") else 'bet' if text.isdigit() else 'text'
+    return None
+
+def _init_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY, username TEXT, coins INTEGER DEFAULT 0, stars INTEGER DEFAULT 0,
+        total_coins_earned INTEGER DEFAULT 0, rank_level INTEGER DEFAULT 1,
+        daily_bonus_streak INTEGER DEFAULT 0, last_bonus_date TEXT,
+        referrer_id INTEGER, join_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+        bp_level INTEGER DEFAULT 1, bp_xp INTEGER DEFAULT 0, has_premium_bp INTEGER DEFAULT 0,
+        is_blocked INTEGER DEFAULT 0
+    )""")
+    # Старий формат інвентарю (рядок на кожну копію предмета) відкладаємо в inventory_legacy,
+    # його переносить у лічильники migrate_legacy_inventory() вже під час роботи бота
+    inventory_columns = [i[1] for i in conn.execute("PRAGMA table_info(inventory)").fetchall()]
+    if 'id' in inventory_columns:
+        conn.execute("ALTER TABLE inventory RENAME TO inventory_legacy")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inventory_legacy_user ON inventory_legacy(user_id)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS inventory (
+        user_id INTEGER NOT NULL, item_id TEXT NOT NULL, count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, item_id)
+    ) WITHOUT ROWID""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS quests (
+        user_id INTEGER, quest_id TEXT, progress INTEGER DEFAULT 0, last_reset_date TEXT,
+        day INTEGER DEFAULT 0, completed_day INTEGER,
+        PRIMARY KEY (user_id, quest_id)
+    )""")
+    quest_columns = [i[1] for i in conn.execute("PRAGMA table_info(quests)").fetchall()]
+    if 'day' not in quest_columns:
+        # Переводимо дату скидання в номер дня і позначаємо вже виконані квести
+        conn.execute("ALTER TABLE quests ADD COLUMN day INTEGER DEFAULT 0")
+        conn.execute("ALTER TABLE quests ADD COLUMN completed_day INTEGER")
+        conn.execute("UPDATE quests SET day = CAST(julianday(last_reset_date) - 1721424.5 AS INTEGER) WHERE last_reset_date IS NOT NULL")
+        for quest_id, quest_info in catalog.quests.items():
+            conn.execute("UPDATE quests SET completed_day = day WHERE quest_id = ? AND progress >= ?", (quest_id, quest_info['target']))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_coins ON users(coins)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_stars ON users(stars)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_total_coins_earned ON users(total_coins_earned)")
+    user_columns = [i[1] for i in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if 'referrer_id' not in user_columns: conn.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER")
+    if 'bp_level' not in user_columns: conn.execute("ALTER TABLE users ADD COLUMN bp_level INTEGER DEFAULT 1")
+    if 'bp_xp' not in user_columns: conn.execute("ALTER TABLE users ADD COLUMN bp_xp INTEGER DEFAULT 0")
+    if 'has_premium_bp' not in user_columns: conn.execute("ALTER TABLE users ADD COLUMN has_premium_bp INTEGER DEFAULT 0")
+    if 'is_blocked' not in user_columns: conn.execute("ALTER TABLE users ADD COLUMN is_blocked INTEGER DEFAULT 0")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, from_chat_id INTEGER, message_id INTEGER,
+        status_chat_id INTEGER, status_message_id INTEGER, status TEXT DEFAULT 'running',
+        last_user_id INTEGER DEFAULT 0, total INTEGER DEFAULT 0, sent INTEGER DEFAULT 0, failed INTEGER DEFAULT 0, blocked INTEGER DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP, finished_at DATETIME
+    )""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, params TEXT, status TEXT DEFAULT 'running',
+        status_chat_id INTEGER, status_message_id INTEGER,
+        last_user_id INTEGER DEFAULT 0, total INTEGER DEFAULT 0, processed INTEGER DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP, finished_at DATETIME
+    )""")
+    conn.execute("CREATE TABLE IF NOT EXISTS user_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, created REAL NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT, expires REAL NOT NULL) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS economy_stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID")
+    for trigger in ECONOMY_TRIGGERS: conn.execute(trigger)
+    if not conn.execute("SELECT 1 FROM economy_stats LIMIT 1").fetchone(): _reconcile_economy_stats(conn)
+
+async def init_db():
+    global inventory_migration_pending
+    await db.connect()
+    await db.transaction(_init_schema)
+    inventory_migration_pending = bool(await db.fetchone("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'inventory_legacy'"))
+
+# ----- 📊 ЛІЧИЛЬНИКИ ЕКОНОМІКИ 📊 -----
+# economy_stats: 'users', 'coins', 'stars', 'items', 'item:<id>' підтримуються тригерами в тих самих
+# транзакціях, що змінюють users та inventory (включно з роздачами й міграцією), 'case:<id>' — з _open_cases.
+STATS_UPSERT = "INSERT INTO economy_stats (key, value) VALUES {} ON CONFLICT(key) DO UPDATE SET value = value + excluded.value;"
+ECONOMY_TRIGGERS = [f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} BEGIN {STATS_UPSERT.format(values)} END" for name, event, values in (
+    ('users_stats_insert', "INSERT ON users", "('users', 1), ('coins', NEW.coins), ('stars', NEW.stars)"),
+    ('users_stats_update', "UPDATE OF coins, stars ON users WHEN NEW.coins != OLD.coins OR NEW.stars != OLD.stars", "('coins', NEW.coins - OLD.coins), ('stars', NEW.stars - OLD.stars)"),
+    ('users_stats_delete', "DELETE ON users", "('users', -1), ('coins', -OLD.coins), ('stars', -OLD.stars)"),
+    ('inventory_stats_insert', "INSERT ON inventory", "('items', NEW.count), ('item:' || NEW.item_id, NEW.count)"),
+    ('inventory_stats_update', "UPDATE OF count ON inventory WHEN NEW.count != OLD.count", "('items', NEW.count - OLD.count), ('item:' || NEW.item_id, NEW.count - OLD.count)"),
+    ('inventory_stats_delete', "DELETE ON inventory", "('items', -OLD.count), ('item:' || OLD.item_id, -OLD.count)"),
+)]
+
+def _bump_stat(conn, key, delta):
+    conn.execute(STATS_UPSERT.format("(?, ?)"), (key, delta))
+
+def _reconcile_economy_stats(conn):
+    """Перераховує похідні лічильники з базових таблиць і виправляє розбіжності. Повертає {key: (було, стало)}."""
+    actual = dict(zip(('users', 'coins', 'stars'), conn.execute("SELECT COUNT(*), COALESCE(SUM(coins), 0), COALESCE(SUM(stars), 0) FROM users").fetchone()))
+    actual['items'] = 0
+    for item_id, count in conn.execute("SELECT item_id, SUM(count) FROM inventory GROUP BY item_id"):
+        actual[f"item:{item_id}"] = count; actual['items'] += count
+    stored = {key: value for key, value in conn.execute("SELECT key, value FROM economy_stats WHERE key NOT LIKE 'case:%'")}
+    drift = {key: (stored.get(key, 0), actual.get(key, 0)) for key in stored.keys() | actual.keys() if stored.get(key, 0) != actual.get(key, 0)}
+    conn.executemany("INSERT INTO economy_stats (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                     [(key, new) for key, (_, new) in drift.items()])
+    return drift
+
+async def get_economy_stats():
+    return {key: value for key, value in await db.fetchall("SELECT key, value FROM economy_stats")}
+
+async def economy_reconciler():
+    while True:
+        await asyncio.sleep(ECONOMY_RECONCILE_INTERVAL)
+        try:
+            drift = await db.transaction(_reconcile_economy_stats)
+            if drift: logging.warning(f"Лічильники економіки розійшлися з таблицями, виправлено: {drift}")
+        except Exception as e: logging.error(f"Ошибка сверки счётчиков экономики: {e}")
+
+# ----- 👤 КЕШ КОРИСТУВАЧІВ 👤 -----
+USER_COLUMNS = ('user_id', 'username', 'coins', 'stars', 'total_coins_earned', 'rank_level', 'daily_bonus_streak',
+                'last_bonus_date', 'referrer_id', 'join_date', 'bp_level', 'bp_xp', 'has_premium_bp', 'is_blocked')
+
+class UserRecord:
+    """Компактна незмінна копія рядка users. Підтримує user['coins'], як і sqlite3.Row."""
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, row):
+        for column in USER_COLUMNS: object.__setattr__(self, column, row[column])
+
+    def __getitem__(self, column): return getattr(self, column)
+    def __setattr__(self, name, value): raise AttributeError("UserRecord is read-only")
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+metrics.add_gauges("bot_user_cache", user_cache.stats)
+
+def cache_user(row, changed=True):
+    # Write-through: кожен хелпер, що змінює users, кладе в кеш рядок із RETURNING
+    if not row: return None
+    user = UserRecord(row); user_cache.put(user.user_id, user)
+    if not changed: return user
+    touch_screens(user.user_id)
+    if not is_own_user(user.user_id): pending_user_changes.add(user.user_id)
+    return user
+
+# ----- 🖼️ ЕКРАНИ 🖼️ -----
+# Профіль, інвентар і меню кейсів запам'ятовуються разом із версією стану користувача.
+# Версія — число з лічильника, видане при першому зверненні; будь-яка зміна рядка users
+# чи інвентарю її скидає, і наступне звернення отримує нову, більшу. Екран зберігається під
+# ключем (екран, user_id, версія), тож старі версії вже ніколи не збігаються — навіть якщо
+# рендер ішов під час зміни — і просто витісняються LRU.
+screen_versions = TTLCache(SCREEN_CACHE_SIZE, SCREEN_CACHE_TTL)
+screen_cache = TTLCache(SCREEN_CACHE_SIZE, SCREEN_CACHE_TTL)
+_screen_version_counter = counter(1)
+metrics.add_gauges("bot_screen_cache", screen_cache.stats)
+metrics.add_gauges("bot_catalog", lambda: {"version": catalog.version})
+
+def touch_screens(user_id):
+    screen_versions.invalidate(user_id)
+
+def screen_version(user_id):
+    version = screen_versions.get(user_id)
+    if version is None: version = next(_screen_version_counter); screen_versions.put(user_id, version)
+    return version
+
+async def render_screen(name, user_id, render, *args):
+    """Повертає (text, markup) екрана name: із кешу, якщо стан користувача не змінився, інакше await render(user_id, *args)."""
+    key = (name, user_id, screen_version(user_id), catalog.version)
+    screen = screen_cache.get(key, screen_cache)
+    if screen is screen_cache:
+        screen = await render(user_id, *args); screen_cache.put(key, screen)
+    return screen
+
+def inventory_changed(user_id):
+    touch_screens(user_id)
+    if not is_own_user(user_id): pending_user_changes.add(user_id)
+
+# ----- 🔀 КЕШ МІЖ ВОРКЕРАМИ 🔀 -----
+# Кожен користувач обслуговується одним воркером, і його кеш там завжди свіжий. Якщо воркер
+# змінює чужого користувача (реферальний бонус, адмінка, розсилка), він пише user_id у
+# user_changes, а воркер-власник раз на SHARD_SYNC_INTERVAL читає журнал і скидає кеш.
+# user_id NULL — скинути весь кеш (масові операції).
+pending_user_changes = set()
+last_user_change = 0
+
+def is_own_user(user_id):
+    return WORKERS == 1 or user_id % WORKERS == WORKER_INDEX
+
+def invalidate_users(user_ids):
+    for user_id in user_ids:
+        user_cache.invalidate(user_id); touch_screens(user_id)
+        if not is_own_user(user_id): pending_user_changes.add(user_id)
+
+def invalidate_all_users():
+    user_cache.clear(); screen_versions.clear()
+    if WORKERS > 1: pending_user_changes.add(None)
+
+def _publish_user_changes(conn, published, last_seq):
+    conn.executemany("INSERT INTO user_changes (user_id, created) VALUES (?, ?)", [(user_id, time.time()) for user_id in published])
+    return conn.execute("SELECT seq, user_id FROM user_changes WHERE seq > ? ORDER BY seq", (last_seq,)).fetchall()
+
+async def shard_sync():
+    global pending_user_changes, last_user_change
+    last_user_change = (await db.fetchone("SELECT COALESCE(MAX(seq), 0) FROM user_changes"))[0]
+    last_rebuild = time.monotonic()
+    while True:
+        await asyncio.sleep(SHARD_SYNC_INTERVAL)
+        try:
+            published, pending_user_changes = pending_user_changes, set()
+            if published: changes = await db.transaction(_publish_user_changes, published, last_user_change)
+            else: changes = await db.fetchall("SELECT seq, user_id FROM user_changes WHERE seq > ? ORDER BY seq", (last_user_change,))
+            for seq, user_id in changes:
+                last_user_change = seq
+                if user_id is None: user_cache.clear(); screen_versions.clear()
+                elif is_own_user(user_id): user_cache.invalidate(user_id); touch_screens(user_id)
+            # Топи інкрементально бачать тільки свої зміни — періодично звіряємо з базою
+            if time.monotonic() - last_rebuild >= LEADERBOARD_SYNC_INTERVAL:
+                last_rebuild = time.monotonic()
+                await rebuild_leaderboards()
+                if WORKER_INDEX == 0: await db.execute("DELETE FROM user_changes WHERE created < ?", (time.time() - 3600,))
+        except Exception as e: logging.error(f"Ошибка синхронизации воркеров: {e}")
 
 # ----- Функції для роботи з БД та логікою -----
 async def get_user(user_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row; cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        return cursor.fetchone()
+    user = user_cache.get(user_id)
+    if user is None: user = cache_user(await db.fetchone("SELECT * FROM users WHERE user_id = ?", (user_id,)), changed=False)
+    return user
+
+def _insert_user(conn, user_id, username, start_coins, referrer_id):
+    return conn.execute("INSERT OR IGNORE INTO users (user_id, username, coins, total_coins_earned, referrer_id) VALUES (?, ?, ?, ?, ?) RETURNING *", (user_id, username, start_coins, start_coins, referrer_id)).fetchone()
 
 async def add_user(user_id, username, referrer_id=None):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        start_coins = REFERRED_BONUS if referrer_id else START_COINS
-        cursor.execute("INSERT OR IGNORE INTO users (user_id, username, coins, total_coins_earned, referrer_id) VALUES (?, ?, ?, ?, ?)", (user_id, username or "Без имени", start_coins, start_coins, referrer_id))
+    start_coins = REFERRED_BONUS if referrer_id else START_COINS
+    user = cache_user(await db.batch(_insert_user, user_id, username or "Без имени", start_coins, referrer_id))
+    if user: update_leaderboards(user, user.coins, user.stars, user.total_coins_earned)
     if referrer_id:
         await update_quest_progress(referrer_id, 'invite_friend')
 
+async def ensure_user(user_id, username, referrer_id=None):
+    user = await get_user(user_id)
+    if not user: await add_user(user_id, username, referrer_id)
+    # Користувач, якого розсилка позначила як такого, що заблокував бота, знову пише — знімаємо позначку
+    elif user['is_blocked']: cache_user(await db.fetchone("UPDATE users SET is_blocked = 0 WHERE user_id = ? RETURNING *", (user_id,)))
+
+def _apply_balance_delta(conn, user_id, coins, stars, earned):
+    # Умова в WHERE не дає піти в мінус лише валюті, що списується: якщо коштів не вистачає,
+    # рядок не оновлюється. Нарахування проходить і тим, у кого старий баланс уже від'ємний
+    debits = [(column, delta) for column, delta in (("coins", coins), ("stars", stars)) if delta < 0]
+    user = conn.execute(
+        "UPDATE users SET coins = coins + ?, stars = stars + ?, total_coins_earned = total_coins_earned + ? "
+        f"WHERE user_id = ?{''.join(f' AND {column} + ? >= 0' for column, _ in debits)} RETURNING *",
+        (coins, stars, earned, user_id, *(delta for _, delta in debits))).fetchone()
+    if not user: return None, False
+    new_rank_level = get_rank_level(user['total_coins_earned'])
+    if new_rank_level <= user['rank_level']: return user, False
+    user = conn.execute("UPDATE users SET rank_level = ? WHERE user_id = ? RETURNING *", (new_rank_level, user_id)).fetchone()
+    return user, True
+
 async def update_balance(user_id, coins=0, stars=0, earned=False):
-    current_data = await get_user(user_id)
-    if not current_data: return
-    new_coins, new_stars = current_data['coins'] + coins, current_data['stars'] + stars
-    new_total_earned = current_data['total_coins_earned'] + coins if earned and coins > 0 else current_data['total_coins_earned']
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET coins = ?, stars = ?, total_coins_earned = ? WHERE user_id = ?", (new_coins, new_stars, new_total_earned, user_id))
-    await check_and_update_rank(user_id, new_total_earned)
+    """Атомарно змінює баланс і підвищує ранг. Повертає оновлений рядок або None, якщо коштів недостатньо."""
+    earned_delta = coins if earned and coins > 0 else 0
+    user, promoted = await db.batch(_apply_balance_delta, user_id, coins, stars, earned_delta)
+    return publish_balance(user, promoted, coins, stars, earned_delta)
+
+def publish_balance(user, promoted, coins=0, stars=0, earned=0):
+    """Після транзакції: кладе рядок у кеш, оновлює топи і повідомляє про новий ранг."""
+    user = cache_user(user)
+    if user: update_leaderboards(user, coins, stars, earned)
+    if promoted:
+        _, rank_name = catalog.ranks[user['rank_level']]
+        outbox.send_message(user.user_id, f"🎉 *Поздравляем!* 🎉\nВы достигли нового ранга: **{rank_name}**!")
+    return user
+
+# ----- 🏆 ЛІДЕРБОРДИ 🏆 -----
+# Топи тримаються в пам'яті й оновлюються з update_balance/add_user, при старті
+# завантажуються з індексів idx_users_*.
+LEADERBOARD_COLUMNS = ('coins', 'stars', 'total_coins_earned')
+leaderboards = {column: Leaderboard() for column in LEADERBOARD_COLUMNS}
+
+def _select_top(conn, column, limit):
+    return [tuple(row) for row in conn.execute(f"SELECT user_id, username, {column} FROM users WHERE {column} > 0 ORDER BY {column} DESC LIMIT ?", (limit,))]
+
+def _load_leaderboards(conn, columns):
+    return {column: ([row[0] for row in conn.execute(f"SELECT {column} FROM users WHERE {column} > 0 ORDER BY {column}")],
+                     _select_top(conn, column, leaderboards[column].capacity)) for column in columns}
+
+async def rebuild_leaderboards(columns=LEADERBOARD_COLUMNS):
+    for column, (values, top_rows) in (await db.transaction(_load_leaderboards, columns)).items():
+        leaderboards[column].load(values, top_rows)
+
+async def get_leaderboard(column):
+    board = leaderboards[column]
+    if board.needs_refill: board.refill(await db.transaction(_select_top, column, board.capacity))
+    return board
+
+def update_leaderboards(user, coins=0, stars=0, earned=0):
+    # user — рядок уже після зміни, тож старе значення = нове - дельта
+    for column, delta in (('coins', coins), ('stars', stars), ('total_coins_earned', earned)):
+        if delta: leaderboards[column].update(user.user_id, user[column] - delta, user[column], user.username)
+
+# ----- 🎒 ІНВЕНТАР: (user_id, item_id) -> count -----
+inventory_migration_pending = False
+
+def _migrate_legacy_rows(conn, user_ids):
+    placeholders = ",".join("?" * len(user_ids))
+    conn.execute(f"INSERT INTO inventory (user_id, item_id, count) SELECT user_id, item_id, COUNT(*) FROM inventory_legacy WHERE user_id IN ({placeholders}) GROUP BY user_id, item_id "
+                 "ON CONFLICT(user_id, item_id) DO UPDATE SET count = count + excluded.count", user_ids)
+    conn.execute(f"DELETE FROM inventory_legacy WHERE user_id IN ({placeholders})", user_ids)
+
+def _ensure_inventory_migrated(conn, user_id):
+    # Поки міграція йде, предмети користувача переносяться перед будь-якою операцією з ними
+    if inventory_migration_pending: _migrate_legacy_rows(conn, (user_id,))
+
+async def migrate_legacy_inventory(chunk_size=500):
+    global inventory_migration_pending
+    if not inventory_migration_pending: return
+    migrated = 0
+    while True:
+        user_ids = [row[0] for row in await db.fetchall("SELECT DISTINCT user_id FROM inventory_legacy LIMIT ?", (chunk_size,))]
+        if not user_ids: break
+        await db.transaction(_migrate_legacy_rows, user_ids)
+        migrated += len(user_ids)
+        await asyncio.sleep(0)
+    await db.execute("DROP TABLE inventory_legacy")
+    inventory_migration_pending = False
+    logging.info(f"Миграция инвентаря завершена, пользователей: {migrated}")
+
+def _add_items(conn, user_id, item_id, quantity):
+    _ensure_inventory_migrated(conn, user_id)
+    conn.execute("INSERT INTO inventory (user_id, item_id, count) VALUES (?, ?, ?) ON CONFLICT(user_id, item_id) DO UPDATE SET count = count + excluded.count", (user_id, item_id, quantity))
+
+def _remove_items(conn, user_id, item_id, quantity):
+    _ensure_inventory_migrated(conn, user_id)
+    if not conn.execute("UPDATE inventory SET count = count - ? WHERE user_id = ? AND item_id = ? AND count >= ?", (quantity, user_id, item_id, quantity)).rowcount: return False
+    conn.execute("DELETE FROM inventory WHERE user_id = ? AND item_id = ? AND count <= 0", (user_id, item_id))
+    return True
+
+def _select_inventory(conn, user_id):
+    _ensure_inventory_migrated(conn, user_id)
+    return conn.execute("SELECT item_id, count FROM inventory WHERE user_id = ?", (user_id,)).fetchall()
 
 async def add_item_to_inventory(user_id, item_id, quantity=1):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        for _ in range(quantity):
-            cursor.execute("INSERT INTO inventory (user_id, item_id) VALUES (?, ?)", (user_id, item_id))
+    await db.batch(_add_items, user_id, item_id, quantity)
+    inventory_changed(user_id)
 
 async def remove_item_from_inventory(user_id, item_id, quantity=1):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM inventory WHERE id IN (SELECT id FROM inventory WHERE user_id = ? AND item_id = ? LIMIT ?)", (user_id, item_id, quantity))
+    """Списує предмети, тільки якщо їх вистачає. Повертає True при успіху."""
+    removed = await db.batch(_remove_items, user_id, item_id, quantity)
+    if removed: inventory_changed(user_id)
+    return removed
 
 async def get_user_inventory(user_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT item_id, COUNT(item_id) as count FROM inventory WHERE user_id = ? GROUP BY item_id", (user_id,))
-        return cursor.fetchall()
-
-async def check_and_update_rank(user_id, total_coins_earned):
-    current_user = await get_user(user_id);
-    if not current_user: return
-    current_rank_level = current_user['rank_level']
-    new_rank_level = current_rank_level
-    for level, (required_coins, _) in sorted(RANKS.items(), reverse=True):
-        if required_coins is not None and total_coins_earned >= required_coins: new_rank_level = level; break
-    if new_rank_level > current_rank_level:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET rank_level = ? WHERE user_id = ?", (new_rank_level, user_id))
-        _, rank_name = RANKS[new_rank_level]
-        try: await bot.send_message(user_id, f"🎉 *Поздравляем!* 🎉\nВы достигли нового ранга: **{rank_name}**!")
-        except: pass# ----- 📜 КВЕСТИ и БАТЛ ПАСС 📜 -----
-async def get_or_create_quest(user_id, quest_id):
-    today = str(date.today())
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM quests WHERE user_id = ? AND quest_id = ?", (user_id, quest_id))
-        quest_data = cursor.fetchone()
-        if not quest_data or quest_data['last_reset_date'] != today:
-            cursor.execute("INSERT OR REPLACE INTO quests (user_id, quest_id, progress, last_reset_date) VALUES (?, ?, 0, ?)", (user_id, quest_id, today))
-            conn.commit()
-            cursor.execute("SELECT * FROM quests WHERE user_id = ? AND quest_id = ?", (user_id, quest_id))
-            quest_data = cursor.fetchone()
-        return quest_data
-
-async def check_quest_completion(user_id, quest_id):
-    quest = await get_or_create_quest(user_id, quest_id)
-    quest_info = QUESTS[quest_id]
-    
-    # Перевіряємо, чи квест вже був завершений
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT progress FROM quests WHERE user_id = ? AND quest_id = ?", (user_id, quest_id))
-        current_progress = cursor.fetchone()[0]
-
-    # Якщо прогрес вже достатній, нічого не робимо
-    if current_progress < quest_info['target']:
-        return
-
-    # Якщо прогрес достатній, але нагорода вже видана (запобігаємо подвійній видачі)
-    # Цю логіку можна покращити, додавши поле is_completed в БД, але поки що так
-    
-    await add_xp(user_id, quest_info['xp'])
-    try:
-        await bot.send_message(user_id, f"✅ Квест *'{quest_info['name']}'* выполнен! Вам начислено **{quest_info['xp']} XP**.")
-    except:
-        pass
-
+    if inventory_migration_pending: return await db.transaction(_select_inventory, user_id)
+    return await db.fetchall("SELECT item_id, count FROM inventory WHERE user_id = ?", (user_id,))
+
+async def get_item_count(user_id, item_id):
+    if inventory_migration_pending: await db.transaction(_ensure_inventory_migrated, user_id)
+    row = await db.fetchone("SELECT count FROM inventory WHERE user_id = ? AND item_id = ?", (user_id, item_id))
+    return row[0] if row else 0
+
+# ----- 📜 КВЕСТИ и БАТЛ ПАСС 📜 -----
+# Прогрес зберігається разом із номером дня (date.toordinal()): запис за вчорашній день
+# просто вважається нульовим, тому щоденне скидання не потребує окремих записів.
+# completed_day — день, коли квест виконано; поки він дорівнює сьогоднішньому, UPSERT
+# нічого не змінює і не повертає рядок, тому XP за квест видається рівно один раз.
+QUEST_UPSERT = """
+INSERT INTO quests (user_id, quest_id, progress, day, completed_day)
+VALUES (:user_id, :quest_id, MIN(:value, :target), :day, CASE WHEN :value >= :target THEN :day END)
+ON CONFLICT(user_id, quest_id) DO UPDATE SET
+    progress = MIN(CASE WHEN quests.day = :day THEN quests.progress ELSE 0 END + :value, :target),
+    completed_day = CASE WHEN CASE WHEN quests.day = :day THEN quests.progress ELSE 0 END + :value >= :target THEN :day END,
+    day = :day
+WHERE quests.completed_day IS NOT :day
+RETURNING quest_id, completed_day
+"""
+
+def _apply_quest_progress(conn, user_id, increments, day):
+    completed = []
+    for quest_id, value in increments.items():
+        row = conn.execute(QUEST_UPSERT, {'user_id': user_id, 'quest_id': quest_id, 'value': value, 'target': catalog.quests[quest_id]['target'], 'day': day}).fetchone()
+        if row and row['completed_day'] == day: completed.append(quest_id)
+    return completed
+
+async def update_quests(user_id, increments):
+    """Застосовує кілька приростів {quest_id: value} однією транзакцією і видає нагороди за щойно виконані квести."""
+    completed = await db.batch(_apply_quest_progress, user_id, increments, date.today().toordinal())
+    await reward_quests(user_id, completed)
+
+async def reward_quests(user_id, completed):
+    for quest_id in completed:
+        quest_info = catalog.quests[quest_id]
+        await add_xp(user_id, quest_info['xp'])
+        outbox.send_message(user_id, f"✅ Квест *'{quest_info['name']}'* выполнен! Вам начислено **{quest_info['xp']} XP**.")
 
 async def update_quest_progress(user_id, quest_id, value=1):
-    quest = await get_or_create_quest(user_id, quest_id)
-    quest_info = QUESTS[quest_id]
-
-    if quest['progress'] < quest_info['target']:
-        new_progress = quest['progress'] + value
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE quests SET progress = ? WHERE user_id = ? AND quest_id = ?", (new_progress, user_id, quest_id))
-        
-        if new_progress >= quest_info['target']:
-            await check_quest_completion(user_id, quest_id)
+    await update_quests(user_id, {quest_id: value})
+
+def _bp_xp_before_level(cat, level):
+    # min — якщо після перезавантаження каталогу рівнів стало менше, ніж у гравця
+    return cat.bp_cumulative_xp[min(level, len(cat.bp_cumulative_xp) + 1) - 2] if level > 1 else 0
+
+def _grant_xp(conn, user_id, xp_to_add):
+    cat = catalog  # одна версія каталогу на всю транзакцію
+    user = conn.execute("SELECT bp_level, bp_xp, has_premium_bp FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if not user: return None, None
+    old_level = user['bp_level']
+    total_xp = _bp_xp_before_level(cat, old_level) + user['bp_xp'] + xp_to_add
+    new_level = bisect_right(cat.bp_cumulative_xp, total_xp) + 1
+
+    # Нагороди за всі пройдені рівні збираємо разом і видаємо однією транзакцією
+    rewards = {'coins': 0, 'stars': 0, 'items': Counter()}
+    for level in range(old_level, new_level):
+        level_rewards = (cat.bp_levels[level]['free_reward'], cat.bp_levels[level]['premium_reward']) if user['has_premium_bp'] else (cat.bp_levels[level]['free_reward'],)
+        for reward in level_rewards:
+            if reward['type'] == 'item': rewards['items'][reward['item_id']] += 1
+            else: rewards[reward['type']] += reward['amount']
+    if rewards['coins'] or rewards['stars']: _apply_balance_delta(conn, user_id, rewards['coins'], rewards['stars'], 0)
+    for item_id, quantity in rewards['items'].items(): _add_items(conn, user_id, item_id, quantity)
+    user = conn.execute("UPDATE users SET bp_level = ?, bp_xp = ? WHERE user_id = ? RETURNING *", (new_level, total_xp - _bp_xp_before_level(cat, new_level), user_id)).fetchone()
+    return user, (rewards if new_level > old_level else None)
 
 async def add_xp(user_id, xp_to_add):
-    user = await get_user(user_id)
-    if not user: return
-    
-    new_xp = user['bp_xp'] + xp_to_add
-    new_level = user['bp_level']
-    
-    while BP_LEVELS.get(new_level) and new_xp >= BP_LEVELS[new_level]['xp']:
-        new_xp -= BP_LEVELS[new_level]['xp']
-        
-        # Видаємо нагороди за досягнення рівня
-        free_rew = BP_LEVELS[new_level]['free_reward']
-        if free_rew['type'] == 'coins': await update_balance(user_id, coins=free_rew['amount'])
-        elif free_rew['type'] == 'item': await add_item_to_inventory(user_id, free_rew['item_id'])
-        
-        if user['has_premium_bp']:
-            prem_rew = BP_LEVELS[new_level]['premium_reward']
-            if prem_rew['type'] == 'stars': await update_balance(user_id, stars=prem_rew['amount'])
-            elif prem_rew['type'] == 'item': await add_item_to_inventory(user_id, prem_rew['item_id'])
-
-        new_level += 1
-        try:
-            await bot.send_message(user_id, f"🎉 Вы достигли **{new_level}** уровня Боевого Пропуска! Проверьте награды!")
-        except: pass
-
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET bp_level = ?, bp_xp = ? WHERE user_id = ?", (new_level, new_xp, user_id))
+    user, rewards = await db.batch(_grant_xp, user_id, xp_to_add)
+    user = cache_user(user)
+    if not rewards: return
+    update_leaderboards(user, rewards['coins'], rewards['stars'])
+    reward_lines = []
+    if rewards['coins']: reward_lines.append(f"💰 {rewards['coins']:,} монет")
+    if rewards['stars']: reward_lines.append(f"⭐ {rewards['stars']:,} звёздочек")
+    reward_lines += [f"🃏 {catalog.items[item_id]['name']} x{quantity}" for item_id, quantity in rewards['items'].items()]
+    outbox.send_message(user_id, f"🎉 Вы достигли **{user['bp_level']}** уровня Боевого Пропуска!\n\n*Награды:*\n" + "\n".join(reward_lines))
 
 
 # ----- 🛡️ ПРОВЕРКА ПОДПИСКИ НА КАНАЛ 🛡️ -----
+# Статус підписки кешується, щоб не робити get_chat_member на кожен клік: підписаних надовго,
+# непідписаних — коротко (вони перевіряються знову при наступному кліку або кнопкою "Я подписался").
+# Підписаних активних користувачів фоновий таск перевіряє заздалегідь, до закінчення TTL.
+# Якщо Telegram відповідає помилкою, ненадовго лишається останній відомий статус.
+subscription_cache = TTLCache(SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_TTL_POSITIVE)
+channel_info_cache = TTLCache(1, CHANNEL_INFO_TTL)
+subscription_active = {}
+
+async def check_subscription_status(user_id):
+    try: member = await bot.get_chat_member(chat_id=SPONSOR_CHANNEL, user_id=user_id)
+    except Exception as e:
+        logging.warning(f"Не удалось проверить подписку {user_id}: {e}")
+        is_member = subscription_cache.peek(user_id, False)
+        subscription_cache.put(user_id, is_member, SUBSCRIPTION_TTL_ERROR)
+        return is_member
+    is_member = member.status in ['member', 'administrator', 'creator']
+    subscription_cache.put(user_id, is_member, SUBSCRIPTION_TTL_POSITIVE if is_member else SUBSCRIPTION_TTL_NEGATIVE)
+    return is_member
+
+async def is_subscribed(user_id, force=False):
+    subscription_active[user_id] = time.monotonic()
+    if force or user_id not in subscription_cache: return await check_subscription_status(user_id)
+    return subscription_cache.get(user_id, False)
+
+async def get_sponsor_channel():
+    channel = channel_info_cache.get(SPONSOR_CHANNEL)
+    if channel is None:
+        try: channel_info = await bot.get_chat(SPONSOR_CHANNEL)
+        except Exception: return None
+        channel = (channel_info.title, channel_info.invite_link or f"https://t.me/{channel_info.username}")
+        channel_info_cache.put(SPONSOR_CHANNEL, channel)
+    return channel
+
+async def subscription_refresher():
+    while True:
+        await asyncio.sleep(SUBSCRIPTION_REFRESH_INTERVAL)
+        try:
+            now = time.monotonic()
+            for user_id, last_seen in list(subscription_active.items()):
+                if now - last_seen > SUBSCRIPTION_ACTIVE_WINDOW: del subscription_active[user_id]
+            # Лише підписаних: непідписаний однаково не пройде перевірку, поки сам не натисне кнопку
+            due = [user_id for user_id in subscription_active
+                   if subscription_cache.peek(user_id) and subscription_cache.ttl_remaining(user_id) < 2 * SUBSCRIPTION_REFRESH_INTERVAL]
+            for i in range(0, len(due), SUBSCRIPTION_REFRESH_BATCH):
+                await asyncio.gather(*(check_subscription_status(user_id) for user_id in due[i:i + SUBSCRIPTION_REFRESH_BATCH]))
+                await asyncio.sleep(1)
+        except Exception as e: logging.error(f"Ошибка фоновой проверки подписок: {e}")
+
 class SponsorshipMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message | CallbackQuery, data):
         user_id = event.from_user.id
         if ADMIN_IDS and str(user_id) in ADMIN_IDS:
-            if not await get_user(user_id): await add_user(user_id, event.from_user.username)
+            await ensure_user(user_id, event.from_user.username)
             return await handler(event, data)
         if not SPONSOR_CHANNEL:
-            if not await get_user(user_id): await add_user(user_id, event.from_user.username)
+            await ensure_user(user_id, event.from_user.username)
             return await handler(event, data)
-        try:
-            member = await bot.get_chat_member(chat_id=SPONSOR_CHANNEL, user_id=user_id)
-            if member.status in ['member', 'administrator', 'creator']:
-                if not await get_user(user_id):
-                    referrer_id = None
-                    if isinstance(event, Message) and event.text and event.text.startswith("/start"):
-                        args = event.text.split()
-                        if len(args) > 1 and args[1].isdigit() and int(args[1]) != user_id: referrer_id = int(args[1])
-                    await add_user(user_id, event.from_user.username, referrer_id)
-                return await handler(event, data)
-            else: raise ValueError("User is not a member.")
-        except:
-            try:
-                channel_info = await bot.get_chat(SPONSOR_CHANNEL)
-                channel_link = channel_info.invite_link or f"https://t.me/{channel_info.username}"
-            except:
-                logging.error(f"ОШИБКА: Не удалось найти канал: {SPONSOR_CHANNEL}.")
-                error_text = "🔧 Бот временно недоступен.";
-                if isinstance(event, Message): await event.answer(error_text)
-                elif isinstance(event, CallbackQuery): await event.message.answer(error_text)
-                return
-            kb = InlineKeyboardBuilder(); kb.button(text="➡️ Перейти в канал", url=channel_link); kb.button(text="✅ Я подписался", callback_data="check_subscription")
-            text = f"🛑 **Доступ ограничен!**\n\nДля использования бота, подпишитесь на наш канал-спонсор:\n**{escape_markdown(channel_info.title)}**\n\nПосле подписки нажмите кнопку 'Я подписался'."
-            if isinstance(event, Message): await event.answer(text, reply_markup=kb.as_markup())
-            elif isinstance(event, CallbackQuery): await event.message.answer(text, reply_markup=kb.as_markup()); await event.answer()
+        # Кнопка "Я подписался" завжди перевіряє статус заново, минаючи негативний кеш
+        force = isinstance(event, CallbackQuery) and event.data == "check_subscription"
+        if await is_subscribed(user_id, force=force):
+            referrer_id = None
+            if isinstance(event, Message) and event.text and event.text.startswith("/start"):
+                args = event.text.split()
+                if len(args) > 1 and args[1].isdigit() and int(args[1]) != user_id: referrer_id = int(args[1])
+            await ensure_user(user_id, event.from_user.username, referrer_id)
+            return await handler(event, data)
+        channel = await get_sponsor_channel()
+        if not channel:
+            logging.error(f"ОШИБКА: Не удалось найти канал: {SPONSOR_CHANNEL}.")
+            error_text = "🔧 Бот временно недоступен.";
+            if isinstance(event, Message): await event.answer(error_text)
+            elif isinstance(event, CallbackQuery): await event.message.answer(error_text)
+            return
+        channel_title, channel_link = channel
+        kb = InlineKeyboardBuilder(); kb.button(text="➡️ Перейти в канал", url=channel_link); kb.button(text="✅ Я подписался", callback_data="check_subscription")
+        text = f"🛑 **Доступ ограничен!**\n\nДля использования бота, подпишитесь на наш канал-спонсор:\n**{escape_markdown(channel_title)}**\n\nПосле подписки нажмите кнопку 'Я подписался'."
+        if isinstance(event, Message): await event.answer(text, reply_markup=kb.as_markup())
+        elif isinstance(event, CallbackQuery): await event.message.answer(text, reply_markup=kb.as_markup()); await event.answer()
 
 # ----- ⌨️ КЛАВИАТУРЫ ⌨️ -----
-def get_main_menu_keyboard():
+# Статичні клавіатури будуються один раз: розмітка aiogram незмінна, тож один об'єкт можна віддавати всім
+def build_keyboard(buttons, *sizes):
     b = InlineKeyboardBuilder()
-    b.button(text="👤 Профиль", callback_data="menu:profile"); b.button(text="🎒 Инвентарь", callback_data="menu:inventory")
-    b.button(text="🎁 Кейсы", callback_data="menu:cases"); b.button(text="🎮 Развлечения", callback_data="menu:games")
-    b.button(text="❌ В РАЗРАБОТКЕ", callback_data="menu:quests"); b.button(text="❌ В РАЗРАБОТКЕ", callback_data="menu:battle_pass")
-    b.button(text="💱 Обмен", callback_data="menu:exchange"); b.button(text="🗓️ Бонус", callback_data="menu:daily_bonus")
-    b.button(text="🏆 Топы", callback_data="menu:tops"); b.button(text="🤝 Пригласить друга", callback_data="menu:referral")
-    b.button(text="✍️ Отзывы", callback_data="menu:feedback"); b.button(text="🛠️ Крафт", callback_data="menu:craft")
-    b.adjust(2); return b.as_markup()
+    for text, callback_data in buttons: b.button(text=text, callback_data=callback_data)
+    b.adjust(*sizes); return b.as_markup()
+
+MAIN_MENU_KEYBOARD = build_keyboard([
+    ("👤 Профиль", "menu:profile"), ("🎒 Инвентарь", "menu:inventory"), ("🎁 Кейсы", "menu:cases"), ("🎮 Развлечения", "menu:games"),
+    ("❌ В РАЗРАБОТКЕ", "menu:quests"), ("❌ В РАЗРАБОТКЕ", "menu:battle_pass"), ("💱 Обмен", "menu:exchange"), ("🗓️ Бонус", "menu:daily_bonus"),
+    ("🏆 Топы", "menu:tops"), ("🤝 Пригласить друга", "menu:referral"), ("✍️ Отзывы", "menu:feedback"), ("🛠️ Крафт", "menu:craft")], 2)
+GAMES_MENU_KEYBOARD = build_keyboard([("🎲 Кости", "game:dice"), ("🎰 Слоты", "game:slots"), ("🃏 Дуэль Карт", "game:duel"), ("⬅️ Назад", "menu:main")], 2, 1)
+TOPS_MENU_KEYBOARD = build_keyboard([("🏆 Топ по монетам", "top:coins"), ("⭐ Топ по звёздочкам", "top:stars"), ("📈 Топ по заработку", "top:earned"), ("⬅️ Назад", "menu:main")], 1)
+EXCHANGE_MENU_KEYBOARD = build_keyboard([(f"Продать ⭐ за 💰 ({STAR_SELL_PRICE:,})", "exchange:s2c"), (f"Купить ⭐ за 💰 ({STAR_BUY_PRICE:,})", "exchange:c2s"), ("⬅️ Назад", "menu:main")], 2, 1)
+ADMIN_PANEL_KEYBOARD = build_keyboard([
+    ("💸 Выдать/Забрать", "admin:edit_balance"), ("📊 Статистика игрока", "admin:check_user"), ("🚁 Раздача всем", "admin:giveaway"),
+    ("📈 Глобальная статистика", "admin:global_stats"), ("📢 Сделать рассылку", "admin:mass_send"), ("⬅️ В главное меню", "menu:main")], 1)
 
+def get_main_menu_keyboard():
+    return MAIN_MENU_KEYBOARD
+
+@lru_cache(maxsize=None)
 def get_back_button(cb="menu:main"):
-    b = InlineKeyboardBuilder(); b.button(text="⬅️ Назад", callback_data=cb); return b.as_markup()
+    return build_keyboard([("⬅️ Назад", cb)])
 
 # ----- ОСНОВНІ ОБРОБЧИКИ -----
 @main_router.message(CommandStart())
@@ -356,10 +757,14 @@ async def cmd_start(message: Message):
         bonus = REFERRED_BONUS if referrer_id else START_COINS
         await message.answer(f"👋 Привет, {escape_markdown(message.from_user.first_name)}!\n\nДобро пожаловать! Ваш стартовый бонус: **{bonus}** монет!", reply_markup=get_main_menu_keyboard())
     else:
-        await message.answer(f"👋 С возвращением, {escape_markdown(message.from_user.first_name)}!", reply_markup=get_main_menu_keyboard())@main_router.callback_query(F.data == "check_subscription")
-async def cb_check_subscription(callback: CallbackQuery): await callback.message.delete(); await cmd_start(callback.message)
+        await message.answer(f"👋 С возвращением, {escape_markdown(message.from_user.first_name)}!", reply_markup=get_main_menu_keyboard())
+
+@callbacks.route("check_subscription")
+async def cb_check_subscription(callback: CallbackQuery):
+    await callback.message.delete()
+    await callback.message.answer(f"👋 Привет, {escape_markdown(callback.from_user.first_name)}!", reply_markup=get_main_menu_keyboard())
 
-@main_router.callback_query(F.data == "menu:main")
+@callbacks.route("menu:main")
 async def cb_main_menu(callback: CallbackQuery, state: FSMContext):
     await state.clear(); await callback.message.edit_text("Вы в главном меню.", reply_markup=get_main_menu_keyboard())
 
@@ -371,80 +776,68 @@ async def cancel_action(message: Message, state: FSMContext):
     else: await message.answer("Вы в главном меню.", reply_markup=get_main_menu_keyboard())
 
 # ----- 🎒 ІНВЕНТАР ТА КРАФТ 🛠️ -----
-@main_router.callback_query(F.data == "menu:inventory")
-async def cb_inventory(callback: CallbackQuery):
-    user_inventory = await get_user_inventory(callback.from_user.id)
-    if not user_inventory:
-        return await callback.message.edit_text("🎒 Ваш инвентарь пуст.\n\n_Открывайте кейсы, чтобы получить коллекционные карточки и предметы!_", reply_markup=get_back_button())
-    
-    text = "🎒 *Ваш инвентарь:*\n\n"
+async def inventory_screen(user_id):
+    cat, user_inventory = catalog, await get_user_inventory(user_id)
+    if not user_inventory: return "🎒 Ваш инвентарь пуст.\n\n_Открывайте кейсы, чтобы получить коллекционные карточки и предметы!_", get_back_button()
+
     items_by_type = {'item': [], 'card': [], 'craft_item': []}
     for item_id, count in user_inventory:
-        item_info = ITEMS.get(item_id)
-        if item_info:
-            items_by_type.setdefault(item_info.get('type', 'item'), []).append((item_id, count, item_info))
-
-    if items_by_type['item']:
-        text += "*Предметы:*\n"
-        for item_id, count, item_info in items_by_type['item']:
-            text += f"  - {item_info['name']} - {count} шт.\n"
-        text += "\n"
-        
-    if items_by_type['craft_item']:
-        text += "*Материалы для крафта:*\n"
-        for item_id, count, item_info in items_by_type['craft_item']:
-            text += f"  - {item_info['name']} - {count} шт.\n"
-        text += "\n"
+        item_info = cat.items.get(item_id)
+        if item_info: items_by_type.setdefault(item_info.get('type', 'item'), []).append((count, item_info))
 
+    parts = ["🎒 *Ваш инвентарь:*\n\n"]
+    for item_type, title in (('item', "Предметы"), ('craft_item', "Материалы для крафта")):
+        if items_by_type[item_type]:
+            parts.append(f"*{title}:*\n"); parts += [f"  - {item_info['name']} - {count} шт.\n" for count, item_info in items_by_type[item_type]]; parts.append("\n")
     if items_by_type['card']:
-        text += "*Коллекционные карточки:*\n"
-        rarity_order = ['⚪️ Обычная', '🟢 Редкая', '🔵 Эпическая', '🟣 Легендарная', '🟠 Мифическая', '⚜️ Уникальная']
-        sorted_cards = sorted(items_by_type['card'], key=lambda x: rarity_order.index(x[2]['rarity']))
-        for card_id, count, card_info in sorted_cards:
-            text += f"  - {card_info['rarity']} *{card_info['name']}* - {count} шт.\n"
-    
-    await callback.message.edit_text(text, reply_markup=get_back_button())
+        parts.append("*Коллекционные карточки:*\n")
+        parts += [f"  - {card_info['rarity']} *{card_info['name']}* - {count} шт.\n" for count, card_info in sorted(items_by_type['card'], key=lambda card: cat.rarity_rank[card[1]['rarity']])]
+    return "".join(parts), get_back_button()
+
+@callbacks.route("menu:inventory")
+async def cb_inventory(callback: CallbackQuery):
+    text, markup = await render_screen("inventory", callback.from_user.id, inventory_screen)
+    await callback.message.edit_text(text, reply_markup=markup)
     
-@main_router.callback_query(F.data == "menu:craft")
+@callbacks.route("menu:craft")
 async def cb_craft_menu(callback: CallbackQuery):
-    user_inventory = await get_user_inventory(callback.from_user.id)
-    fragment_count = next((count for item_id, count in user_inventory if item_id == 'fragment1'), 0)
+    fragment_count = await get_item_count(callback.from_user.id, 'fragment1')
     
     kb = InlineKeyboardBuilder()
     text = "🛠️ *Мастерская Крафта*\n\nЗдесь вы можете создавать новые предметы из материалов.\n\n"
     text += f"У вас есть **{fragment_count}** фрагментов карт.\n\n"
     
-    if fragment_count >= 10:
-        text += "Создать случайную редкую карту (требуется 10 фрагментов)."
-        kb.button(text="Создать карту (10 фрагментов)", callback_data="craft:rare_card")
+    if fragment_count >= CRAFT_FRAGMENTS:
+        text += f"Создать случайную редкую карту (требуется {CRAFT_FRAGMENTS} фрагментов)."
+        kb.button(text=f"Создать карту ({CRAFT_FRAGMENTS} фрагментов)", callback_data="craft:rare_card")
     else:
-        text += f"Нужно еще **{10 - fragment_count}** фрагментов, чтобы создать случайную редкую карту."
+        text += f"Нужно еще **{CRAFT_FRAGMENTS - fragment_count}** фрагментов, чтобы создать случайную редкую карту."
         
     kb.button(text="⬅️ Назад", callback_data="menu:main")
     await callback.message.edit_text(text, reply_markup=kb.as_markup())
 
-@main_router.callback_query(F.data == "craft:rare_card")
+def _craft_card(conn, user_id, card_id):
+    # Фрагменти списуються і карта видається в одній транзакції
+    if not _remove_items(conn, user_id, 'fragment1', CRAFT_FRAGMENTS): return False
+    _add_items(conn, user_id, card_id, 1)
+    return True
+
+@callbacks.route("craft:rare_card")
 async def cb_craft_rare_card(callback: CallbackQuery):
-    user_inventory = await get_user_inventory(callback.from_user.id)
-    fragment_count = next((count for item_id, count in user_inventory if item_id == 'fragment1'), 0)
-    
-    if fragment_count < 10:
+    cat = catalog
+    crafted_card_id = random.choice(cat.cards_by_rarity[CRAFT_RARITY])
+    if not await db.batch(_craft_card, callback.from_user.id, crafted_card_id):
         return await callback.answer("❌ У вас недостаточно фрагментов!", show_alert=True)
-    
-    await remove_item_from_inventory(callback.from_user.id, 'fragment1', 10)
-    
-    rare_cards = [cid for cid, cinfo in ITEMS.items() if cinfo.get('rarity') == '🟢 Редкая' and cinfo.get('type') == 'card']
-    crafted_card_id = random.choice(rare_cards)
-    await add_item_to_inventory(callback.from_user.id, crafted_card_id)
+    inventory_changed(callback.from_user.id)
     
     await callback.answer("✨ Вы успешно создали карту! ✨", show_alert=True)
-    await callback.message.answer(f"Вы создали: *{ITEMS[crafted_card_id]['rarity']} {ITEMS[crafted_card_id]['name']}*")
+    await callback.message.answer(f"Вы создали: *{cat.items[crafted_card_id]['rarity']} {cat.items[crafted_card_id]['name']}*")
     await cb_craft_menu(callback)
 
 # ----- 🤝 РЕФЕРАЛЬНА СИСТЕМА ТА ВІДГУКИ ✍️ -----
-@main_router.callback_query(F.data == "menu:referral")
+@callbacks.route("menu:referral")
 async def cb_referral(callback: CallbackQuery):
-    me = await bot.get_me()
+    me = await bot.me()  # getMe кешується в Bot після першого виклику
     referral_link = f"https://t.me/{me.username}?start={callback.from_user.id}"
     text = (f"🤝 *Пригласите друга и получите бонус!* \n\n"
             f"Отправьте другу свою уникальную ссылку. Когда он запустит бота по ней, вы оба получите награду:\n\n"
@@ -453,7 +846,7 @@ async def cb_referral(callback: CallbackQuery):
             f"Ваша ссылка:\n`{referral_link}`")
     await callback.message.edit_text(text, reply_markup=get_back_button())
 
-@main_router.callback_query(F.data == "menu:feedback")
+@callbacks.route("menu:feedback")
 async def cb_feedback(callback: CallbackQuery, state: FSMContext):
     await state.set_state(FeedbackState.waiting_for_feedback)
     await callback.message.edit_text(
@@ -468,10 +861,7 @@ async def process_feedback(message: Message, state: FSMContext):
     await state.clear()
     feedback_text = (f"📬 *Новый отзыв от пользователя!* (ID: `{message.from_user.id}`)\n\n"
                      f"Текст:\n_{escape_markdown(message.text)}_")
-    if ADMIN_IDS:
-        for admin_id in ADMIN_IDS:
-            try: await bot.send_message(admin_id, feedback_text)
-            except Exception as e: logging.error(f"Не удалось отправить отзыв админу {admin_id}: {e}")
+    for admin_id in ADMIN_IDS: outbox.send_message(admin_id, feedback_text, priority=ADMIN)
     await message.answer("✅ Спасибо! Ваш отзыв был отправлен.", reply_markup=get_main_menu_keyboard())
 
 # ----- 💻 АДМІН-ПАНЕЛЬ 💻 -----
@@ -479,21 +869,29 @@ async def process_feedback(message: Message, state: FSMContext):
 async def cmd_admin_panel(message: Message, state: FSMContext):
     if str(message.from_user.id) not in ADMIN_IDS: return
     await state.clear()
-    kb = InlineKeyboardBuilder()
-    kb.button(text="💸 Выдать/Забрать", callback_data="admin:edit_balance")
-    kb.button(text="📊 Статистика игрока", callback_data="admin:check_user")
-    kb.button(text="🚁 Раздача всем", callback_data="admin:giveaway")
-    kb.button(text="📈 Глобальная статистика", callback_data="admin:global_stats")
-    kb.button(text="📢 Сделать рассылку", callback_data="admin:mass_send")
-    kb.button(text="⬅️ В главное меню", callback_data="menu:main")
-    kb.adjust(1)
-    await message.answer("👑 **Админ-панель**", reply_markup=kb.as_markup())
-
-@main_router.callback_query(F.data == "admin:main_panel")
+    await message.answer("👑 **Админ-панель**", reply_markup=ADMIN_PANEL_KEYBOARD)
+
+@callbacks.route("admin:main_panel")
 async def cb_admin_panel_back(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await cmd_admin_panel(callback.message, state)
 
+@main_router.message(Command("flood"))
+async def cmd_flood_report(message: Message):
+    if str(message.from_user.id) not in ADMIN_IDS: return
+    offenders = flood_guard.top(20)
+    if not offenders: return await message.reply("✅ Отброшенных действий нет.")
+    by_class = ", ".join(f"{name}: {count:,}" for name, count in flood_guard.dropped_by_class.most_common())
+    lines = "\n".join(f"`{user_id}` — {count:,}" for user_id, count in offenders)
+    await message.reply(f"🚫 **Отброшено по лимитам** ({by_class})\n\n{lines}")
+
+@main_router.message(Command("catalog"))
+async def cmd_reload_catalog(message: Message):
+    if str(message.from_user.id) not in ADMIN_IDS: return
+    try: new_catalog = reload_catalog()
+    except CatalogError as e: return await message.reply(f"❌ Каталог не применён, работает v{catalog.version}:\n{str(e)[:3500]}", parse_mode=None)
+    await message.reply(f"✅ Каталог {new_catalog.summary()}")
+
 @main_router.message(Command("give"))
 async def cmd_give_by_reply(message: Message):
     if str(message.from_user.id) not in ADMIN_IDS: return
@@ -510,36 +908,35 @@ async def cmd_give_by_reply(message: Message):
         safe_username = escape_markdown(message.reply_to_message.from_user.username or "Без_юзернейма")
         if currency in ["монеты", "coins"]:
             amount = int(amount_str)
-            await update_balance(target_id, coins=amount, earned=(amount > 0))
+            if not await update_balance(target_id, coins=amount, earned=(amount > 0)): return await message.reply("❌ У пользователя недостаточно монет для списания.")
             await message.reply(f"✅ Успешно изменено на {amount} монет для @{safe_username}.")
         elif currency in ["звезды", "stars"]:
             amount = int(amount_str)
-            await update_balance(target_id, stars=amount)
+            if not await update_balance(target_id, stars=amount): return await message.reply("❌ У пользователя недостаточно звёздочек для списания.")
             await message.reply(f"✅ Успешно изменено на {amount} звёздочек для @{safe_username}.")
         elif currency in ["item", "предмет"]:
             item_id = amount_str
-            if item_id not in ITEMS: return await message.reply(f"❌ Предмет с ID '{item_id}' не найден.")
+            if item_id not in catalog.items: return await message.reply(f"❌ Предмет с ID '{item_id}' не найден.")
             await add_item_to_inventory(target_id, item_id)
-            await message.reply(f"✅ Успешно выдан предмет '{ITEMS[item_id]['name']}' пользователю @{safe_username}.")
+            await message.reply(f"✅ Успешно выдан предмет '{catalog.items[item_id]['name']}' пользователю @{safe_username}.")
         else: await message.reply("❌ Неверный тип. Используйте 'монеты', 'звезды' или 'предмет'.")
     except: await message.reply("❌ Ошибка в команде. Пример: `/give монеты 10000` или `/give item key1`")# ----- АДМІН-ПАНЕЛЬ: ЛОГІКА КНОПОК -----
-@main_router.callback_query(F.data == "admin:global_stats")
+@callbacks.route("admin:global_stats")
 async def admin_global_stats(callback: CallbackQuery):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(user_id) FROM users"); total_users = cursor.fetchone()[0]
-        cursor.execute("SELECT SUM(coins) FROM users"); total_coins = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(stars) FROM users"); total_stars = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT COUNT(id) FROM inventory"); total_items = cursor.fetchone()[0]
-    
+    stats = await get_economy_stats()
     text = (f"📈 *Глобальная статистика бота:*\n\n"
-            f"👥 *Всего пользователей:* {total_users}\n"
-            f"💰 *Всего монет в экономике:* {total_coins:,}\n"
-            f"⭐ *Всего звёздочек в экономике:* {total_stars:,}\n"
-            f"🃏 *Всего предметов в инвентарях:* {total_items:,}")
+            f"👥 *Всего пользователей:* {stats.get('users', 0)}\n"
+            f"💰 *Всего монет в экономике:* {stats.get('coins', 0):,}\n"
+            f"⭐ *Всего звёздочек в экономике:* {stats.get('stars', 0):,}\n"
+            f"🃏 *Всего предметов в инвентарях:* {stats.get('items', 0):,}")
+    cat = catalog
+    case_lines = [f"{info['name']}: {stats[f'case:{case_id}']:,}" for case_id, info in cat.cases.items() if stats.get(f"case:{case_id}")]
+    if case_lines: text += "\n\n🎁 *Открыто кейсов:*\n" + "\n".join(case_lines)
+    top_items = sorted(((stats.get(f"item:{item_id}", 0), item_id) for item_id in cat.items), reverse=True)[:5]
+    if top_items and top_items[0][0]: text += "\n\n🃏 *Больше всего в обороте:*\n" + "\n".join(f"{cat.items[item_id]['name']}: {count:,}" for count, item_id in top_items if count)
     await callback.message.edit_text(text, reply_markup=get_back_button("admin:main_panel"))
     
-@main_router.callback_query(F.data == "admin:giveaway")
+@callbacks.route("admin:giveaway")
 async def admin_giveaway_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AdminStates.giveaway_currency)
     kb = InlineKeyboardBuilder(); kb.button(text="💰 Монеты", callback_data="giveaway:coins"); kb.button(text="⭐ Звёздочки", callback_data="giveaway:stars")
@@ -547,7 +944,9 @@ async def admin_giveaway_start(callback: CallbackQuery, state: FSMContext):
 
 @main_router.callback_query(F.data.startswith("giveaway:"), AdminStates.giveaway_currency)
 async def admin_giveaway_currency(callback: CallbackQuery, state: FSMContext):
-    currency = callback.data.split(":")[1]; await state.update_data(currency=currency)
+    currency = callback.data.split(":")[1]
+    if currency not in GIVEAWAY_SQL: return await callback.answer()
+    await state.update_data(currency=currency)
     await state.set_state(AdminStates.giveaway_amount)
     await callback.message.edit_text(f"Введите сумму ({'монет' if currency == 'coins' else 'звёздочек'}), которую получит каждый пользователь.")
 
@@ -568,16 +967,41 @@ async def admin_giveaway_confirm(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data(); currency, amount = data['currency'], data['amount']
     await state.clear()
     await callback.message.edit_text(f"⏳ Начинаю раздачу... Это может занять некоторое время.")
-    
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(f"UPDATE users SET {currency} = {currency} + ?", (amount,))
-        if currency == 'coins': cursor.execute("UPDATE users SET total_coins_earned = total_coins_earned + ?", (amount,))
-        conn.commit()
-        
-    await callback.message.edit_text("✅ Раздача успешно завершена!", reply_markup=get_back_button("admin:main_panel"))
+    await job_runner.start('giveaway', {'currency': currency, 'amount': amount}, callback.message.chat.id, callback.message.message_id)
+
+GIVEAWAY_SQL = {
+    'coins': "UPDATE users SET coins = coins + :amount, total_coins_earned = total_coins_earned + :amount WHERE user_id > :low AND user_id <= :high",
+    'stars': "UPDATE users SET stars = stars + :amount WHERE user_id > :low AND user_id <= :high",
+}
+
+def _giveaway_chunk(conn, params, low, high):
+    conn.execute(GIVEAWAY_SQL[params['currency']], {'amount': params['amount'], 'low': low, 'high': high})
+    if params['currency'] == 'coins':
+        rank_level_sql = catalog.rank_level_sql
+        conn.execute(f"UPDATE users SET rank_level = {rank_level_sql} WHERE user_id > ? AND user_id <= ? AND rank_level < {rank_level_sql}", (low, high))
 
-@main_router.callback_query(F.data == "admin:edit_balance")
+async def report_job_progress(job):
+    if job['status'] == 'running':
+        kb = InlineKeyboardBuilder(); kb.button(text="⛔ Остановить", callback_data=f"job_cancel:{job['id']}")
+        progress = min(job['processed'] / job['total'], 1) if job['total'] else 1
+        progress_bar = "█" * int(progress * 10) + "░" * (10 - int(progress * 10))
+        return await bot.edit_message_text(f"⏳ Раздача #{job['id']}: {job['processed']:,} из {job['total']:,}\n`{progress_bar}` {int(progress*100)}%",
+                                           chat_id=job['status_chat_id'], message_id=job['status_message_id'], reply_markup=kb.as_markup())
+    # Топи після масової зміни простіше перебудувати з індексів
+    await rebuild_leaderboards()
+    text = "✅ Раздача успешно завершена!" if job['status'] == 'done' else f"⛔ Раздача остановлена. Обработано {job['processed']:,} из {job['total']:,}."
+    await bot.edit_message_text(text, chat_id=job['status_chat_id'], message_id=job['status_message_id'], reply_markup=get_back_button("admin:main_panel"))
+
+@callbacks.route("job_cancel", job_id=int)
+async def admin_job_cancel(callback: CallbackQuery, job_id: int):
+    if str(callback.from_user.id) not in ADMIN_IDS: return await callback.answer()
+    if not await job_runner.cancel(job_id): return await callback.answer("Задача уже завершена.", show_alert=True)
+    await callback.answer("Остановлено")
+
+job_runner = JobRunner(db, on_progress=report_job_progress, on_chunk=lambda job, user_ids: invalidate_all_users() if WORKERS > 1 else invalidate_users(user_ids))
+job_runner.register('giveaway', _giveaway_chunk)
+
+@callbacks.route("admin:edit_balance")
 async def admin_edit_balance_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AdminStates.get_user_id_for_balance); await callback.message.edit_text("Введите ID пользователя.\n\n_Напишите 'отмена'._")
 
@@ -605,21 +1029,25 @@ async def admin_edit_balance_get_amount(message: Message, state: FSMContext):
         item_id = message.text
         if item_id.startswith('-'):
             item_to_remove = item_id[1:]
-            if item_to_remove not in ITEMS: return await message.reply(f"❌ Предмет с ID '{item_to_remove}' не найден.")
-            await remove_item_from_inventory(target_id, item_to_remove)
-            await message.answer(f"✅ Успешно удален 1 предмет '{ITEMS[item_to_remove]['name']}' у пользователя {target_id}.")
+            if item_to_remove not in catalog.items: return await message.reply(f"❌ Предмет с ID '{item_to_remove}' не найден.")
+            if not await remove_item_from_inventory(target_id, item_to_remove): return await message.reply(f"❌ У пользователя нет предмета '{catalog.items[item_to_remove]['name']}'.")
+            await message.answer(f"✅ Успешно удален 1 предмет '{catalog.items[item_to_remove]['name']}' у пользователя {target_id}.")
         else:
-            if item_id not in ITEMS: return await message.reply(f"❌ Предмет с ID '{item_id}' не найден.")
+            if item_id not in catalog.items: return await message.reply(f"❌ Предмет с ID '{item_id}' не найден.")
             await add_item_to_inventory(target_id, item_id)
-            await message.answer(f"✅ Успешно выдан предмет '{ITEMS[item_id]['name']}' пользователю {target_id}.")
+            await message.answer(f"✅ Успешно выдан предмет '{catalog.items[item_id]['name']}' пользователю {target_id}.")
     else:
         try: amount = int(message.text)
         except ValueError: return await message.reply("❌ Количество должно быть целым числом.")
-        if currency == "coins": await update_balance(target_id, coins=amount, earned=(amount > 0)); await message.answer(f"✅ Баланс монет пользователя {target_id} изменен на {amount}.")
-        elif currency == "stars": await update_balance(target_id, stars=amount); await message.answer(f"✅ Баланс звёздочек пользователя {target_id} изменен на {amount}.")
+        if currency == "coins":
+            if await update_balance(target_id, coins=amount, earned=(amount > 0)): await message.answer(f"✅ Баланс монет пользователя {target_id} изменен на {amount}.")
+            else: await message.answer(f"❌ У пользователя {target_id} недостаточно монет для списания.")
+        elif currency == "stars":
+            if await update_balance(target_id, stars=amount): await message.answer(f"✅ Баланс звёздочек пользователя {target_id} изменен на {amount}.")
+            else: await message.answer(f"❌ У пользователя {target_id} недостаточно звёздочек для списания.")
     await state.clear(); await cmd_admin_panel(message, state)
     
-@main_router.callback_query(F.data == "admin:check_user")
+@callbacks.route("admin:check_user")
 async def admin_check_user_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AdminStates.get_user_id_for_stats); await callback.message.edit_text("Введите ID или @username.\n\n_Напишите 'отмена'._")
 
@@ -630,10 +1058,8 @@ async def admin_show_user_stats(message: Message, state: FSMContext):
     if user_data_input.isdigit(): user_id = int(user_data_input); user = await get_user(user_id)
     elif user_data_input.startswith('@'):
         username_to_find = user_data_input[1:]
-        with sqlite3.connect(DB_NAME) as conn:
-            conn.row_factory = sqlite3.Row; cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username_to_find,)); user = cursor.fetchone()
-            if user: user_id = user['user_id']
+        user = await db.fetchone("SELECT * FROM users WHERE username = ?", (username_to_find,))
+        if user: user_id = user['user_id']
     else: await message.reply("❌ Неверный формат."); await state.clear(); await cmd_admin_panel(message, state); return
     if not user: await message.reply("❌ Пользователь не найден.")
     else:
@@ -642,14 +1068,14 @@ async def admin_show_user_stats(message: Message, state: FSMContext):
         if not inventory_items: inventory_text += "_Пусто_"
         else:
             for item_id, count in inventory_items:
-                inventory_text += f" - {ITEMS.get(item_id, {'name': 'Неизвестный предмет'})['name']} ({item_id}) x{count}\n"
+                inventory_text += f" - {catalog.items.get(item_id, {'name': 'Неизвестный предмет'})['name']} ({item_id}) x{count}\n"
         safe_username = escape_markdown(user['username'])
-        stats_text = (f"📊 **Статистика игрока ID `{user_id}`**\n\nЮзернейм: @{safe_username}\nМонеты: {user['coins']:,}\nЗвёздочки: {user['stars']:,}\nРанг: {RANKS[user['rank_level']][1]}"
+        stats_text = (f"📊 **Статистика игрока ID `{user_id}`**\n\nЮзернейм: @{safe_username}\nМонеты: {user['coins']:,}\nЗвёздочки: {user['stars']:,}\nРанг: {catalog.ranks[user['rank_level']][1]}"
                       f"{inventory_text}")
         await message.answer(stats_text)
     await state.clear(); await cmd_admin_panel(message, state)
 
-@main_router.callback_query(F.data == "admin:mass_send")
+@callbacks.route("admin:mass_send")
 async def admin_mass_send_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AdminStates.get_message_for_mass_send); await callback.message.edit_text("Введите сообщение для рассылки.\n\n_Напишите 'отмена'._")
 
@@ -666,21 +1092,26 @@ async def admin_mass_send_confirm(callback: CallbackQuery, state: FSMContext):
     if callback.data == "send_no":
         await state.clear(); await callback.message.edit_text("Рассылка отменена."); await cmd_admin_panel(callback.message, state); return
     await state.clear(); await callback.message.edit_text("⏳ Начинаю рассылку...")
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor(); cursor.execute("SELECT user_id FROM users"); user_ids = cursor.fetchall()
-    sent_count, failed_count = 0, 0
-    for (user_id,) in user_ids:
-        try: await bot.copy_message(chat_id=user_id, from_chat_id=data['chat_id'], message_id=data['message_id']); sent_count += 1; await asyncio.sleep(0.1)
-        except: failed_count += 1
-    await callback.message.answer(f"✅ Рассылка завершена!\n\nОтправлено: {sent_count}\nНе удалось: {failed_count}"); await cmd_admin_panel(callback.message, state)
+    await broadcaster.start(data['chat_id'], data['message_id'], callback.message.chat.id, callback.message.message_id)
+    await cmd_admin_panel(callback.message, state)
+
+async def report_broadcast_progress(campaign):
+    processed = campaign['sent'] + campaign['failed'] + campaign['blocked']
+    counters = f"Отправлено: {campaign['sent']}\nНе удалось: {campaign['failed']}\nЗаблокировали бота: {campaign['blocked']}"
+    if campaign['status'] == 'done':
+        await bot.send_message(campaign['status_chat_id'], f"✅ Рассылка #{campaign['id']} завершена!\n\n{counters}")
+    else:
+        await bot.edit_message_text(f"⏳ Рассылка #{campaign['id']}: {processed:,} из {campaign['total']:,}\n\n{counters}",
+                                    chat_id=campaign['status_chat_id'], message_id=campaign['status_message_id'])
+
+broadcaster = BroadcastEngine(db, bot, api_limiter, on_progress=report_broadcast_progress, on_blocked=invalidate_users)
 
 # ----- 🎮 РОЗВАГИ 🎮 -----
-@main_router.callback_query(F.data == "menu:games")
+@callbacks.route("menu:games")
 async def cb_games_menu(callback: CallbackQuery):
-    kb = InlineKeyboardBuilder(); kb.button(text="🎲 Кости", callback_data="game:dice"); kb.button(text="🎰 Слоты", callback_data="game:slots"); kb.button(text="🃏 Дуэль Карт", callback_data="game:duel")
-    kb.button(text="⬅️ Назад", callback_data="menu:main"); kb.adjust(2,1); await callback.message.edit_text("Выберите развлечение:", reply_markup=kb.as_markup())
+    await callback.message.edit_text("Выберите развлечение:", reply_markup=GAMES_MENU_KEYBOARD)
 
-@main_router.callback_query(F.data == "game:dice")
+@callbacks.route("game:dice")
 async def cb_game_dice(callback: CallbackQuery, state: FSMContext):
     await state.set_state(CasinoStates.get_bet_dice); await callback.message.edit_text(f"Введите ставку (мин. {MIN_BET}).\n\n_Напишите 'отмена'._")
 
@@ -689,20 +1120,20 @@ async def process_dice_bet(message: Message, state: FSMContext):
     if not message.text.isdigit(): return await message.reply("❌ Ставка должна быть числом.")
     bet = int(message.text)
     if bet < MIN_BET: return await message.reply(f"❌ Минимальная ставка: {MIN_BET}.")
-    user = await get_user(message.from_user.id)
-    if user['coins'] < bet: return await message.reply("❌ У вас недостаточно монет.")
-    await state.clear(); await update_balance(message.from_user.id, coins=-bet); await update_quest_progress(message.from_user.id, 'play_casino')
+    if not await update_balance(message.from_user.id, coins=-bet): return await message.reply("❌ У вас недостаточно монет.")
+    await state.clear(); await update_quest_progress(message.from_user.id, 'play_casino')
     await message.reply("Бросаем кости...")
     await asyncio.sleep(1); user_dice = await message.answer_dice(); user_roll = user_dice.dice.value
     await asyncio.sleep(3); bot_dice = await message.answer_dice(); bot_roll = bot_dice.dice.value
-    win_amount = bet * 2
+    win_amount = dice_payout(bet, user_roll, bot_roll)
+    if win_amount and not await update_balance(message.from_user.id, coins=win_amount, earned=user_roll > bot_roll):
+        return await message.reply(PAYOUT_FAILED_TEXT)
     if user_roll > bot_roll:
-        await update_balance(message.from_user.id, coins=win_amount, earned=True)
         await message.reply(f"🎉 **Вы победили!** ({user_roll} vs {bot_roll})\nВы выиграли **{win_amount}** монет!")
     elif bot_roll > user_roll: await message.reply(f"😕 **Вы проиграли...** ({user_roll} vs {bot_roll})\nВаша ставка в **{bet}** монет потеряна.")
-    else: await update_balance(message.from_user.id, coins=bet); await message.reply(f"🤝 **Ничья!** ({user_roll} vs {bot_roll})\nВаша ставка возвращена.")
+    else: await message.reply(f"🤝 **Ничья!** ({user_roll} vs {bot_roll})\nВаша ставка возвращена.")
 
-@main_router.callback_query(F.data == "game:slots")
+@callbacks.route("game:slots")
 async def cb_game_slots(callback: CallbackQuery, state: FSMContext):
     await state.set_state(CasinoStates.get_bet_slots); await callback.message.edit_text(f"Введите ставку (мин. {MIN_BET}).\n\n_Напишите 'отмена'._")
 
@@ -711,40 +1142,40 @@ async def process_slots_bet(message: Message, state: FSMContext):
     if not message.text.isdigit(): return await message.reply("❌ Ставка должна быть числом.")
     bet = int(message.text)
     if bet < MIN_BET: return await message.reply(f"❌ Минимальная ставка: {MIN_BET}.")
-    user = await get_user(message.from_user.id);
-    if user['coins'] < bet: return await message.reply("❌ У вас недостаточно монет.")
-    await state.clear(); await update_balance(message.from_user.id, coins=-bet); await update_quest_progress(message.from_user.id, 'play_casino')
-    slots = ["🍓", "🍋", "🍀", "💎", "BAR"]; reels = [random.choice(slots) for _ in range(3)]
+    if not await update_balance(message.from_user.id, coins=-bet): return await message.reply("❌ У вас недостаточно монет.")
+    await state.clear(); await update_quest_progress(message.from_user.id, 'play_casino')
+    reels = [random.choice(SLOT_SYMBOLS) for _ in range(3)]
     result_msg = await message.answer(f"Крутим барабаны...\n\n[❓] [❓] [❓]")
     await asyncio.sleep(1); await result_msg.edit_text(f"Крутим барабаны...\n\n[{reels[0]}] [❓] [❓]")
     await asyncio.sleep(1); await result_msg.edit_text(f"Крутим барабаны...\n\n[{reels[0]}] [{reels[1]}] [❓]")
     await asyncio.sleep(1); await result_msg.edit_text(f"Ваш результат:\n\n[{reels[0]}] [{reels[1]}] [{reels[2]}]")
-    win = 0
-    if reels[0] == reels[1] == reels[2]: win = {'💎': bet * 25, 'BAR': bet * 15, '🍀': bet * 10}.get(reels[0], bet * 5)
-    elif reels[0] == reels[1] or reels[1] == reels[2]: win = {'💎': bet * 3}.get(reels[1], bet * 2)
-    if win > 0: await update_balance(message.from_user.id, coins=win, earned=True); await message.answer(f"🎉 **Поздравляем!** Вы выиграли **{win}** монет!")
+    win = slots_payout(bet, reels)
+    if win > 0 and not await update_balance(message.from_user.id, coins=win, earned=True): await message.answer(PAYOUT_FAILED_TEXT)
+    elif win > 0: await message.answer(f"🎉 **Поздравляем!** Вы выиграли **{win}** монет!")
     else: await message.answer("😕 Увы, не повезло.")
     
-@main_router.callback_query(F.data == "game:duel")
+@callbacks.route("game:duel")
 async def cb_game_duel(callback: CallbackQuery):
     user_inventory = await get_user_inventory(callback.from_user.id)
-    card_items = [item for item in user_inventory if ITEMS.get(item[0], {}).get('type') == 'card']
+    cat = catalog
+    card_items = [item for item in user_inventory if cat.items.get(item[0], {}).get('type') == 'card']
     if not card_items: return await callback.answer("У вас нет карт для дуэли!", show_alert=True)
     
     kb = InlineKeyboardBuilder()
     for card_id, count in card_items:
-        kb.button(text=f"{ITEMS[card_id]['name']} ({count} шт.)", callback_data=f"duel_card:{card_id}")
+        kb.button(text=f"{cat.items[card_id]['name']} ({count} шт.)", callback_data=f"duel_card:{card_id}")
     kb.button(text="⬅️ Назад", callback_data="menu:games"); kb.adjust(1)
     await callback.message.edit_text("Выберите карту для дуэли:", reply_markup=kb.as_markup())
 
-@main_router.callback_query(F.data.startswith("duel_card:"))
-async def process_card_duel(callback: CallbackQuery):
-    user_card_id = callback.data.split(":")[1]; user_card = ITEMS[user_card_id]
+@callbacks.route("duel_card", user_card_id=str)
+async def process_card_duel(callback: CallbackQuery, user_card_id: str):
+    cat = catalog; user_card = cat.items.get(user_card_id)
+    if not user_card or user_card['type'] != 'card': return await callback.answer()
     
-    await remove_item_from_inventory(callback.from_user.id, user_card_id, 1)
+    if not await remove_item_from_inventory(callback.from_user.id, user_card_id, 1):
+        return await callback.answer("У вас нет этой карты!", show_alert=True)
 
-    bot_card_id = random.choice([cid for cid, cinfo in ITEMS.items() if cinfo['type'] == 'card'])
-    bot_card = ITEMS[bot_card_id]
+    bot_card = cat.items[random.choice(cat.items_by_type['card'])]
     
     await callback.message.edit_text(f"Вы выбрали: *{user_card['name']}* ({user_card['rarity']})\nБот выбирает карту...")
     await asyncio.sleep(2)
@@ -752,126 +1183,161 @@ async def process_card_duel(callback: CallbackQuery):
     result_text = f"Вы: *{user_card['name']}* (Сила: {user_card['power']})\nБот: *{bot_card['name']}* (Сила: {bot_card['power']})\n\n"
     
     if user_card['power'] > bot_card['power']:
-        win_amount = user_card['power'] * 1000
-        await update_balance(callback.from_user.id, coins=win_amount, earned=True)
+        win_amount = duel_payout(user_card['power'], bot_card['power'])
+        if not await update_balance(callback.from_user.id, coins=win_amount, earned=True):
+            return await callback.message.edit_text(PAYOUT_FAILED_TEXT, reply_markup=get_back_button("menu:games"))
         result_text += f"🎉 **Вы победили** и получаете **{win_amount:,}** монет!"
     elif bot_card['power'] > user_card['power']: result_text += "😕 **Вы проиграли**."
     else: result_text += "🤝 **Ничья!**"
         
     await callback.message.edit_text(result_text, reply_markup=get_back_button("menu:games"))
 
-@main_router.callback_query(F.data == "menu:profile")
-async def cb_profile(callback: CallbackQuery):
-    user = await get_user(callback.from_user.id)
-    if not user: return await callback.answer("Произошла ошибка, перезапустите бота /start", show_alert=True)
-    level = user['rank_level']; rank_name = RANKS[level][1]; progress_text = ""
-    next_rank_coins = RANKS.get(level + 1, (None, ""))[0]
+async def profile_screen(user_id):
+    user = await get_user(user_id)
+    if not user: return None
+    ranks = catalog.ranks
+    level = user['rank_level']; rank_name = ranks[level][1]; progress_text = ""
+    next_rank_coins = ranks.get(level + 1, (None, ""))[0]
     if next_rank_coins and next_rank_coins != float('inf'):
-        current_rank_coins = RANKS[level][0]
+        current_rank_coins = ranks[level][0]
         progress = (user['total_coins_earned'] - current_rank_coins) / (next_rank_coins - current_rank_coins)
         progress = max(0, min(1, progress))
         progress_bar = "█" * int(progress * 10) + "░" * (10 - int(progress * 10))
         progress_text = f"\n\n*Прогресс до ранга:*\n`{progress_bar}` {int(progress*100)}%"
     username = user['username'] or "Без_имени"
     profile_text = (f"👤 **Профиль @{escape_markdown(username)}**\n\n👑 *Ранг:* {rank_name}\n💰 *Монеты:* {user['coins']:,}\n⭐ *Звёздочки:* {user['stars']:,}{progress_text}")
-    await callback.message.edit_text(profile_text, reply_markup=get_back_button())
+    return profile_text, get_back_button()
+
+@callbacks.route("menu:profile")
+async def cb_profile(callback: CallbackQuery):
+    screen = await render_screen("profile", callback.from_user.id, profile_screen)
+    if not screen: return await callback.answer("Произошла ошибка, перезапустите бота /start", show_alert=True)
+    await callback.message.edit_text(screen[0], reply_markup=screen[1])
     
-@main_router.callback_query(F.data == "menu:daily_bonus")
+def _claim_daily_bonus(conn, user_id, streak, day, reward):
+    conn.execute("UPDATE users SET daily_bonus_streak = ?, last_bonus_date = ? WHERE user_id = ?", (streak, day, user_id))
+    return _apply_balance_delta(conn, user_id, reward, 0, reward)
+
+@callbacks.route("menu:daily_bonus")
 async def cb_daily_bonus(callback: CallbackQuery):
     user_id = callback.from_user.id; user = await get_user(user_id); today = datetime.now().date()
     last_bonus_date = datetime.strptime(user['last_bonus_date'], '%Y-%m-%d').date() if user['last_bonus_date'] else None
     if last_bonus_date == today: return await callback.answer("Вы уже получали бонус сегодня!", show_alert=True)
-    streak = (user['daily_bonus_streak'] % 7) + 1 if last_bonus_date and (today - last_bonus_date).days == 1 else 1
-    base_reward = 100 * streak
+    streak = daily_bonus_streak(user['daily_bonus_streak'], bool(last_bonus_date) and (today - last_bonus_date).days == 1)
+    base_reward = daily_bonus_reward(streak)
     reward_text = f"🎉 Вы получили бонус: **{base_reward}** монет.\nВаша серия: **{streak}** дней."
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET daily_bonus_streak = ?, last_bonus_date = ? WHERE user_id = ?", (streak, today.strftime('%Y-%m-%d'), user_id))
-    await update_balance(user_id, coins=base_reward, earned=True)
+    user, promoted = await db.batch(_claim_daily_bonus, user_id, streak, today.strftime('%Y-%m-%d'), base_reward)
+    if not publish_balance(user, promoted, coins=base_reward, earned=base_reward): return await callback.answer(PAYOUT_FAILED_TEXT, show_alert=True)
     await callback.answer(reward_text.replace("*", "").replace("`", ""), show_alert=True)
     
-@main_router.callback_query(F.data == "menu:tops")
+@callbacks.route("menu:tops")
 async def cb_tops_menu(callback: CallbackQuery):
-    kb = InlineKeyboardBuilder(); kb.button(text="🏆 Топ по монетам", callback_data="top:coins"); kb.button(text="⭐ Топ по звёздочкам", callback_data="top:stars")
-    kb.button(text="⬅️ Назад", callback_data="menu:main"); kb.adjust(1); await callback.message.edit_text("Выберите рейтинг:", reply_markup=kb.as_markup())
+    await callback.message.edit_text("Выберите рейтинг:", reply_markup=TOPS_MENU_KEYBOARD)
 
 async def show_top_list(callback: CallbackQuery, top_type: str, currency_name: str, emoji: str):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row; cursor = conn.cursor()
-        cursor.execute(f"SELECT username, {top_type} FROM users WHERE {top_type} > 0 ORDER BY {top_type} DESC LIMIT 10")
-        top_users = cursor.fetchall()
+    board = await get_leaderboard(top_type)
+    top_users = board.top_entries()
     if not top_users: return await callback.answer("Рейтинг пока пуст!", show_alert=True)
     top_text = f"🏆 **Топ-10 по {currency_name}**\n\n"
-    for i, user in enumerate(top_users, 1):
-        place_emoji = {1: "🥇", 2: "🥈", 3: "🥉"}.get(i, f"**{i}.**"); username = user['username'] or "Скрытный_игрок"
-        top_text += f"{place_emoji} @{escape_markdown(username)} — **{user[top_type]:,}** {emoji}\n"
+    for i, (_, username, value) in enumerate(top_users, 1):
+        place_emoji = {1: "🥇", 2: "🥈", 3: "🥉"}.get(i, f"**{i}.**"); username = username or "Скрытный_игрок"
+        top_text += f"{place_emoji} @{escape_markdown(username)} — **{value:,}** {emoji}\n"
+    user = await get_user(callback.from_user.id)
+    position = board.position(user[top_type]) if user else None
+    top_text += f"\nВаше место: **{position}** из {len(board)}" if position else "\nВы пока не в рейтинге."
     await callback.message.edit_text(top_text, reply_markup=get_back_button("menu:tops"))
 
-@main_router.callback_query(F.data == "top:coins")
+@callbacks.route("top:coins")
 async def cb_top_coins(callback: CallbackQuery): await show_top_list(callback, "coins", "монетам", "💰")
 
-@main_router.callback_query(F.data == "top:stars")
+@callbacks.route("top:stars")
 async def cb_top_stars(callback: CallbackQuery): await show_top_list(callback, "stars", "звёздочкам", "⭐")
 
-@main_router.callback_query(F.data == "menu:cases")
-async def cb_cases_menu(callback: CallbackQuery):
-    user = await get_user(callback.from_user.id); kb = InlineKeyboardBuilder()
+@callbacks.route("top:earned")
+async def cb_top_earned(callback: CallbackQuery): await show_top_list(callback, "total_coins_earned", "заработку", "💰")
+
+def build_cases_menu(user, key_count):
+    kb = InlineKeyboardBuilder(); rows = []
     text = "🎁 **Магазин кейсов**\n\n"
-    for case_id, info in CASES.items():
-        if info.get('currency') == 'key1': continue
-        cost, currency, emoji = info['cost'], info.get('currency', 'coins'), {'coins': '💰', 'stars': '⭐'}[info.get('currency', 'coins')]
-        text += f"**{info['name']}**\nЦена: {cost:,} {emoji}\n\n";
-        if user[currency] >= cost: kb.button(text=f"Открыть {info['name']}", callback_data=f"case:{case_id}")
-    
-    user_inventory = await get_user_inventory(callback.from_user.id)
-    key_count = next((count for item_id, count in user_inventory if item_id == 'key1'), 0)
-    if key_count > 0: kb.button(text=f"🔑 Открыть Сокровищницу ({key_count} шт.)", callback_data="case:treasure")
-        
-    kb.button(text="⬅️ Назад", callback_data="menu:main"); kb.adjust(1); await callback.message.edit_text(text, reply_markup=kb.as_markup())
-
-@main_router.callback_query(F.data.startswith("case:"))
-async def cb_open_case(callback: CallbackQuery):
-    case_id, user_id = callback.data.split(":")[1], callback.from_user.id; case_info, user = CASES[case_id], await get_user(user_id)
-    cost, cost_currency = case_info['cost'], case_info.get('currency', 'coins')
-
-    if cost_currency == 'key1':
-        user_inventory = await get_user_inventory(user_id)
-        if not any(item_id == 'key1' for item_id, _ in user_inventory): return await callback.answer("У вас нет ключей!", show_alert=True)
-        await remove_item_from_inventory(user_id, 'key1', 1)
-    elif user[cost_currency] < cost: return await callback.answer("У вас недостаточно средств!", show_alert=True)
-    else: await update_balance(user_id, coins=-cost if cost_currency == 'coins' else 0, stars=-cost if cost_currency == 'stars' else 0)
-    
-    await update_quest_progress(user_id, 'open_case')
-    rand_val = random.randint(1, 100); cumulative_chance = 0; prize = None
-    for p in case_info['prizes']:
-        cumulative_chance += p['chance'];
-        if rand_val <= cumulative_chance: prize = p; break
-    if not prize: return await callback.message.answer("Что-то пошло не так...")
-    
-    prize_text = ""
-    if prize['type'] == 'coins':
-        amount = random.randint(prize['amount'][0], prize['amount'][1])
-        await update_balance(user_id, coins=amount, earned=True); prize_text = f"🎉 Вы выиграли **{amount:,} монет** 💰!"
-    elif prize['type'] == 'stars':
-        amount = prize['amount'] if isinstance(prize['amount'], int) else random.randint(prize['amount'][0], prize['amount'][1])
-        await update_balance(user_id, stars=amount); prize_text = f"🌟 Вы выиграли **{amount:,} звёздочек** ⭐!"
-    elif prize['type'] == 'item':
-        item_id = prize['item_id']; item_info = ITEMS[item_id]
-        await add_item_to_inventory(user_id, item_id)
-        prize_text = f"Предмет!\n\nВы получили: *{item_info['rarity']} {item_info['name']}*"
-
-    await callback.answer(f"Открываем {case_info['name']}...", show_alert=False); await callback.message.answer(prize_text); await cb_cases_menu(callback)
-
-@main_router.callback_query(F.data == "menu:exchange")
+    for case_id, name, cost, currency, emoji in catalog.shop_cases:
+        text += f"**{name}**\nЦена: {cost:,} {emoji}\n\n";
+        counts = [n for n in CASE_BULK_COUNTS if user[currency] >= cost * n]
+        for n in counts: kb.button(text=f"Открыть {name}" if n == 1 else f"×{n}", callback_data=f"case:{case_id}:{n}")
+        if counts: rows.append(len(counts))
+
+    counts = [n for n in CASE_BULK_COUNTS if key_count >= n]
+    for n in counts: kb.button(text=f"🔑 Открыть Сокровищницу ({key_count} шт.)" if n == 1 else f"×{n}", callback_data=f"case:treasure:{n}")
+    if counts: rows.append(len(counts))
+
+    kb.button(text="⬅️ Назад", callback_data="menu:main"); kb.adjust(*rows, 1); return text, kb.as_markup()
+
+async def cases_screen(user_id, key_count=None):
+    return build_cases_menu(await get_user(user_id), await get_item_count(user_id, 'key1') if key_count is None else key_count)
+
+@callbacks.route("menu:cases")
+async def cb_cases_menu(callback: CallbackQuery):
+    text, markup = await render_screen("cases", callback.from_user.id, cases_screen)
+    await callback.message.edit_text(text, reply_markup=markup)
+
+def roll_case_prizes(case_id, count, cat=None):
+    """Розігрує count кейсів за один виклик random.choices і підсумовує виграш: (монети, зірки, Counter предметів)."""
+    prizes, cum_weights = (cat or catalog).case_prize_tables[case_id]
+    coins = stars = 0; items = Counter()
+    for prize in random.choices(prizes, cum_weights=cum_weights, k=count):
+        if prize['type'] == 'coins': coins += random.randint(prize['amount'][0], prize['amount'][1])
+        elif prize['type'] == 'stars': stars += prize['amount'] if isinstance(prize['amount'], int) else random.randint(prize['amount'][0], prize['amount'][1])
+        elif prize['type'] == 'item': items[prize['item_id']] += 1
+    return coins, stars, items
+
+def _open_cases(conn, user_id, case_id, cost, currency, count, coins, stars, items, day):
+    # Оплата, виграш, предмети і прогрес квесту — одна транзакція
+    if currency in ('coins', 'stars'):
+        paid, _ = _apply_balance_delta(conn, user_id, -cost if currency == 'coins' else 0, -cost if currency == 'stars' else 0, 0)
+        if not paid: return None
+    elif not _remove_items(conn, user_id, currency, cost): return None
+    user, promoted = _apply_balance_delta(conn, user_id, coins, stars, coins)
+    for item_id, quantity in items.items(): _add_items(conn, user_id, item_id, quantity)
+    _bump_stat(conn, f"case:{case_id}", count)
+    key_count = conn.execute("SELECT count FROM inventory WHERE user_id = ? AND item_id = 'key1'", (user_id,)).fetchone()
+    return user, promoted, key_count[0] if key_count else 0, _apply_quest_progress(conn, user_id, {'open_case': count}, day)
+
+@callbacks.route("case", case_id=str, count=int)
+async def cb_open_case(callback: CallbackQuery, case_id: str, count: int = 1):
+    cat = catalog
+    if case_id not in cat.cases or count not in CASE_BULK_COUNTS: return await callback.answer()
+    user_id, case_info = callback.from_user.id, cat.cases[case_id]
+    cost, cost_currency = case_info['cost'] * count, case_info['currency']
+
+    coins, stars, items = roll_case_prizes(case_id, count, cat)
+    result = await db.batch(_open_cases, user_id, case_id, cost, cost_currency, count, coins, stars, items, date.today().toordinal())
+    if not result: return await callback.answer("У вас нет ключей!" if cost_currency == 'key1' else "У вас недостаточно средств!", show_alert=True)
+    user, promoted, key_count, completed = result
+    publish_balance(user, promoted, coins - (cost if cost_currency == 'coins' else 0), stars - (cost if cost_currency == 'stars' else 0), coins)
+    await reward_quests(user_id, completed)
+
+    if count == 1:
+        if coins: prize_text = f"🎉 Вы выиграли **{coins:,} монет** 💰!"
+        elif stars: prize_text = f"🌟 Вы выиграли **{stars:,} звёздочек** ⭐!"
+        else: item_info = cat.items[next(iter(items))]; prize_text = f"Предмет!\n\nВы получили: *{item_info['rarity']} {item_info['name']}*"
+    else:
+        lines = []
+        if coins: lines.append(f"💰 {coins:,} монет")
+        if stars: lines.append(f"⭐ {stars:,} звёздочек")
+        lines += [f"{cat.items[item_id]['rarity']} {cat.items[item_id]['name']} x{items[item_id]}" for item_id in cat.items if item_id in items]
+        prize_text = f"🎁 Открыто **{count}** × {case_info['name']}\n\n*Выигрыш:*\n" + "\n".join(lines)
+
+    await callback.answer(f"Открываем {case_info['name']}...", show_alert=False); await callback.message.answer(prize_text)
+    text, markup = await render_screen("cases", user_id, cases_screen, key_count)
+    try: await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest: pass  # меню не змінилось
+
+@callbacks.route("menu:exchange")
 async def cb_exchange_menu(callback: CallbackQuery):
-    kb = InlineKeyboardBuilder();
-    kb.button(text=f"Продать ⭐ за 💰 ({STAR_SELL_PRICE:,})", callback_data="exchange:s2c")
-    kb.button(text=f"Купить ⭐ за 💰 ({STAR_BUY_PRICE:,})", callback_data="exchange:c2s")
-    kb.button(text="⬅️ Назад", callback_data="menu:main"); kb.adjust(2,1); await callback.message.edit_text("💱 **Обмен валют**", reply_markup=kb.as_markup())
-
-@main_router.callback_query(F.data.in_({"exchange:s2c", "exchange:c2s"}))
-async def cb_start_exchange(callback: CallbackQuery, state: FSMContext):
-    exchange_type = callback.data.split(":")[1]; await state.update_data(type=exchange_type); await state.set_state(ExchangeStates.amount)
+    await callback.message.edit_text("💱 **Обмен валют**", reply_markup=EXCHANGE_MENU_KEYBOARD)
+
+@callbacks.route("exchange", exchange_type={"s2c", "c2s"})
+async def cb_start_exchange(callback: CallbackQuery, state: FSMContext, exchange_type: str):
+    await state.update_data(type=exchange_type); await state.set_state(ExchangeStates.amount)
     prompt = f"Введите количество звёздочек.\n\n_Напишите 'отмена'._"
     await callback.message.edit_text(prompt)
 
@@ -880,40 +1346,134 @@ async def process_exchange_amount(message: Message, state: FSMContext):
     if not message.text.isdigit(): return await message.reply("❌ Количество должно быть числом.")
     amount = int(message.text)
     if amount <= 0: return await message.reply("❌ Количество должно быть больше нуля.")
-    data = await state.get_data(); user = await get_user(message.from_user.id); await state.clear()
+    data = await state.get_data(); await state.clear()
     if data['type'] == 's2c':
-        if user['stars'] < amount: return await message.answer("❌ У вас недостаточно звёздочек.")
         coins_get = amount * STAR_SELL_PRICE
-        await update_balance(message.from_user.id, stars=-amount, coins=coins_get, earned=True)
+        if not await update_balance(message.from_user.id, stars=-amount, coins=coins_get, earned=True): return await message.answer("❌ У вас недостаточно звёздочек.")
         await message.answer(f"✅ Вы продали **{amount}** ⭐ и получили **{coins_get:,}** 💰.")
     elif data['type'] == 'c2s':
         cost = amount * STAR_BUY_PRICE
-        if user['coins'] < cost: return await message.answer(f"❌ У вас недостаточно монет. Нужно **{cost:,}** 💰.")
-        await update_balance(message.from_user.id, stars=amount, coins=-cost)
+        if not await update_balance(message.from_user.id, stars=amount, coins=-cost): return await message.answer(f"❌ У вас недостаточно монет. Нужно **{cost:,}** 💰.")
         await message.answer(f"✅ Вы купили **{amount}** ⭐ за **{cost:,}** 💰.")
 
 @main_router.message()
 async def any_message(message: Message):
     if ADMIN_IDS and str(message.from_user.id) not in ADMIN_IDS:
-        try:
-            user_info_text = (f"Сообщение от: @{message.from_user.username or 'Без_имени'}\nID: {message.from_user.id}")
-            for admin_id in ADMIN_IDS:
-                await bot.send_message(admin_id, user_info_text)
-                await bot.forward_message(chat_id=admin_id, from_chat_id=message.chat.id, message_id=message.message_id)
-        except Exception as e: logging.error(f"Не удалось переслать сообщение: {e}")
+        user_info_text = (f"Сообщение от: @{message.from_user.username or 'Без_имени'}\nID: {message.from_user.id}")
+        for admin_id in ADMIN_IDS:
+            # Порядок внутри чата сохраняется: пересланное сообщение уйдёт сразу после подписи
+            outbox.send_message(admin_id, user_info_text, priority=ADMIN)
+            outbox.submit(admin_id, lambda admin_id=admin_id: bot.forward_message(chat_id=admin_id, from_chat_id=message.chat.id, message_id=message.message_id))
 
 # ----- 🚀 ЗАПУСК БОТА 🚀 -----
-async def main():
-    if not BOT_TOKEN: return logging.critical("ОШИБКА: Токен не найден.")
-    
+background_tasks = []
+
+def setup_dispatcher():
+    # Флуд відсікається першим, далі черга користувача — перед FSM: стан читається вже всередині черги
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(flood_guard.middleware(flood_class, "⏳ Слишком часто, подождите немного."))
+    dp.update.outer_middleware(lanes.middleware())
+    dp.update.outer_middleware(dp.fsm)
+    for observer in (dp.message, dp.callback_query):
+        observer.outer_middleware(metrics.middleware())
+        observer.middleware(metrics.handler_middleware())
+    # Request middleware живуть у сесії: ставимся на ту, що зараз у бота (тести й бенчмарки її підміняють).
+    # Ліміт — зовнішнім, щоб метрики API міряли сам запит, а не очікування токена
+    bot.session.middleware(api_limiter.request_middleware())
+    bot.session.middleware(metrics.request_middleware())
     dp.message.middleware(SponsorshipMiddleware())
     dp.callback_query.middleware(SponsorshipMiddleware())
-    dp.include_router(main_router)
+    dp.include_routers(callbacks, main_router)
+
+async def startup():
+    await init_db()
+    await rebuild_leaderboards()
+    outbox.start()
+    fsm_storage.start()
+    background_tasks.append(asyncio.create_task(catalog_watcher()))
+    if SPONSOR_CHANNEL: background_tasks.append(asyncio.create_task(subscription_refresher()))
+    # Фонові задачі в одному екземплярі — тільки у воркера #0
+    if WORKER_INDEX == 0:
+        background_tasks.append(asyncio.create_task(migrate_legacy_inventory()))
+        background_tasks.append(asyncio.create_task(economy_reconciler()))
+        await broadcaster.resume_all()
+        await job_runner.resume_all()
+    if WORKERS > 1: background_tasks.append(asyncio.create_task(shard_sync()))
+    if METRICS_PORT:
+        # Кожен воркер віддає свої метрики на власному порту: METRICS_PORT + 1 + WORKER_INDEX
+        port = METRICS_PORT + 1 + WORKER_INDEX if BOT_ROLE == "worker" else METRICS_PORT
+        await metrics.start_server(METRICS_HOST, port)
+        logging.info(f"Метрики: http://{METRICS_HOST}:{port}/metrics")
+
+async def shutdown():
+    for task in background_tasks: task.cancel()
+    await lanes.stop()
+    await broadcaster.stop()
+    await job_runner.stop()
+    await outbox.stop()
+    await fsm_storage.close()
+    await metrics.stop_server()
+    await db.close()
+
+async def run_webhook():
+    if not WEBHOOK_URL or not WEBHOOK_SECRET: return logging.critical("ОШИБКА: Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET.")
+    server = WebhookServer(dp, bot, WEBHOOK_SECRET, path=WEBHOOK_PATH)
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    await server.set_webhook(WEBHOOK_URL, drop_pending_updates=True)
+    logging.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try: await asyncio.Event().wait()
+    finally: await server.stop()
+
+async def run_workers():
+    """Процес прийому: сам нічого не обробляє, а роздає оновлення воркерам за user_id."""
+    if BOT_MODE == "webhook" and (not WEBHOOK_URL or not WEBHOOK_SECRET): return logging.critical("ОШИБКА: Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET.")
+    # Схему створюємо один раз тут, до запуску воркерів
+    await init_db()
+    await db.close()
+    router = ShardRouter([sys.executable, os.path.abspath(__file__)], WORKERS)
+    await router.start()
+    logging.info(f"Запущено воркеров: {WORKERS}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, stop.set)
+    try:
+        if BOT_MODE == "webhook":
+            server = WebhookServer(dp, bot, WEBHOOK_SECRET, path=WEBHOOK_PATH, sink=router.route)
+            await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+            await server.set_webhook(WEBHOOK_URL, drop_pending_updates=True)
+            logging.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            try: await stop.wait()
+            finally: await server.stop()
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await poll_updates(bot, router.route, dp.resolve_used_update_types(), stop=stop)
+    finally:
+        await router.stop()
+        await bot.session.close()
+        logging.info(f"Воркеры остановлены, обновлений по воркерам: {dict(router.routed)}")
+
+async def run_worker():
+    await startup()
+    try: await serve_worker(dp, bot, WORKER_CONCURRENCY, WORKER_INDEX)
+    finally:
+        await shutdown()
+        await bot.session.close()
+
+async def main():
+    if not BOT_TOKEN: return logging.critical("ОШИБКА: Токен не найден.")
     
-    init_db()
+    setup_dispatcher()
+    if BOT_ROLE == "worker": return await run_worker()
+    if WORKERS > 1: return await run_workers()
+    await startup()
     
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook": await run_webhook()
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
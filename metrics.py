@@ -0,0 +1,201 @@
+# metrics.py
+
+import contextvars
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_trace = contextvars.ContextVar("update_trace", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines, cumulative = [], 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class UpdateTrace:
+    """Усе, що сталося під час обробки одного оновлення."""
+    __slots__ = ("started", "handler", "statements", "rows", "api_calls")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler = "unhandled"
+        self.statements = []  # (секунди від початку, sql)
+        self.rows = 0
+        self.api_calls = []  # (метод, тривалість)
+
+
+class Metrics:
+    """Метрики обробки оновлень у форматі Prometheus.
+
+    Оновлення прив'язується до запитів SQLite і Bot API через contextvar: trace-хук
+    з'єднання і лічильник змінених рядків викликаються в потоці бази з контекстом
+    того хендлера, що зробив запит (див. Database.on_statement / on_call).
+    Оновлення, що обробляється довше за slow_threshold, пишеться в лог разом з
+    усіма своїми SQL-запитами.
+    """
+
+    def __init__(self, slow_threshold=1.0, logger=None):
+        self.slow_threshold = slow_threshold
+        self.logger = logger or logging.getLogger("slow_updates")
+        self.update_latency = defaultdict(Histogram)
+        self.updates = Counter()  # (handler, status)
+        self.sql_statements = Counter()  # handler
+        self.sql_rows = Counter()  # handler
+        self.api_latency = defaultdict(Histogram)
+        self.api_requests = Counter()  # (method, status)
+        self.in_flight = self.in_flight_max = 0
+        self.gauges = []  # (prefix, функція -> {name: число})
+        self._last_statement = None  # змінюється тільки в потоці бази
+        self._runner = None
+
+    # --- хуки ---
+    def on_statement(self, sql):
+        # Кожне спрацювання тригера SQLite повідомляє текстом батьківського запиту — рахуємо його один раз
+        if sql == self._last_statement: return
+        self._last_statement = sql
+        trace = _current_trace.get()
+        if trace is None: self.sql_statements["background"] += 1
+        else: trace.statements.append((time.perf_counter() - trace.started, sql))
+
+    def on_db_call(self, rows):
+        self._last_statement = None
+        trace = _current_trace.get()
+        if trace is None: self.sql_rows["background"] += rows
+        else: trace.rows += rows
+
+    def add_gauges(self, prefix, collect):
+        self.gauges.append((prefix, collect))
+
+    def middleware(self):
+        return _UpdateMiddleware(self)
+
+    def handler_middleware(self):
+        return _HandlerMiddleware()
+
+    def request_middleware(self):
+        return _RequestMiddleware(self)
+
+    # --- запис результату ---
+    def _finish(self, trace, status):
+        elapsed = time.perf_counter() - trace.started
+        self.update_latency[trace.handler].observe(elapsed)
+        self.updates[trace.handler, status] += 1
+        self.sql_statements[trace.handler] += len(trace.statements)
+        self.sql_rows[trace.handler] += trace.rows
+        if elapsed >= self.slow_threshold:
+            queries = "\n".join(f"  +{offset * 1000:8.1f} ms  {sql}" for offset, sql in trace.statements)
+            calls = ", ".join(f"{method} {duration * 1000:.0f} ms" for method, duration in trace.api_calls)
+            self.logger.warning(f"Медленное обновление: {trace.handler} {elapsed * 1000:.0f} ms, SQL: {len(trace.statements)}, "
+                                f"строк изменено: {trace.rows}, API: [{calls}]\n{queries}")
+
+    def render(self):
+        lines = ["# TYPE bot_update_duration_seconds histogram"]
+        for handler, histogram in self.update_latency.items(): lines += histogram.render("bot_update_duration_seconds", f'handler="{handler}"')
+        lines.append("# TYPE bot_updates_total counter")
+        lines += [f'bot_updates_total{{handler="{handler}",status="{status}"}} {count}' for (handler, status), count in self.updates.items()]
+        lines.append("# TYPE bot_sql_statements_total counter")
+        lines += [f'bot_sql_statements_total{{handler="{handler}"}} {count}' for handler, count in self.sql_statements.items()]
+        lines.append("# TYPE bot_sql_rows_changed_total counter")
+        lines += [f'bot_sql_rows_changed_total{{handler="{handler}"}} {count}' for handler, count in self.sql_rows.items()]
+        lines.append("# TYPE bot_api_request_duration_seconds histogram")
+        for method, histogram in self.api_latency.items(): lines += histogram.render("bot_api_request_duration_seconds", f'method="{method}"')
+        lines.append("# TYPE bot_api_requests_total counter")
+        lines += [f'bot_api_requests_total{{method="{method}",status="{status}"}} {count}' for (method, status), count in self.api_requests.items()]
+        lines += ["# TYPE bot_updates_in_flight gauge", f"bot_updates_in_flight {self.in_flight}",
+                  "# TYPE bot_updates_in_flight_max gauge", f"bot_updates_in_flight_max {self.in_flight_max}"]
+        for prefix, collect in self.gauges:
+            try: values = collect()
+            except Exception as e:
+                logging.warning(f"Метрики {prefix}: {e}"); continue
+            for name, value in values.items():
+                lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    # --- HTTP ---
+    async def handle(self, request):
+        return web.Response(text=self.render(), content_type="text/plain", headers={"Cache-Control": "no-cache"})
+
+    async def start_server(self, host, port, path="/metrics"):
+        app = web.Application()
+        app.router.add_get(path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop_server(self):
+        if self._runner: await self._runner.cleanup()
+
+
+class _UpdateMiddleware(BaseMiddleware):
+    """Зовнішній middleware: вимірює оновлення цілком, разом з рештою middleware і фільтрами."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        metrics, trace = self.metrics, UpdateTrace()
+        token = _current_trace.set(trace)
+        metrics.in_flight += 1; metrics.in_flight_max = max(metrics.in_flight_max, metrics.in_flight)
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            metrics.in_flight -= 1
+            _current_trace.reset(token)
+            metrics._finish(trace, status)
+
+
+class _HandlerMiddleware(BaseMiddleware):
+    """Внутрішній middleware: тільки запам'ятовує, який хендлер обрано."""
+
+    async def __call__(self, handler, event, data):
+        trace = _current_trace.get()
+        if trace is not None: trace.handler = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class _RequestMiddleware(BaseRequestMiddleware):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name, started, status = method.__api_method__, time.perf_counter(), "error"
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        finally:
+            duration = time.perf_counter() - started
+            self.metrics.api_latency[name].observe(duration)
+            self.metrics.api_requests[name, status] += 1
+            trace = _current_trace.get()
+            if trace is not None: trace.api_calls.append((name, duration))
@@ -0,0 +1,170 @@
+# outbox.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from ratelimit import TokenBucket
+
+NOTIFICATION, ADMIN = 0, 1
+LANE_NAMES = ("notification", "admin")
+MESSAGE_LIMIT = 4096
+
+
+class _Entry:
+    __slots__ = ("priority", "chat_id", "text", "kwargs", "call", "due", "enqueued")
+
+    def __init__(self, priority, chat_id, text=None, kwargs=None, call=None, due=0.0):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs or {}
+        self.call = call
+        self.due = due
+        self.enqueued = time.monotonic()
+
+
+class Outbox:
+    """Черга фонових повідомлень (сповіщення, адмінам), щоб хендлери не чекали на мережу.
+
+    Дві смуги пріоритету: notification, admin — завжди береться перший готовий запис
+    із вищої смуги. Глобальний ліміт — спільний BotRateLimiter бота: відповіді хендлерів
+    ідуть через нього напряму й мають перевагу, outbox бере лише залишок. Крім того,
+    діє ліміт на чат, і на один чат одночасно летить не більше одного запиту, тож
+    порядок повідомлень у чаті зберігається. Сповіщення в той самий чат протягом
+    coalesce_window склеюються в одне повідомлення, не довше MESSAGE_LIMIT.
+    """
+
+    def __init__(self, bot, limiter, chat_rate=1, chat_burst=3, coalesce_window=1.0,
+                 max_concurrency=10, max_attempts=3, scan_limit=100):
+        self.bot = bot
+        self.limiter = limiter
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.scan_limit = scan_limit
+        self.lanes = (deque(), deque())
+        self._chat_buckets = {}
+        self._coalescing = {}  # chat_id -> запис-сповіщення, який ще можна доповнити
+        self._in_flight = set()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._sends = set()
+        self.sent = self.failed = self.coalesced = self.retried = 0
+        self.latencies = deque(maxlen=1000)
+
+    # --- постановка в чергу ---
+    def send_message(self, chat_id, text, priority=NOTIFICATION, **kwargs):
+        if priority == NOTIFICATION and not kwargs:
+            entry = self._coalescing.get(chat_id)
+            if entry is not None and len(entry.text) + 2 + len(text) <= MESSAGE_LIMIT:
+                entry.text += "\n\n" + text
+                self.coalesced += 1
+                return
+            entry = _Entry(priority, chat_id, text, due=time.monotonic() + self.coalesce_window)
+            self._coalescing[chat_id] = entry
+        else: entry = _Entry(priority, chat_id, text, kwargs)
+        self._push(entry)
+
+    def submit(self, chat_id, call, priority=ADMIN):
+        """call — функція без аргументів, що повертає корутину запиту до API."""
+        self._push(_Entry(priority, chat_id, call=call))
+
+    def _push(self, entry):
+        self.lanes[entry.priority].append(entry)
+        self._wakeup.set()
+
+    # --- відправка ---
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None: bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _take_ready(self, now):
+        for lane in self.lanes:
+            for index, entry in enumerate(lane):
+                if index >= self.scan_limit: break
+                if entry.due > now or entry.chat_id in self._in_flight: continue
+                if not self._chat_bucket(entry.chat_id).try_acquire(): continue
+                del lane[index]
+                if self._coalescing.get(entry.chat_id) is entry: del self._coalescing[entry.chat_id]
+                return entry
+        return None
+
+    async def _deliver(self, entry):
+        try:
+            for _ in range(self.max_attempts):
+                try:
+                    with self.limiter.background():
+                        if entry.call: await entry.call()
+                        else: await self.bot.send_message(entry.chat_id, entry.text, **entry.kwargs)
+                    self.sent += 1
+                    self.latencies.append(time.monotonic() - entry.enqueued)
+                    return
+                except TelegramRetryAfter as e:
+                    self.retried += 1
+                    # Flood wait діє на весь бот, а не лише на цей чат
+                    self.limiter.pause(e.retry_after)
+                    self._chat_bucket(entry.chat_id).pause(e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+                except TelegramForbiddenError:
+                    break
+                except Exception as e:
+                    logging.warning(f"Outbox: не удалось отправить в {entry.chat_id}: {e}")
+                    break
+            self.failed += 1
+        finally:
+            self._in_flight.discard(entry.chat_id)
+            self._semaphore.release()
+            self._wakeup.set()
+
+    async def _run(self):
+        last_sweep = time.monotonic()
+        while True:
+            await self._semaphore.acquire()
+            entry = None
+            while entry is None:
+                delay = self.limiter.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                    continue
+                entry = self._take_ready(time.monotonic())
+                if entry is None:
+                    self._wakeup.clear()
+                    try: await asyncio.wait_for(self._wakeup.wait(), 0.05)
+                    except asyncio.TimeoutError: pass
+            self._in_flight.add(entry.chat_id)
+            task = asyncio.create_task(self._deliver(entry))
+            self._sends.add(task); task.add_done_callback(self._sends.discard)
+            if time.monotonic() - last_sweep > 60:
+                last_sweep = time.monotonic(); self.sweep()
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout=5):
+        deadline = time.monotonic() + drain_timeout
+        while (any(self.lanes) or self._sends) and time.monotonic() < deadline:
+            for entry in self._coalescing.values(): entry.due = 0.0
+            await asyncio.sleep(0.05)
+        if self._task: self._task.cancel()
+        await asyncio.gather(*(t for t in (self._task, *self._sends) if t), return_exceptions=True)
+        self._task = None
+
+    def sweep(self):
+        """Прибирає лічильники чатів, що давно не писали (повні відра нічого не пам'ятають)."""
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in self._in_flight and bucket.delay(bucket.capacity) == 0: del self._chat_buckets[chat_id]
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p): return latencies[min(int(len(latencies) * p), len(latencies) - 1)] if latencies else 0.0
+        return {**{f"queue_{name}": len(lane) for name, lane in zip(LANE_NAMES, self.lanes)},
+                "in_flight": len(self._in_flight), "sent": self.sent, "failed": self.failed,
+                "coalesced": self.coalesced, "retried": self.retried,
+                "latency_p50": percentile(0.5), "latency_p95": percentile(0.95)}
@@ -0,0 +1,189 @@
+# ratelimit.py
+
+import asyncio
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+# Методи API, що надсилають або змінюють повідомлення, — саме на них діє ліміт Telegram
+LIMITED_METHOD_PREFIXES = ("send", "copy", "forward", "edit")
+
+
+class TokenBucket:
+    """Класичний token bucket: rate токенів на секунду, не більше capacity у запасі.
+
+    pause() повністю зупиняє видачу токенів (наприклад, на час retry_after від Telegram).
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        now = self.clock()
+        if now < self.paused_until: return False
+        self._refill(now)
+        if self.tokens < tokens: return False
+        self.tokens -= tokens
+        return True
+
+    def delay(self, tokens=1):
+        """Скільки секунд чекати, поки стане доступно tokens токенів."""
+        now = self.clock()
+        self._refill(now)
+        return max(self.paused_until - now, (tokens - self.tokens) / self.rate, 0.0)
+
+    async def acquire(self, tokens=1):
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class BotRateLimiter:
+    """Один ліміт на всі вихідні повідомлення бота (Telegram дає ~30 на секунду на бота).
+
+    Підключається request middleware до сесії бота, тож через нього проходять і відповіді
+    хендлерів, і outbox, і розсилка. Фонові відправники виконують запити всередині
+    background() і беруть токен лише тоді, коли його не чекає жоден інтерактивний запит —
+    відповідь користувачу завжди попереду. retry_after від Telegram зупиняє видачу
+    токенів усім, бо flood wait діє на весь бот.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.bucket = TokenBucket(rate, capacity)
+        self.waiting = 0
+        self.interactive = self.background_sent = self.retry_after = 0
+        self._background = ContextVar("background_request", default=False)
+
+    @contextmanager
+    def background(self):
+        token = self._background.set(True)
+        try: yield
+        finally: self._background.reset(token)
+
+    def delay(self):
+        """Скільки чекати фоновому відправнику: поки є токен і його не чекають інтерактивні запити."""
+        return max(self.bucket.delay(), 0.01 if self.waiting else 0.0)
+
+    async def acquire(self):
+        if self._background.get():
+            while self.waiting or not self.bucket.try_acquire(): await asyncio.sleep(self.delay())
+            self.background_sent += 1
+            return
+        self.waiting += 1
+        try: await self.bucket.acquire()
+        finally: self.waiting -= 1
+        self.interactive += 1
+
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
+
+    def request_middleware(self):
+        return _RequestLimitMiddleware(self)
+
+    def stats(self):
+        return {"waiting": self.waiting, "interactive": self.interactive, "background": self.background_sent,
+                "retry_after": self.retry_after, "paused_for": max(self.bucket.paused_until - self.bucket.clock(), 0.0)}
+
+
+class _RequestLimitMiddleware(BaseRequestMiddleware):
+    """Request middleware сесії: кожне надсилання чи редагування бере токен у BotRateLimiter."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    async def __call__(self, make_request, bot, method):
+        if not method.__api_method__.startswith(LIMITED_METHOD_PREFIXES): return await make_request(bot, method)
+        await self.limiter.acquire()
+        try: return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.limiter.retry_after += 1; self.limiter.pause(e.retry_after)
+            raise
+
+
+class FloodGuard:
+    """Token bucket на кожного користувача окремо для кожного класу дій (меню, ставки, кейси...).
+
+    limits — {клас: (дій на секунду, запас)}. Відро зберігається як одне число —
+    момент, коли воно знову стане повним (GCRA, еквівалент token bucket), у словнику
+    з цілим ключем; повні відра нічим не відрізняються від відсутніх, тож раз на
+    sweep_interval вони викидаються, а словник перебудовується. Відкинуті дії
+    рахуються по користувачах (до top_size найактивніших) для розбору зловживань.
+    """
+
+    def __init__(self, limits, sweep_interval=60, top_size=1000, clock=time.monotonic):
+        self.classes = {name: index for index, name in enumerate(limits)}
+        self.intervals = [1 / rate for rate, _ in limits.values()]
+        self.tolerances = [(burst - 1) / rate for rate, burst in limits.values()]
+        self.sweep_interval = sweep_interval
+        self.top_size = top_size
+        self.clock = clock
+        self.buckets = {}  # user_id * кількість класів + клас -> коли відро знову повне
+        self.dropped = Counter()  # user_id -> відкинуто дій
+        self.dropped_by_class = Counter()
+        self.allowed = 0
+        self._next_sweep = clock() + sweep_interval
+
+    def allow(self, user_id, action):
+        now = self.clock()
+        if now >= self._next_sweep: self.sweep(now)
+        index = self.classes[action]; key = user_id * len(self.classes) + index
+        full_at = max(self.buckets.get(key, now), now)
+        if full_at - now > self.tolerances[index]:
+            self.dropped[user_id] += 1; self.dropped_by_class[action] += 1
+            return False
+        self.buckets[key] = full_at + self.intervals[index]; self.allowed += 1
+        return True
+
+    def sweep(self, now=None):
+        now = self.clock() if now is None else now
+        self.buckets = {key: full_at for key, full_at in self.buckets.items() if full_at > now}
+        if len(self.dropped) > self.top_size: self.dropped = Counter(dict(self.dropped.most_common(self.top_size)))
+        self._next_sweep = now + self.sweep_interval
+
+    def top(self, count=10):
+        return self.dropped.most_common(count)
+
+    def middleware(self, classify, notice):
+        return _FloodMiddleware(self, classify, notice)
+
+    def stats(self):
+        return {"buckets": len(self.buckets), "offenders": len(self.dropped), "allowed": self.allowed,
+                **{f"dropped_{name}": self.dropped_by_class[name] for name in self.classes}}
+
+
+class _FloodMiddleware(BaseMiddleware):
+    """Зовнішній middleware на dp.update: відкидає оновлення понад ліміт до будь-якої роботи з БД чи API.
+
+    classify(update, user) повертає клас дії або None — тоді без обмежень. На відкинутий
+    callback відповідаємо коротким notice, щоб у клієнта зник годинник; повідомлення
+    відкидаються мовчки.
+    """
+
+    def __init__(self, guard, classify, notice):
+        self.guard = guard
+        self.classify = classify
+        self.notice = notice
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        action = self.classify(event, user) if user else None
+        if action is None or self.guard.allow(user.id, action): return await handler(event, data)
+        if event.callback_query is not None:
+            try: await event.callback_query.answer(self.notice)
+            except TelegramAPIError: pass
@@ -0,0 +1,126 @@
+# sharding.py
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from collections import Counter
+
+import aiohttp
+from aiogram.types import Update
+
+
+def update_user_id(raw):
+    """user_id того, від кого оновлення (from/user у вкладеному об'єкті), інакше id чату, інакше 0."""
+    for name, value in raw.items():
+        if name == "update_id" or not isinstance(value, dict): continue
+        user = value.get("from") or value.get("user")
+        if user: return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat: return chat["id"]
+    return 0
+
+
+class ShardRouter:
+    """Процес прийому: розподіляє сирі оновлення між N процесами-воркерами за user_id % N.
+
+    Кожен воркер — той самий скрипт із BOT_ROLE=worker; оновлення пишуться в його
+    stdin рядками JSON. Порядок у трубі зберігається, а drain() дає backpressure:
+    якщо воркер не встигає, прийом (polling або webhook) чекає. Воркер, що впав,
+    перезапускається.
+    """
+
+    def __init__(self, command, workers, env=None):
+        self.command = command
+        self.workers = workers
+        self.env = env or {}
+        self.processes = [None] * workers
+        self.routed = Counter()
+        self.restarts = 0
+        self._stopping = False
+        self._lock = asyncio.Lock()
+
+    async def _spawn(self, index):
+        env = {**os.environ, **self.env, "BOT_ROLE": "worker", "WORKER_INDEX": str(index), "WORKERS": str(self.workers)}
+        self.processes[index] = await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.PIPE, env=env)
+        logging.info(f"Воркер #{index} запущен (pid {self.processes[index].pid})")
+
+    async def start(self):
+        for index in range(self.workers): await self._spawn(index)
+
+    async def route(self, raw):
+        index = update_user_id(raw) % self.workers
+        process = self.processes[index]
+        if process.returncode is not None:
+            async with self._lock:
+                if self.processes[index] is process and not self._stopping:
+                    logging.error(f"Воркер #{index} завершился с кодом {process.returncode}, перезапускаю")
+                    self.restarts += 1
+                    await self._spawn(index)
+            process = self.processes[index]
+        process.stdin.write(json.dumps(raw, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+        await process.stdin.drain()
+        self.routed[index] += 1
+
+    async def stop(self, timeout=30):
+        """Закриває stdin воркерів: кожен дообробляє прийняте і завершується сам."""
+        self._stopping = True
+        for process in self.processes:
+            if process and process.returncode is None: process.stdin.close()
+        for index, process in enumerate(self.processes):
+            if process is None: continue
+            try: await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Воркер #{index} не завершился за {timeout} с, останавливаю")
+                process.kill(); await process.wait()
+
+
+async def poll_updates(bot, handle, allowed_updates=None, timeout=30, stop=None):
+    """Long polling без розбору в моделі aiogram: сирі оновлення одразу йдуть у handle(raw)."""
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    offset = 0
+    async with aiohttp.ClientSession() as session:
+        while not (stop and stop.is_set()):
+            params = {"offset": offset, "timeout": timeout}
+            if allowed_updates is not None: params["allowed_updates"] = json.dumps(allowed_updates)
+            try:
+                async with session.post(url, data=params, timeout=aiohttp.ClientTimeout(total=timeout + 10)) as response:
+                    payload = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"getUpdates: {e}"); await asyncio.sleep(1); continue
+            if not payload.get("ok"):
+                logging.error(f"getUpdates: {payload.get('description')}")
+                await asyncio.sleep(payload.get("parameters", {}).get("retry_after", 1)); continue
+            for raw in payload["result"]:
+                await handle(raw)
+                offset = raw["update_id"] + 1
+
+
+async def serve_worker(dp, bot, concurrency=256, index=0):
+    """Сторона воркера: читає оновлення з stdin і обробляє до concurrency одночасно.
+
+    Кожне оновлення — окремий таск; таски стартують у порядку читання і доходять до
+    черги користувача (lanes.py) без жодного await, тож оновлення одного користувача
+    обробляються строго по черзі, а різних — паралельно. Повертається, коли stdin
+    закрито і все прочитане оброблено.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1 << 24)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    # Ctrl+C у терміналі приходить усій групі процесів — воркер зупиняється, коли прийом закриє stdin
+    for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, lambda: None)
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def process(raw):
+        try: await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+        except Exception as e: logging.exception(f"Воркер #{index}: ошибка обработки обновления {raw.get('update_id')}: {e}")
+        finally: slots.release()
+
+    while line := await reader.readline():
+        await slots.acquire()
+        task = asyncio.create_task(process(json.loads(line)))
+        tasks.add(task); task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
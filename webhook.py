@@ -0,0 +1,79 @@
+# webhook.py
+
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram.types import Update
+
+
+class WebhookServer:
+    """Приймає оновлення від Telegram по HTTP і передає їх у dp.feed_update через обмежену чергу.
+
+    Хендлер HTTP тільки перевіряє секрет, розбирає JSON і кладе Update в чергу,
+    обробку роблять workers. Якщо черга повна довше за enqueue_timeout,
+    відповідаємо 503 — Telegram повторить доставку пізніше, це і є backpressure.
+
+    Якщо задано sink, черги і workers немає: сирий JSON оновлення одразу передається
+    в await sink(raw) (так процес прийому розподіляє оновлення між воркерами).
+    """
+
+    def __init__(self, dp, bot, secret_token, path="/webhook", queue_size=1000, workers=32, enqueue_timeout=1.0, sink=None):
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self.sink = sink
+        self.rejected = 0
+        self._worker_tasks = []
+        self._runner = None
+
+    async def handle(self, request):
+        received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not self.secret_token or not hmac.compare_digest(received, self.secret_token):
+            return web.Response(status=401)
+        try:
+            raw = await request.json()
+            if self.sink is None: update = Update.model_validate(raw, context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"Webhook: некорректное обновление: {e}")
+            return web.Response(status=400)
+        if self.sink is not None:
+            await self.sink(raw)
+            return web.Response()
+        try: await asyncio.wait_for(self.queue.put(update), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try: await self.dp.feed_update(self.bot, update)
+            except Exception as e: logging.exception(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally: self.queue.task_done()
+
+    async def start(self, host, port):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        if self.sink is None: self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def set_webhook(self, base_url, **kwargs):
+        await self.bot.set_webhook(url=base_url.rstrip("/") + self.path, secret_token=self.secret_token,
+                                   allowed_updates=self.dp.resolve_used_update_types(), **kwargs)
+
+    async def stop(self, drain_timeout=10):
+        if self._runner: await self._runner.cleanup()
+        # Даємо дообробити те, що вже прийнято в чергу
+        try: await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError: logging.warning(f"Webhook: не дождались обработки {self.queue.qsize()} обновлений")
+        for task in self._worker_tasks: task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)